@@ -0,0 +1,176 @@
+import os
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from heapq import merge
+
+HASH_SIZE = 32
+
+NUMBERS_FILE = "numbers.u64"
+TIMESTAMPS_FILE = "timestamps.u64"
+HASHES_FILE = "hashes.bin"
+
+
+def _read_column(path, typecode):
+    column = array(typecode)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            column.frombytes(f.read())
+    return column
+
+
+def _write_file(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class BlockIndex:
+    """
+    Persistent block number -> (timestamp, hash) index.
+
+    Entries are stored as three parallel columns sorted by block number:
+    numbers.u64 and timestamps.u64 (array('Q')) and hashes.bin (32 bytes per
+    block). Blocks are fetched from the node only the first time they are needed,
+    through `batch` (a BatchRPC) when one is given.
+    """
+
+    def __init__(self, w3, path, save_every=1000, batch=None):
+        self.w3 = w3
+        self.batch = batch
+        self.path = path
+        self.save_every = save_every
+        os.makedirs(path, exist_ok=True)
+
+        self._numbers = _read_column(os.path.join(path, NUMBERS_FILE), "Q")
+        self._timestamps = _read_column(os.path.join(path, TIMESTAMPS_FILE), "Q")
+        self._hashes = bytearray()
+        if os.path.exists(os.path.join(path, HASHES_FILE)):
+            with open(os.path.join(path, HASHES_FILE), "rb") as f:
+                self._hashes = bytearray(f.read())
+
+        if not (len(self._numbers) == len(self._timestamps) == len(self._hashes) // HASH_SIZE):
+            raise ValueError(f"Block index at {path} is corrupted (column lengths differ)")
+
+        # Entries fetched since the last merge: number -> (timestamp, hash)
+        self._pending = {}
+        self._unsaved = 0
+
+    def __len__(self):
+        return len(self._numbers) + len(self._pending)
+
+    def __contains__(self, number):
+        return self.get(number) is not None
+
+    def get(self, number):
+        """(timestamp, hash) of a block if it is in the index, without any RPC"""
+        if number in self._pending:
+            return self._pending[number]
+        i = bisect_left(self._numbers, number)
+        if i < len(self._numbers) and self._numbers[i] == number:
+            return self._timestamps[i], bytes(self._hashes[i * HASH_SIZE:(i + 1) * HASH_SIZE])
+        return None
+
+    def add(self, number, timestamp, block_hash):
+        self._pending[number] = (timestamp, bytes(block_hash))
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def fetch(self, number):
+        block = self.w3.eth.get_block(number)
+        self.add(block["number"], block["timestamp"], block["hash"])
+        return self._pending[block["number"]]
+
+    def ensure(self, numbers):
+        """Make sure every block in `numbers` is indexed, fetching only the missing ones"""
+        missing = sorted(n for n in set(numbers) if self.get(n) is None)
+        if self.batch is None:
+            for number in missing:
+                self.fetch(number)
+            return len(missing)
+
+        for number, block in self.batch.get_blocks(missing).items():
+            self.add(number, block["timestamp"], block["hash"])
+        return len(missing)
+
+    def timestamp(self, number):
+        entry = self.get(number)
+        if entry is None:
+            entry = self.fetch(number)
+        return entry[0]
+
+    def block_hash(self, number):
+        entry = self.get(number)
+        if entry is None:
+            entry = self.fetch(number)
+        return entry[1]
+
+    def _merge(self):
+        if not self._pending:
+            return
+        pending = sorted(self._pending.items())
+        current = (
+            (self._numbers[i], (self._timestamps[i], bytes(self._hashes[i * HASH_SIZE:(i + 1) * HASH_SIZE])))
+            for i in range(len(self._numbers))
+        )
+
+        numbers = array("Q")
+        timestamps = array("Q")
+        hashes = bytearray()
+        last = None
+        for number, (timestamp, block_hash) in merge(pending, current, key=lambda x: x[0]):
+            if number == last:
+                continue
+            numbers.append(number)
+            timestamps.append(timestamp)
+            hashes += block_hash
+            last = number
+
+        self._numbers, self._timestamps, self._hashes = numbers, timestamps, hashes
+        self._pending = {}
+
+    def save(self):
+        self._merge()
+        _write_file(os.path.join(self.path, NUMBERS_FILE), self._numbers.tobytes())
+        _write_file(os.path.join(self.path, TIMESTAMPS_FILE), self._timestamps.tobytes())
+        _write_file(os.path.join(self.path, HASHES_FILE), bytes(self._hashes))
+        self._unsaved = 0
+
+    def block_at(self, when):
+        """
+        First block whose timestamp is at or after `when` (datetime or unix timestamp).
+
+        Binary search over block numbers; indexed blocks narrow the search bounds
+        first and every block looked at on the way is added to the index.
+        """
+        target = int(when.timestamp()) if isinstance(when, datetime) else int(when)
+
+        self._merge()
+        i = bisect_left(self._timestamps, target)
+        lo = self._numbers[i - 1] if i > 0 else 0
+        if i < len(self._numbers):
+            hi = self._numbers[i]
+        else:
+            hi = self.w3.eth.get_block("latest")["number"]
+            if self.timestamp(hi) < target:
+                raise ValueError(f"{when} is after the latest block {hi}")
+
+        if self.timestamp(lo) >= target:
+            return lo
+
+        # Invariant: timestamp(lo) < target <= timestamp(hi)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.timestamp(mid) < target:
+                lo = mid
+            else:
+                hi = mid
+        return hi
+
+    def block_before(self, when):
+        """Last block whose timestamp is before `when`"""
+        return self.block_at(when) - 1
@@ -0,0 +1,147 @@
+import os
+import json
+from collections import deque
+
+# (number, hash) entries kept: the last block of each processed range and every block with a log
+DEFAULT_DEPTH = 128
+
+
+def _hex(value):
+    if value is None or isinstance(value, str):
+        return value
+    return "0x" + bytes(value).hex()
+
+
+class Reorg(Exception):
+    """The chain no longer contains the checkpointed block `number`"""
+
+    def __init__(self, number, expected, found):
+        self.number = number
+        super().__init__(f"reorg at block {number}: expected {expected}, found {found}")
+
+
+class Checkpoint:
+    """
+    Progress of a block-following process: the (number, hash) of the last
+    block of each processed range and of every block whose logs were reported,
+    the newest `depth` of them in a ring buffer persisted to a JSON file.
+
+    Every save writes a temporary file, fsyncs it and renames it over the old
+    one, so a crash leaves either the old or the new checkpoint. A new range is
+    only accepted (verify()) if its first block's parentHash is the hash of the
+    last checkpointed block; otherwise fork_point() walks the buffer back to the
+    newest block that is still on the chain and rollback() drops the rest, so
+    the caller can process the blocks after it again. Every reported block after
+    the fork point is orphaned, so only events of replaced blocks are reported
+    again, not the whole range they were read in.
+    """
+
+    def __init__(self, path, depth=DEFAULT_DEPTH):
+        self.path = path
+        self.blocks = deque(maxlen=depth)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for number, block_hash in json.load(f)["blocks"]:
+                    self.blocks.append((number, block_hash))
+
+    def __len__(self):
+        return len(self.blocks)
+
+    @property
+    def last_block(self):
+        """Number of the last processed block, None before the first one"""
+        return self.blocks[-1][0] if self.blocks else None
+
+    @property
+    def last_hash(self):
+        return self.blocks[-1][1] if self.blocks else None
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"blocks": list(self.blocks)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # The rename itself is only durable once the directory is synced
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def start(self, number, block_hash=None):
+        """Start from block `number` (already processed) when there is no checkpoint yet; hash None skips the first parent check"""
+        self.blocks.clear()
+        self.blocks.append((number, _hex(block_hash)))
+        self.save()
+
+    def verify(self, block):
+        """Raise Reorg unless `block` (a block dict) is the child of the last checkpointed block"""
+        if not self.blocks or self.last_hash is None:
+            return
+        number, block_hash = self.blocks[-1]
+        if block["number"] != number + 1:
+            raise ValueError(f"block {block['number']} does not follow checkpoint {number}")
+        if _hex(block["parentHash"]) != block_hash:
+            raise Reorg(number, block_hash, _hex(block["parentHash"]))
+
+    def check_range(self, get_blocks, from_block, to_block, logs):
+        """
+        Headers {number: block} of from_block, to_block and every block with a log, read with
+        `get_blocks(numbers)` (BatchRPC.get_blocks). Raises Reorg if the range does not extend
+        the checkpoint; None if the node is behind or the logs are not all from that chain.
+        """
+        blocks = get_blocks({from_block, to_block} | {log["blockNumber"] for log in logs})
+        if any(block is None for block in blocks.values()):
+            print("node is behind the head it reported, retrying")
+            return None
+        self.verify(blocks[from_block])
+        if any(_hex(log["blockHash"]) != _hex(blocks[log["blockNumber"]]["hash"]) for log in logs):
+            print("chain changed while reading the range, retrying")
+            return None
+        return blocks
+
+    def record(self, block, log_blocks=()):
+        """
+        Mark everything up to `block` (a block dict with number and hash) as processed and save;
+        `log_blocks` are the blocks of the range whose logs were reported.
+        """
+        for number, log_block in sorted({b["number"]: b for b in log_blocks}.items()):
+            if number < block["number"]:
+                self.blocks.append((number, _hex(log_block["hash"])))
+        self.blocks.append((block["number"], _hex(block["hash"])))
+        self.save()
+
+    def fork_point(self, get_blocks):
+        """
+        Newest checkpointed block still on the chain, as (number, hash).
+
+        `get_blocks(numbers)` returns {number: block} (BatchRPC.get_blocks), so
+        the whole buffer is checked with one batch. If no entry matches, the
+        reorg is deeper than the buffer and the oldest entry is returned without
+        its hash.
+        """
+        canonical = get_blocks([number for number, _ in self.blocks])
+        for number, block_hash in reversed(self.blocks):
+            block = canonical.get(number)
+            if block is not None and _hex(block["hash"]) == block_hash:
+                return number, block_hash
+        return self.blocks[0][0], None
+
+    def rewind(self, get_blocks):
+        """After a Reorg: roll back to the fork point and return its number; blocks after it are processed again"""
+        number, block_hash = self.fork_point(get_blocks)
+        self.rollback(number, block_hash)
+        return number
+
+    def rollback(self, number, block_hash):
+        """Forget the blocks after `number`; they are processed again from number + 1"""
+        while self.blocks and self.blocks[-1][0] > number:
+            self.blocks.pop()
+        if not self.blocks or self.blocks[-1][0] != number:
+            self.blocks.append((number, block_hash))
+        elif block_hash is None:
+            self.blocks[-1] = (number, None)
+        self.save()
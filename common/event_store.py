@@ -0,0 +1,177 @@
+import os
+import sqlite3
+
+from hexbytes import HexBytes
+
+from common.log_fetcher import fetch_logs, RangePlanner
+
+DEFAULT_EVENT_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "events.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    chain_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    block_hash BLOB NOT NULL,
+    tx_hash BLOB NOT NULL,
+    tx_index INTEGER NOT NULL,
+    topic0 BLOB,
+    topics BLOB NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (chain_id, address, block_number, log_index)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS logs_by_topic0 ON logs (chain_id, address, topic0, block_number);
+
+CREATE TABLE IF NOT EXISTS synced_ranges (
+    chain_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    from_block INTEGER NOT NULL,
+    to_block INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, address, from_block)
+);
+"""
+
+
+def merge_ranges(ranges):
+    """Merge overlapping or adjacent (from, to) block ranges"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_ranges(from_block, to_block, ranges):
+    """Parts of from_block ~ to_block not covered by `ranges`"""
+    gaps = []
+    start = from_block
+    for synced_start, synced_end in merge_ranges(ranges):
+        if synced_end < start:
+            continue
+        if synced_start > to_block:
+            break
+        if synced_start > start:
+            gaps.append((start, synced_start - 1))
+        start = max(start, synced_end + 1)
+    if start <= to_block:
+        gaps.append((start, to_block))
+    return gaps
+
+
+class EventStore:
+    """
+    Local SQLite store of raw contract logs.
+
+    Logs are keyed by (chain_id, address, blockNumber, logIndex). Every contract
+    also has a list of block ranges that have been fully synced, so a sync only
+    needs to fetch blocks that are not covered yet. All logs of a contract are
+    stored, whatever their topic; readers filter by topic0.
+    """
+
+    def __init__(self, path=DEFAULT_EVENT_STORE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add_logs(self, chain_id, address, logs, from_block, to_block):
+        """Store the logs of one fetched range and mark the range synced, in one transaction"""
+        rows = [
+            (
+                chain_id,
+                address,
+                log["blockNumber"],
+                log["logIndex"],
+                bytes(log["blockHash"]),
+                bytes(log["transactionHash"]),
+                log["transactionIndex"],
+                bytes(log["topics"][0]) if log["topics"] else None,
+                b"".join(bytes(topic) for topic in log["topics"]),
+                bytes(log["data"]),
+            )
+            for log in logs
+        ]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO logs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._mark_synced(chain_id, address, from_block, to_block)
+
+    def _mark_synced(self, chain_id, address, from_block, to_block):
+        ranges = merge_ranges(self.synced_ranges(chain_id, address) + [(from_block, to_block)])
+        self.conn.execute("DELETE FROM synced_ranges WHERE chain_id = ? AND address = ?", (chain_id, address))
+        self.conn.executemany(
+            "INSERT INTO synced_ranges VALUES (?, ?, ?, ?)",
+            [(chain_id, address, start, end) for start, end in ranges],
+        )
+
+    def synced_ranges(self, chain_id, address):
+        cursor = self.conn.execute(
+            "SELECT from_block, to_block FROM synced_ranges WHERE chain_id = ? AND address = ? ORDER BY from_block",
+            (chain_id, address),
+        )
+        return [(start, end) for start, end in cursor]
+
+    def last_synced_block(self, chain_id, address):
+        ranges = self.synced_ranges(chain_id, address)
+        return ranges[-1][1] if ranges else None
+
+    def missing_ranges(self, chain_id, address, from_block, to_block):
+        return subtract_ranges(from_block, to_block, self.synced_ranges(chain_id, address))
+
+    def count_logs(self, chain_id, address):
+        cursor = self.conn.execute("SELECT COUNT(*) FROM logs WHERE chain_id = ? AND address = ?", (chain_id, address))
+        return cursor.fetchone()[0]
+
+    def iter_logs(self, chain_id, address, from_block=0, to_block=None, topic0s=None):
+        """Stored logs in (blockNumber, logIndex) order, shaped like the logs returned by w3.eth.get_logs"""
+        query = "SELECT block_number, log_index, block_hash, tx_hash, tx_index, topics, data FROM logs WHERE chain_id = ? AND address = ? AND block_number >= ?"
+        params = [chain_id, address, from_block]
+        if to_block is not None:
+            query += " AND block_number <= ?"
+            params.append(to_block)
+        if topic0s is not None:
+            topic0s = [bytes(HexBytes(topic)) for topic in topic0s]
+            query += f" AND topic0 IN ({', '.join('?' * len(topic0s))})"
+            params += topic0s
+        query += " ORDER BY block_number, log_index"
+
+        for block_number, log_index, block_hash, tx_hash, tx_index, topics, data in self.conn.execute(query, params):
+            yield {
+                "address": address,
+                "blockNumber": block_number,
+                "logIndex": log_index,
+                "blockHash": HexBytes(block_hash),
+                "transactionHash": HexBytes(tx_hash),
+                "transactionIndex": tx_index,
+                "topics": [HexBytes(topics[i:i + 32]) for i in range(0, len(topics), 32)],
+                "data": HexBytes(data),
+                "removed": False,
+            }
+
+
+def sync(w3, store, address, start_block, to_block, chunk_size, max_in_flight=1, chain_id=None):
+    """
+    Fetch and store all logs of `address` in start_block ~ to_block that are not synced yet.
+
+    Returns the RangePlanner of the run so callers can report missing ranges.
+    """
+    if chain_id is None:
+        chain_id = w3.eth.chain_id
+
+    planner = RangePlanner(chunk_size)
+    for gap_start, gap_end in store.missing_ranges(chain_id, address, start_block, to_block):
+        print(f"🔄 {address}: syncing blocks {gap_start} ~ {gap_end}")
+        for chunk in fetch_logs(w3, {"address": address}, gap_start, gap_end, chunk_size, max_in_flight, planner):
+            if chunk.error is not None:
+                print(f"   ❌ blocks {chunk.start} ~ {chunk.end} failed: {chunk.error}")
+                continue
+            store.add_logs(chain_id, address, chunk.logs, chunk.start, chunk.end)
+            if chunk.logs:
+                print(f"   ✅ blocks {chunk.start} ~ {chunk.end}: {len(chunk.logs)} logs")
+    return planner
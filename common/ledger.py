@@ -0,0 +1,139 @@
+from array import array
+from bisect import bisect_right
+
+from common.log_decoder import LogDecoder
+
+# DepositManager events that change the principal of a (layer2, depositor) pair
+PRINCIPAL_EVENTS = {
+    "Deposited": 1,
+    "WithdrawalRequested": -1,
+}
+
+# Blocks between full-state checkpoints (~2 weeks of mainnet blocks)
+CHECKPOINT_EVERY = 100000
+
+
+class StakeLedger:
+    """
+    Principal per (layer2, depositor), replayed from DepositManager events.
+
+    Principal is the sum of Deposited minus WithdrawalRequested amounts (WTON,
+    27 decimals); seigniorage is not in the events and is not included.
+
+    Every pair gets an account id with its own sorted history of (block,
+    principal after the change), so principal_at() is one binary search. For
+    whole-state queries a copy of all principals is kept every
+    `checkpoint_every` blocks, and state_at() replays only the events after
+    the nearest checkpoint.
+    """
+
+    def __init__(self, checkpoint_every=CHECKPOINT_EVERY):
+        self.checkpoint_every = checkpoint_every
+
+        self.accounts = {}  # (layer2, depositor) -> account id
+        self.keys = []  # account id -> (layer2, depositor)
+        self.principal = []  # account id -> current principal
+        self.history_blocks = []  # account id -> array('Q') of blocks where principal changed
+        self.history_principal = []  # account id -> principal after each change
+
+        # Event log in replay order
+        self.event_blocks = array('Q')
+        self.event_accounts = array('L')
+        self.event_deltas = []
+
+        # checkpoint_blocks[i]: block whose events are all in checkpoints[i] = (events applied, principals)
+        self.checkpoint_blocks = []
+        self.checkpoints = []
+
+        self.event_counts = {name: 0 for name in PRINCIPAL_EVENTS}
+        self.last_block = None
+
+    def __len__(self):
+        return len(self.event_deltas)
+
+    def account_id(self, layer2, depositor):
+        key = (layer2, depositor)
+        account = self.accounts.get(key)
+        if account is None:
+            account = len(self.keys)
+            self.accounts[key] = account
+            self.keys.append(key)
+            self.principal.append(0)
+            self.history_blocks.append(array('Q'))
+            self.history_principal.append([])
+        return account
+
+    def _checkpoint(self):
+        self.checkpoint_blocks.append(self.last_block)
+        self.checkpoints.append((len(self.event_deltas), list(self.principal)))
+
+    def apply(self, event):
+        """Apply one decoded DepositManager event (LogDecoder.decode output); events must come in block order"""
+        sign = PRINCIPAL_EVENTS.get(event["event"])
+        if sign is None:
+            return
+        block_number = event["blockNumber"]
+        if self.last_block is not None:
+            if block_number < self.last_block:
+                raise ValueError(f"Events out of order: block {block_number} after {self.last_block}")
+            last_checkpoint = self.checkpoint_blocks[-1] if self.checkpoint_blocks else 0
+            if block_number > self.last_block and block_number - last_checkpoint >= self.checkpoint_every:
+                self._checkpoint()
+
+        args = event["args"]
+        account = self.account_id(args["layer2"], args["depositor"])
+        delta = sign * args["amount"]
+        self.principal[account] += delta
+
+        history_blocks = self.history_blocks[account]
+        if history_blocks and history_blocks[-1] == block_number:
+            self.history_principal[account][-1] = self.principal[account]
+        else:
+            history_blocks.append(block_number)
+            self.history_principal[account].append(self.principal[account])
+
+        self.event_blocks.append(block_number)
+        self.event_accounts.append(account)
+        self.event_deltas.append(delta)
+        self.event_counts[event["event"]] += 1
+        self.last_block = block_number
+
+    def principal_at(self, layer2, depositor, block_number):
+        """Principal of a pair after all events up to and including block_number"""
+        account = self.accounts.get((layer2, depositor))
+        if account is None:
+            return 0
+        i = bisect_right(self.history_blocks[account], block_number)
+        return self.history_principal[account][i - 1] if i else 0
+
+    def state_at(self, block_number):
+        """{(layer2, depositor): principal} after all events up to and including block_number"""
+        i = bisect_right(self.checkpoint_blocks, block_number)
+        if i:
+            start, principal = self.checkpoints[i - 1]
+            principal = principal + [0] * (len(self.keys) - len(principal))
+        else:
+            start, principal = 0, [0] * len(self.keys)
+
+        end = bisect_right(self.event_blocks, block_number, lo=start)
+        for position in range(start, end):
+            principal[self.event_accounts[position]] += self.event_deltas[position]
+
+        return {self.keys[account]: amount for account, amount in enumerate(principal) if amount}
+
+    def stakers_at(self, block_number):
+        """{depositor: principal summed over all layer2s} of depositors with a non-zero principal"""
+        totals = {}
+        for (_, depositor), amount in self.state_at(block_number).items():
+            totals[depositor] = totals.get(depositor, 0) + amount
+        return {depositor: amount for depositor, amount in totals.items() if amount}
+
+
+def replay(store, chain_id, address, abi, to_block=None, ledger=None):
+    """StakeLedger of the DepositManager at `address` from the logs in an EventStore, no RPC needed"""
+    decoder = LogDecoder(abi, PRINCIPAL_EVENTS.keys())
+    if ledger is None:
+        ledger = StakeLedger()
+    for log in store.iter_logs(chain_id, address, 0, to_block, topic0s=decoder.topics()):
+        ledger.apply(decoder.decode(log))
+    return ledger
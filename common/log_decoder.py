@@ -0,0 +1,127 @@
+import re
+
+try:
+    from eth_abi import decode as abi_decode
+except ImportError:  # eth_abi < 4, installed with web3 v5
+    from eth_abi import decode_abi as abi_decode
+from eth_utils import event_abi_to_log_topic, to_checksum_address
+
+STATIC_TYPE = re.compile(r"^(address|bool|u?int\d*|bytes([1-9]|[12]\d|3[0-2]))$")
+
+# Checksumming hashes the address, so every address is checksummed only once per process
+_checksum_cache = {}
+
+
+def checksum(word):
+    """Checksum address from a 32-byte ABI word (or a 20-byte address)"""
+    raw = bytes(word[-20:])
+    address = _checksum_cache.get(raw)
+    if address is None:
+        address = to_checksum_address(raw)
+        _checksum_cache[raw] = address
+    return address
+
+
+def _word_decoder(abi_type):
+    if abi_type == "address":
+        return checksum
+    if abi_type == "bool":
+        return lambda word: word[31] != 0
+    if abi_type.startswith("uint"):
+        return lambda word: int.from_bytes(word, "big")
+    if abi_type.startswith("int"):
+        return lambda word: int.from_bytes(word, "big", signed=True)
+    size = int(abi_type[5:])
+    return lambda word: bytes(word[:size])
+
+
+def _normalize(abi_type, value):
+    """eth_abi value as process_log returns it: addresses checksummed, arrays as lists"""
+    if abi_type.endswith("]"):
+        item_type = abi_type[:abi_type.rindex("[")]
+        return [_normalize(item_type, item) for item in value]
+    if abi_type == "address":
+        return checksum(bytes.fromhex(value[2:]))
+    return value
+
+
+class EventDecoder:
+    """Decoder of one event, precompiled from its ABI entry"""
+
+    def __init__(self, event_abi):
+        self.name = event_abi["name"]
+        self.topic = event_abi_to_log_topic(event_abi)
+        self.indexed = [(i["name"], i["type"]) for i in event_abi["inputs"] if i.get("indexed")]
+        self.non_indexed = [(i["name"], i["type"]) for i in event_abi["inputs"] if not i.get("indexed")]
+
+        # Fast path: every field is one 32-byte word, decoded by slicing topics and data
+        self.is_static = all(STATIC_TYPE.match(t) for _, t in self.indexed + self.non_indexed)
+        if self.is_static:
+            self.indexed_decoders = [(name, _word_decoder(t)) for name, t in self.indexed]
+            self.data_decoders = [(name, _word_decoder(t), i * 32) for i, (name, t) in enumerate(self.non_indexed)]
+        self.data_types = [t for _, t in self.non_indexed]
+
+    def decode_args(self, topics, data):
+        data = bytes(data)
+        args = {}
+        if self.is_static:
+            for (name, decoder), topic in zip(self.indexed_decoders, topics[1:]):
+                args[name] = decoder(topic)
+            for name, decoder, offset in self.data_decoders:
+                args[name] = decoder(data[offset:offset + 32])
+            return args
+
+        for (name, abi_type), topic in zip(self.indexed, topics[1:]):
+            # Dynamic indexed values are stored as their keccak hash
+            args[name] = _word_decoder(abi_type)(bytes(topic)) if STATIC_TYPE.match(abi_type) else bytes(topic)
+        for (name, abi_type), value in zip(self.non_indexed, abi_decode(self.data_types, data)):
+            args[name] = _normalize(abi_type, value)
+        return args
+
+
+class LogDecoder:
+    """
+    topic0 -> EventDecoder table built once from a contract ABI.
+
+    decode() returns the same fields as web3's process_log (event, args, address,
+    blockNumber, logIndex, transactionHash, ...) as a plain dict, or None for logs
+    whose topic0 is not one of the events.
+    """
+
+    def __init__(self, abi, event_names=None):
+        self.decoders = {}
+        for entry in abi:
+            if entry.get("type") != "event" or entry.get("anonymous"):
+                continue
+            if event_names is not None and entry["name"] not in event_names:
+                continue
+            decoder = EventDecoder(entry)
+            self.decoders[decoder.topic] = decoder
+
+    def topic(self, event_name):
+        for topic, decoder in self.decoders.items():
+            if decoder.name == event_name:
+                return topic
+        raise KeyError(event_name)
+
+    def topics(self):
+        """topic0 of every event, as 0x-prefixed hex for eth_getLogs filters"""
+        return ["0x" + topic.hex() for topic in self.decoders]
+
+    def decode(self, log):
+        topics = log["topics"]
+        if not topics:
+            return None
+        decoder = self.decoders.get(bytes(topics[0]))
+        if decoder is None:
+            return None
+        return {
+            "event": decoder.name,
+            "args": decoder.decode_args(topics, log["data"]),
+            "address": log["address"],
+            "blockNumber": log["blockNumber"],
+            "blockHash": log.get("blockHash"),
+            "logIndex": log["logIndex"],
+            "transactionIndex": log.get("transactionIndex"),
+            "transactionHash": log["transactionHash"],
+        }
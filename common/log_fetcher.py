@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# One fetched block range. `logs` is None and `error` is set when the range could not be read.
+ChunkResult = namedtuple("ChunkResult", ["start", "end", "logs", "error"])
+
+# Provider errors meaning "this block range is too expensive", answered by splitting the range
+RANGE_ERROR_HINTS = (
+    "more than",
+    "too many results",
+    "query returned",
+    "block range",
+    "range is too large",
+    "limit exceeded",
+    "response size",
+    "response is too big",
+    "timeout",
+    "timed out",
+)
+
+# Provider errors that go away by waiting, answered by retrying the same range
+TRANSIENT_ERROR_HINTS = (
+    "rate limit",
+    "too many requests",
+    "capacity",
+    "temporarily",
+    "try again",
+    "header not found",
+)
+
+
+def log_sort_key(log):
+    return (log["blockNumber"], log["logIndex"])
+
+
+def is_transient_error(e):
+    if isinstance(e, requests.exceptions.ConnectionError) and not isinstance(e, requests.exceptions.Timeout):
+        return True
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    message = str(e).lower()
+    return any(hint in message for hint in TRANSIENT_ERROR_HINTS)
+
+
+def is_range_error(e):
+    if isinstance(e, requests.exceptions.Timeout):
+        return True
+    if is_transient_error(e):
+        return False
+    message = str(e).lower()
+    return any(hint in message for hint in RANGE_ERROR_HINTS)
+
+
+class RangeTooLarge(Exception):
+    pass
+
+
+class RangePlanner:
+    """
+    Chooses the block span of each eth_getLogs call.
+
+    The span is halved when the provider rejects a range as too large (result limit
+    or timeout) and doubled after calls that return fewer than target_logs / 2 logs,
+    up to max_span. Transient errors are retried with exponential backoff. Ranges
+    that cannot be read at min_span or after max_retries are kept in `missing`.
+    """
+
+    def __init__(self, span, min_span=1, max_span=None, target_logs=2000, max_retries=5, backoff=1.0):
+        self.span = span
+        self.min_span = min_span
+        self.max_span = max_span or span * 8
+        self.target_logs = target_logs
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.missing = []
+        self.calls = 0
+        self.retries = 0
+        self.splits = 0
+        self._lock = threading.Lock()
+
+    def shrink(self, span):
+        with self._lock:
+            self.splits += 1
+            self.span = max(self.min_span, span // 2)
+            return self.span
+
+    def grow(self, span, n_logs):
+        with self._lock:
+            if n_logs < self.target_logs // 2:
+                self.span = min(self.max_span, max(self.span, span * 2))
+            return self.span
+
+    def add_missing(self, start, end, error):
+        with self._lock:
+            self.missing.append((start, end, str(error)))
+
+    def get_logs(self, w3, filter_params, from_block, to_block):
+        """eth_getLogs for one range, retrying transient errors with backoff"""
+        params = dict(filter_params)
+        params["fromBlock"] = from_block
+        params["toBlock"] = to_block
+
+        attempt = 0
+        while True:
+            with self._lock:
+                self.calls += 1
+            try:
+                return sorted(w3.eth.get_logs(params), key=log_sort_key)
+            except Exception as e:
+                if is_range_error(e):
+                    raise RangeTooLarge(str(e)) from e
+                attempt += 1
+                if not is_transient_error(e) or attempt > self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def print_report(self):
+        print(f"📡 eth_getLogs calls: {self.calls} (retries: {self.retries}, splits: {self.splits})")
+        if not self.missing:
+            print("✅ All block ranges fetched, no missing ranges")
+            return
+        print(f"⚠️ {len(self.missing)} block ranges could not be fetched, results are INCOMPLETE:")
+        for start, end, error in self.missing:
+            print(f"   - {start} ~ {end}: {error}")
+
+
+def fetch_range(w3, filter_params, from_block, to_block, planner):
+    """Walk from_block ~ to_block with adaptive spans, yielding a ChunkResult per eth_getLogs call"""
+    start = from_block
+    span = planner.span
+    while start <= to_block:
+        end = min(start + span - 1, to_block)
+        try:
+            logs = planner.get_logs(w3, filter_params, start, end)
+        except RangeTooLarge as e:
+            if end - start + 1 > planner.min_span:
+                span = planner.shrink(end - start + 1)
+                continue
+            error = e
+        except Exception as e:
+            error = e
+        else:
+            span = planner.grow(end - start + 1, len(logs))
+            yield ChunkResult(start, end, logs, None)
+            start = end + 1
+            continue
+
+        planner.add_missing(start, end, error)
+        yield ChunkResult(start, end, None, error)
+        start = end + 1
+
+
+def fetch_logs(w3, filter_params, from_block, to_block, chunk_size, max_in_flight=1, planner=None):
+    """
+    Fetch logs for from_block ~ to_block, starting with ranges of chunk_size blocks.
+
+    Up to max_in_flight ranges are requested at the same time, but results are
+    yielded strictly in block order and the logs of each range are sorted by
+    (blockNumber, logIndex), so callers see the same stream as a sequential scan.
+    Pass a RangePlanner to read back the missing ranges after the scan.
+    """
+    if planner is None:
+        planner = RangePlanner(chunk_size)
+
+    if max_in_flight <= 1:
+        yield from fetch_range(w3, filter_params, from_block, to_block, planner)
+        return
+
+    def fetch_window(start, end):
+        return list(fetch_range(w3, filter_params, start, end, planner))
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        pending = deque()
+        start = from_block
+        while start <= to_block or pending:
+            while start <= to_block and len(pending) < max_in_flight:
+                end = min(start + planner.span - 1, to_block)
+                pending.append(executor.submit(fetch_window, start, end))
+                start = end + 1
+
+            yield from pending.popleft().result()
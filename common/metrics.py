@@ -0,0 +1,181 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the RPC latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    """
+    One metric family in the Prometheus text format.
+
+    Values are kept per tuple of label values. A metric made with `collect`
+    has no stored values; collect() returns {label values: value} (or a single
+    number without labels) when the metrics are scraped.
+    """
+
+    def __init__(self, name, kind, help_text, labels=(), collect=None):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def samples(self):
+        if self.collect is None:
+            with self.lock:
+                return dict(self.values)
+        values = self.collect()
+        return values if isinstance(values, dict) else {(): values}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, value in sorted(self.samples().items()):
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram(Metric):
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, "histogram", help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                # per-bucket counts (not cumulative), then +Inf, sum
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        names = self.labels + ("le",)
+        for label_values, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, label_values + (bound,))} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """
+    Registry of metrics, served in the Prometheus text format by serve().
+
+    Has the RPC metrics built in: rpc_requests_total, rpc_errors_total and
+    rpc_request_duration_seconds per JSON-RPC method, fed by rpc_middleware()
+    for web3 calls and by observe_batch() for BatchRPC requests.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.rpc_requests = self.counter("rpc_requests_total", "JSON-RPC calls sent", ["method"])
+        self.rpc_errors = self.counter("rpc_errors_total", "JSON-RPC calls that failed", ["method"])
+        self.rpc_latency = self.histogram("rpc_request_duration_seconds", "JSON-RPC request latency (a whole batch for batched calls)", ["method"])
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=(), collect=None):
+        return self.add(Metric(name, "counter", help_text, labels, collect))
+
+    def gauge(self, name, help_text, labels=(), collect=None):
+        return self.add(Metric(name, "gauge", help_text, labels, collect))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines += metric.render()
+            except Exception as e:
+                lines.append(f"# {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+    def observe_rpc(self, methods, seconds, error=None):
+        counts = {}
+        for method in methods:
+            counts[method] = counts.get(method, 0) + 1
+        for method, count in counts.items():
+            self.rpc_requests.inc(method, amount=count)
+            self.rpc_latency.observe(seconds, method)
+            if error is not None:
+                self.rpc_errors.inc(method, amount=count)
+
+    def observe_batch(self, methods, seconds, response_bytes, error):
+        """BatchRPC observer: append to batch.observers"""
+        self.observe_rpc(methods, seconds, error)
+
+    def rpc_middleware(self, make_request, w3):
+        """web3 middleware: w3.middleware_onion.add(metrics.rpc_middleware, "metrics")"""
+        def middleware(method, params):
+            started = time.perf_counter()
+            try:
+                response = make_request(method, params)
+            except Exception as e:
+                self.observe_rpc([method], time.perf_counter() - started, e)
+                raise
+            self.observe_rpc([method], time.perf_counter() - started, response.get("error"))
+            return response
+        return middleware
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve GET /metrics from a daemon thread; returns the server"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        print(f"metrics: http://{host}:{server.server_port}/metrics")
+        return server
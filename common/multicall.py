@@ -0,0 +1,138 @@
+from web3.exceptions import ContractLogicError
+
+from common.rpc_batch import decode_function_output, to_block_param
+
+# Multicall3 has the same address on every chain it is deployed to
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+# Ethereum mainnet deployment block; eth_calls pinned before it fall back to plain batched calls
+MULTICALL3_DEPLOY_BLOCK = 14353601
+
+# aggregate3((address target, bool allowFailure, bytes callData)[]) returns ((bool success, bytes returnData)[])
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")
+
+# Calls packed into one aggregate3 eth_call, kept well below the providers' eth_call gas caps
+MULTICALL_CHUNK_SIZE = 300
+
+
+class MulticallError(Exception):
+    pass
+
+
+def encode_aggregate3(w3, calls):
+    """calldata of aggregate3 for (target, calldata) pairs, every call allowed to fail on its own"""
+    return AGGREGATE3_SELECTOR + w3.codec.encode(
+        ["(address,bool,bytes)[]"],
+        [[(target, True, bytes(data)) for target, data in calls]],
+    )
+
+
+def decode_aggregate3(w3, data):
+    """[(success, returnData), ...] from the return data of aggregate3"""
+    return w3.codec.decode(["(bool,bytes)[]"], bytes(data))[0]
+
+
+def _calldata(function):
+    return bytes.fromhex(function._encode_transaction_data()[2:])
+
+
+def _aggregate_transactions(w3, chunks):
+    return [
+        {"to": MULTICALL3_ADDRESS, "data": "0x" + encode_aggregate3(w3, [(fn.address, _calldata(fn)) for fn in chunk]).hex()}
+        for chunk in chunks
+    ]
+
+
+def _decode_chunks(w3, chunks, responses):
+    """Decoded results of aggregate3 responses, with None for failed calls, and the indexes of those"""
+    results = []
+    failed = []
+    for chunk, response in zip(chunks, responses):
+        for fn, (success, data) in zip(chunk, decode_aggregate3(w3, response)):
+            if success:
+                results.append(decode_function_output(w3, fn, data))
+            else:
+                failed.append(len(results))
+                results.append(None)
+    return results, failed
+
+
+def _plain_calls(functions, block_identifier, batch):
+    """Results of one eth_call per function, with None for reverted calls, and the indexes of those"""
+    if batch is None:
+        values = []
+        for fn in functions:
+            try:
+                values.append(fn.call(block_identifier=block_identifier))
+            except ContractLogicError as e:
+                values.append(e)
+    else:
+        values = batch.call(functions, block_identifier, raise_errors=False)
+    failed = [i for i, value in enumerate(values) if isinstance(value, Exception)]
+    return [None if isinstance(value, Exception) else value for value in values], failed
+
+
+def multicall(w3, functions, block_identifier="latest", batch=None, chunk_size=MULTICALL_CHUNK_SIZE, allow_failure=False):
+    """
+    eth_call many contract functions (e.g. instance.functions.stakeOf(account)) at one block.
+
+    The calls are packed into Multicall3.aggregate3 calls of chunk_size each and the
+    packed results are decoded locally. With a BatchRPC all aggregate calls go out
+    in JSON-RPC batches. Failed calls raise MulticallError, or give None when
+    allow_failure is set.
+    """
+    functions = list(functions)
+    if isinstance(block_identifier, int) and block_identifier < MULTICALL3_DEPLOY_BLOCK:
+        results, failed = _plain_calls(functions, block_identifier, batch)
+    else:
+        chunks = [functions[i:i + chunk_size] for i in range(0, len(functions), chunk_size)]
+        transactions = _aggregate_transactions(w3, chunks)
+
+        if batch is None:
+            responses = [w3.eth.call(tx, block_identifier=block_identifier) for tx in transactions]
+        else:
+            responses = batch.request(("eth_call", [tx, to_block_param(block_identifier)]) for tx in transactions)
+
+        results, failed = _decode_chunks(w3, chunks, responses)
+    if failed and not allow_failure:
+        raise MulticallError(f"{len(failed)} of {len(functions)} calls failed, first at index {failed[0]}")
+    return results
+
+
+def multicall_blocks(w3, functions_by_block, batch, chunk_size=MULTICALL_CHUNK_SIZE, allow_failure=False):
+    """
+    multicall() at many blocks at once: {block: [functions]} -> {block: [results]}.
+
+    The aggregate calls of every block (and the plain calls of blocks before
+    Multicall3 was deployed) share the same JSON-RPC batches, so reading a few
+    values at thousands of historical blocks costs a handful of requests.
+    """
+    plan = []
+    calls = []
+    plain_functions = []
+    plain_blocks = []
+    for block, functions in functions_by_block.items():
+        functions = list(functions)
+        if isinstance(block, int) and block < MULTICALL3_DEPLOY_BLOCK:
+            plan.append((block, None, len(plain_functions), len(functions)))
+            plain_functions.extend(functions)
+            plain_blocks.extend([block] * len(functions))
+            continue
+        chunks = [functions[i:i + chunk_size] for i in range(0, len(functions), chunk_size)]
+        plan.append((block, chunks, len(calls), len(chunks)))
+        calls.extend(("eth_call", [tx, to_block_param(block)]) for tx in _aggregate_transactions(w3, chunks))
+
+    responses = batch.request(calls) if calls else []
+    plain_results = batch.call(plain_functions, plain_blocks, raise_errors=False) if plain_functions else []
+
+    results = {}
+    for block, chunks, offset, count in plan:
+        if chunks is None:
+            values = plain_results[offset:offset + count]
+            failed = [i for i, value in enumerate(values) if isinstance(value, Exception)]
+            values = [None if isinstance(value, Exception) else value for value in values]
+        else:
+            values, failed = _decode_chunks(w3, chunks, responses[offset:offset + count])
+        if failed and not allow_failure:
+            raise MulticallError(f"{len(failed)} of {len(values)} calls at block {block} failed, first at index {failed[0]}")
+        results[block] = values
+    return results
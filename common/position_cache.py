@@ -0,0 +1,133 @@
+import time
+import sqlite3
+from collections import OrderedDict, namedtuple
+
+from common.log_fetcher import is_transient_error
+
+Position = namedtuple("Position", ["token0", "token1", "fee", "tick_lower", "tick_upper"])
+
+# get() result for a tokenId whose positions() read failed (burned or reverting), within the TTL
+UNREADABLE = "unreadable"
+
+# Positions kept in memory; the rest are read back from the SQLite file
+DEFAULT_CACHE_SIZE = 10000
+# Seconds a failed positions() read is remembered before the tokenId is read again
+UNREADABLE_TTL = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    token_id TEXT PRIMARY KEY,
+    token0 TEXT NOT NULL,
+    token1 TEXT NOT NULL,
+    fee INTEGER NOT NULL,
+    tick_lower INTEGER NOT NULL,
+    tick_upper INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS unreadable (
+    token_id TEXT PRIMARY KEY,
+    failed_at INTEGER NOT NULL
+);
+"""
+
+
+class PositionCache:
+    """
+    tokenId -> Position (token0, token1, fee, tickLower, tickUpper) of Uniswap v3 positions.
+
+    These fields never change for a tokenId, so each position is read from the
+    chain once. Lookups go through an in-memory LRU of `max_size` entries, then a
+    SQLite file that every new entry is written through to.
+
+    The cache does not know which tokens are tracked: every position read is
+    stored, so events of untracked pairs are dropped by the caller without any
+    RPC. TokenIds whose positions() call fails with anything but a transient
+    error (burned or reverting) get a tombstone row in `unreadable` and resolve
+    to None without an RPC for `unreadable_ttl` seconds, then are read again.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_CACHE_SIZE, unreadable_ttl=UNREADABLE_TTL):
+        self.max_size = max_size
+        self.unreadable_ttl = unreadable_ttl
+        self.memory = OrderedDict()
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.conn.close()
+
+    def _remember(self, token_id, value):
+        """Position, or the unix time of a failed read, in the LRU"""
+        self.memory[token_id] = value
+        self.memory.move_to_end(token_id)
+        if len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def _load(self, token_id):
+        # token ids are uint256, stored as text
+        row = self.conn.execute(
+            "SELECT token0, token1, fee, tick_lower, tick_upper FROM positions WHERE token_id = ?", (str(token_id),)
+        ).fetchone()
+        if row is not None:
+            return Position(*row)
+        row = self.conn.execute("SELECT failed_at FROM unreadable WHERE token_id = ?", (str(token_id),)).fetchone()
+        return None if row is None else row[0]
+
+    def get(self, token_id):
+        """Cached Position of a tokenId, UNREADABLE if its last read failed less than unreadable_ttl ago, or None"""
+        value = self.memory.get(token_id)
+        if value is None:
+            value = self._load(token_id)
+        if value is None or (not isinstance(value, Position) and time.time() - value >= self.unreadable_ttl):
+            self.misses += 1
+            return None
+        self._remember(token_id, value)
+        self.hits += 1
+        return value if isinstance(value, Position) else UNREADABLE
+
+    def put(self, token_id, position):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?, ?, ?)", (str(token_id),) + tuple(position))
+            self.conn.execute("DELETE FROM unreadable WHERE token_id = ?", (str(token_id),))
+        self._remember(token_id, position)
+
+    def put_unreadable(self, token_id):
+        """Tombstone for a tokenId whose positions() read failed, so it is not read again for unreadable_ttl"""
+        failed_at = int(time.time())
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO unreadable VALUES (?, ?)", (str(token_id), failed_at))
+        self._remember(token_id, failed_at)
+
+    def resolve(self, batch, instance, token_blocks):
+        """
+        tokenId -> Position for {tokenId: block number}, None where it could not be read.
+
+        Unknown positions are read with one batch of positions(tokenId) calls
+        (BatchRPC.call) at the given blocks and stored in the cache, failed reads
+        as tombstones unless the error was transient.
+        """
+        positions = {}
+        missing = {}
+        for token_id, block_number in token_blocks.items():
+            cached = self.get(token_id)
+            positions[token_id] = None if cached is UNREADABLE else cached
+            if cached is None:
+                missing[token_id] = block_number
+
+        if missing:
+            functions = [instance.functions.positions(token_id) for token_id in missing]
+            results = batch.call(functions, list(missing.values()), raise_errors=False)
+            for (token_id, block_number), result in zip(missing.items(), results):
+                if isinstance(result, Exception):
+                    print(f"positions({token_id}) at block {block_number} failed: {result}")
+                    if not is_transient_error(result):
+                        self.put_unreadable(token_id)
+                    continue
+                # positions() returns (nonce, operator, token0, token1, fee, tickLower, tickUpper, ...)
+                position = Position(result[2], result[3], result[4], result[5], result[6])
+                self.put(token_id, position)
+                positions[token_id] = position
+
+        return positions
@@ -0,0 +1,181 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from common.rpc_batch import BatchRPC
+
+# The profiler of this run, set by start(); the helpers below do nothing while it is None
+_active = None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class Profiler:
+    """
+    Where the time of a batch run goes.
+
+    Per JSON-RPC method: calls, errors, latency percentiles and response bytes,
+    from a web3 middleware (install()) and from every BatchRPC (a batch counts
+    each of its calls, and its latency and size are shared out evenly).
+
+    Per pipeline stage: wall time spent inside stage() blocks. Time spent in a
+    nested stage is only counted for the inner one, so the stages add up to
+    the wall time they cover.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.rpc = {}  # method -> {"calls", "errors", "bytes", "latencies"}
+        self.stages = {}  # name -> [seconds, entries]
+        self.local = threading.local()
+
+    def observe(self, methods, seconds, response_bytes, error):
+        """BatchRPC observer: one request carrying `methods`"""
+        with self.lock:
+            for method in methods:
+                stats = self.rpc.setdefault(method, {"calls": 0, "errors": 0, "bytes": 0, "latencies": []})
+                stats["calls"] += 1
+                stats["latencies"].append(seconds / len(methods))
+                if response_bytes is not None:
+                    stats["bytes"] += response_bytes // len(methods)
+                if error is not None:
+                    stats["errors"] += 1
+
+    def middleware(self, make_request, w3):
+        """web3 middleware timing each request; response size is that of the re-encoded JSON response"""
+        def middleware(method, params):
+            started = time.perf_counter()
+            try:
+                response = make_request(method, params)
+            except Exception as e:
+                self.observe([method], time.perf_counter() - started, None, e)
+                raise
+            seconds = time.perf_counter() - started
+            self.observe([method], seconds, len(json.dumps(response, default=str)), response.get("error"))
+            return response
+        return middleware
+
+    @contextmanager
+    def stage(self, name):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        frame = [time.perf_counter(), 0.0]  # start, time spent in nested stages
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            if stack:
+                stack[-1][1] += elapsed
+            with self.lock:
+                totals = self.stages.setdefault(name, [0.0, 0])
+                totals[0] += elapsed - frame[1]
+                totals[1] += 1
+
+    def summary(self):
+        wall = time.perf_counter() - self.started
+        rpc = {}
+        with self.lock:
+            for method, stats in sorted(self.rpc.items(), key=lambda item: -sum(item[1]["latencies"])):
+                latencies = sorted(stats["latencies"])
+                rpc[method] = {
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "total_seconds": round(sum(latencies), 6),
+                    "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+                    "p90_ms": round(percentile(latencies, 0.9) * 1000, 3),
+                    "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+                    "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+                    "bytes": stats["bytes"],
+                }
+            stages = {
+                name: {"seconds": round(seconds, 6), "entries": entries, "share": round(seconds / wall, 4) if wall else 0.0}
+                for name, (seconds, entries) in sorted(self.stages.items(), key=lambda item: -item[1][0])
+            }
+        return {"wall_seconds": round(wall, 6), "stages": stages, "rpc": rpc}
+
+    def print_report(self):
+        summary = self.summary()
+        print("\n" + "=" * 96)
+        print(f"⏱️ Profile: {summary['wall_seconds']:.2f}s wall time")
+        print("=" * 96)
+        print(f"{'Stage':<32}{'Seconds':>12}{'Share':>9}{'Entries':>10}")
+        for name, stage in summary["stages"].items():
+            print(f"{name:<32}{stage['seconds']:>12.3f}{stage['share'] * 100:>8.1f}%{stage['entries']:>10}")
+        untracked = summary["wall_seconds"] - sum(stage["seconds"] for stage in summary["stages"].values())
+        print(f"{'(outside stages)':<32}{untracked:>12.3f}")
+        print()
+        print(f"{'RPC method':<28}{'Calls':>8}{'Errors':>8}{'Total s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'MB':>10}")
+        for method, stats in summary["rpc"].items():
+            print(
+                f"{method:<28}{stats['calls']:>8}{stats['errors']:>8}{stats['total_seconds']:>10.3f}"
+                f"{stats['p50_ms']:>10.1f}{stats['p90_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['bytes'] / 1e6:>10.2f}"
+            )
+        print("=" * 96)
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+        print(f"📄 Profile saved: {path}")
+
+
+def add_arguments(parser):
+    parser.add_argument("--profile", action="store_true", help="print RPC and stage timings at the end")
+    parser.add_argument("--profile-json", metavar="PATH", help="also write the profile to a JSON file (implies --profile)")
+
+
+def start(args=None):
+    """Start profiling this run if --profile or --profile-json was given (always when args is None)"""
+    global _active
+    if args is not None and not (args.profile or args.profile_json):
+        return None
+    _active = Profiler()
+    BatchRPC.shared_observers.append(_active.observe)
+    return _active
+
+
+def install(w3):
+    """Time the web3 requests of w3; no-op when not profiling"""
+    if _active is not None:
+        # Innermost layer, so only the request itself is timed and the response is still plain JSON
+        w3.middleware_onion.inject(_active.middleware, "profiler", layer=0)
+    return w3
+
+
+@contextmanager
+def stage(name):
+    """Count the time of the block as pipeline stage `name`; no-op when not profiling"""
+    if _active is None:
+        yield
+        return
+    with _active.stage(name):
+        yield
+
+
+def timed(iterable, name):
+    """Yield from iterable, counting the time spent producing each item as stage `name`"""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def finish(args=None):
+    """Print the report and write --profile-json if profiling"""
+    if _active is None:
+        return
+    _active.print_report()
+    if args is not None and args.profile_json:
+        _active.write_json(args.profile_json)
@@ -0,0 +1,262 @@
+import time
+
+import requests
+from web3._utils.abi import get_abi_output_types
+from web3._utils.method_formatters import PYTHONIC_RESULT_FORMATTERS
+from web3.datastructures import AttributeDict
+
+from common.log_fetcher import is_transient_error
+
+# Provider messages meaning "this batch has too many calls", answered by splitting the batch
+BATCH_TOO_LARGE_HINTS = (
+    "batch size",
+    "batch too large",
+    "batch limit",
+    "too many batch",
+    "request entity too large",
+)
+
+
+class RPCError(Exception):
+    def __init__(self, method, error):
+        self.method = method
+        self.error = error
+        super().__init__(f"{method}: {error}")
+
+
+class BatchTooLarge(Exception):
+    pass
+
+
+def to_block_param(block_identifier):
+    if isinstance(block_identifier, int):
+        return hex(block_identifier)
+    return block_identifier
+
+
+def format_result(method, result):
+    """Apply the same result formatting web3 applies, so batched results look like w3.eth.* results"""
+    if result is None:
+        return None
+    formatter = PYTHONIC_RESULT_FORMATTERS.get(method)
+    if formatter is not None:
+        result = formatter(result)
+    if isinstance(result, dict):
+        result = AttributeDict.recursive(result)
+    return result
+
+
+def decode_function_output(w3, function, data):
+    output_types = get_abi_output_types(function.abi)
+    values = w3.codec.decode(output_types, data)
+    if len(values) == 1:
+        return values[0]
+    return list(values)
+
+
+class BatchRPC:
+    """
+    Sends independent JSON-RPC calls as batch arrays to the endpoint of a Web3 instance.
+
+    Calls are grouped into batches of at most batch_size. A batch rejected for its
+    size is split in half and retried (and batch_size is lowered for the rest of
+    the run); rate-limited calls are retried with exponential backoff. Providers
+    that are not HTTP (e.g. websocket) fall back to one request per call; a
+    provider with a post_batch() method (RPCPool) gets the batches instead.
+
+    Every request sent is reported to the callables in `observers` as
+    observer(methods, seconds, response_bytes, error), with the method of each
+    call in it; response_bytes is None when the provider does not expose it.
+    `shared_observers` are told about the requests of every BatchRPC.
+    """
+
+    shared_observers = []
+
+    def __init__(self, w3, batch_size=100, timeout=60, max_retries=5, backoff=1.0):
+        self.w3 = w3
+        self.endpoint_uri = str(getattr(w3.provider, "endpoint_uri", "") or "")
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.pool = w3.provider if hasattr(w3.provider, "post_batch") else None
+        self.is_http = self.pool is not None or self.endpoint_uri.startswith("http")
+        self.observers = []
+
+    def _observe(self, methods, started, response_bytes, error):
+        seconds = time.perf_counter() - started
+        for observer in self.observers + BatchRPC.shared_observers:
+            observer(methods, seconds, response_bytes, error)
+
+    def request(self, calls, raise_errors=True):
+        """
+        Send (method, params) calls and return their formatted results in the same order.
+
+        With raise_errors=False a failed call gives an RPCError in its slot instead of raising.
+        """
+        calls = list(calls)
+        results = []
+        offset = 0
+        while offset < len(calls):
+            chunk = calls[offset:offset + self.batch_size]
+            results.extend(self._send(chunk))
+            offset += len(chunk)
+
+        formatted = []
+        for (method, _), result in zip(calls, results):
+            if isinstance(result, RPCError):
+                if raise_errors:
+                    raise result
+                formatted.append(result)
+            else:
+                formatted.append(format_result(method, result))
+        return formatted
+
+    def _send(self, calls):
+        if not self.is_http:
+            return [self._send_single(method, params) for method, params in calls]
+
+        try:
+            return self._send_batch(calls)
+        except BatchTooLarge:
+            if len(calls) == 1:
+                raise
+            half = len(calls) // 2
+            if half < self.batch_size:
+                self.batch_size = half
+                print(f"   ⚠️ RPC batch of {len(calls)} calls rejected, lowering batch size to {self.batch_size}")
+            return self._send(calls[:half]) + self._send(calls[half:])
+
+    def _send_single(self, method, params):
+        started = time.perf_counter()
+        try:
+            response = self.w3.provider.make_request(method, params)
+        except Exception as e:
+            self._observe([method], started, None, e)
+            raise
+        self._observe([method], started, None, response.get("error"))
+        if "error" in response:
+            return RPCError(method, response["error"])
+        return response.get("result")
+
+    def _send_batch(self, calls):
+        results = [None] * len(calls)
+        todo = list(range(len(calls)))
+        attempt = 0
+        while todo:
+            payload = [
+                {"jsonrpc": "2.0", "id": i, "method": calls[i][0], "params": calls[i][1]}
+                for i in todo
+            ]
+            responses = self._post(payload)
+
+            by_id = {response.get("id"): response for response in responses}
+            retry = []
+            for i in todo:
+                response = by_id.get(i)
+                if response is None:
+                    retry.append(i)
+                    continue
+                if "error" in response:
+                    error = RPCError(calls[i][0], response["error"])
+                    message = str(response["error"]).lower()
+                    if any(hint in message for hint in BATCH_TOO_LARGE_HINTS):
+                        raise BatchTooLarge(message)
+                    if is_transient_error(error):
+                        retry.append(i)
+                    else:
+                        results[i] = error
+                    continue
+                results[i] = response.get("result")
+
+            todo = retry
+            if todo:
+                attempt += 1
+                if attempt > self.max_retries:
+                    for i in todo:
+                        results[i] = RPCError(calls[i][0], by_id.get(i, {}).get("error", "no response"))
+                    break
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+        return results
+
+    def _post(self, payload):
+        methods = [call["method"] for call in payload]
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                if self.pool is not None:
+                    body = self.pool.post_batch(payload)
+                    self._observe(methods, started, None, None)
+                else:
+                    response = self.session.post(self.endpoint_uri, json=payload, timeout=self.timeout)
+                    if response.status_code == 413:
+                        raise BatchTooLarge("request entity too large")
+                    response.raise_for_status()
+                    body = response.json()
+                    self._observe(methods, started, len(response.content), None)
+            except BatchTooLarge as e:
+                self._observe(methods, started, None, e)
+                raise
+            except Exception as e:
+                self._observe(methods, started, None, e)
+                attempt += 1
+                if not is_transient_error(e) or attempt > self.max_retries:
+                    raise
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+                continue
+
+            if isinstance(body, list):
+                return body
+
+            # A single error object instead of an array: the whole batch was refused
+            message = str(body.get("error", body)).lower()
+            if any(hint in message for hint in BATCH_TOO_LARGE_HINTS):
+                raise BatchTooLarge(message)
+            error = RPCError("batch", body.get("error", body))
+            attempt += 1
+            if not is_transient_error(error) or attempt > self.max_retries:
+                raise error
+            time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def get_blocks(self, numbers):
+        """Block headers (without transactions) by number, as a dict number -> block"""
+        numbers = list(numbers)
+        blocks = self.request(("eth_getBlockByNumber", [to_block_param(n), False]) for n in numbers)
+        return dict(zip(numbers, blocks))
+
+    def get_receipts(self, tx_hashes):
+        return self.request(("eth_getTransactionReceipt", [_to_hex(h)]) for h in tx_hashes)
+
+    def get_transactions(self, tx_hashes):
+        return self.request(("eth_getTransactionByHash", [_to_hex(h)]) for h in tx_hashes)
+
+    def call(self, functions, block_identifier="latest", raise_errors=True):
+        """
+        eth_call many contract functions (e.g. instance.functions.stakeOf(account)) and decode the results.
+
+        block_identifier is either one block for all calls or a list with one block per call.
+        With raise_errors=False a reverted call gives an RPCError in its slot.
+        """
+        functions = list(functions)
+        if isinstance(block_identifier, (list, tuple)):
+            blocks = list(block_identifier)
+        else:
+            blocks = [block_identifier] * len(functions)
+
+        calls = (
+            ("eth_call", [{"to": fn.address, "data": fn._encode_transaction_data()}, to_block_param(block)])
+            for fn, block in zip(functions, blocks)
+        )
+        results = self.request(calls, raise_errors)
+        return [
+            data if isinstance(data, RPCError) else decode_function_output(self.w3, fn, data)
+            for fn, data in zip(functions, results)
+        ]
+
+
+def _to_hex(value):
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + bytes(value).hex()
+    return value
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import threading
+
+import requests
+from web3 import HTTPProvider
+from web3.providers import JSONBaseProvider
+
+from common.log_fetcher import is_transient_error
+from common.rpc_batch import RPCError, BatchTooLarge
+
+# Consecutive failures that eject an endpoint, and how long the first ejection lasts (doubled on every repeat)
+FAILURE_THRESHOLD = 3
+COOLDOWN = 30
+MAX_COOLDOWN = 600
+
+# Blocks behind head whose state full (non-archive) nodes still serve
+HISTORICAL_DEPTH = 128
+# Seconds the known head is used before it is read again for routing
+HEAD_REFRESH = 60
+
+# Position of the block parameter of the methods that read state at a block
+STATE_METHODS = {
+    "eth_call": 1,
+    "eth_getBalance": 1,
+    "eth_getCode": 1,
+    "eth_getTransactionCount": 1,
+    "eth_getStorageAt": 2,
+    "eth_getProof": 2,
+}
+
+
+class TokenBucket:
+    """`rate` requests per second with bursts of up to `burst`; rate None means unlimited"""
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate or 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, n=1):
+        """Seconds until n tokens are available"""
+        if self.rate is None:
+            return 0.0
+        with self.lock:
+            self._refill(time.monotonic())
+            return max(0.0, (min(n, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, n=1):
+        """Reserve n tokens (the balance may go negative) and return how long to wait before using them"""
+        if self.rate is None:
+            return 0.0
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= n
+            return max(0.0, -self.tokens / self.rate)
+
+
+class Endpoint:
+    """One RPC endpoint of a pool with its rate limit and circuit breaker state"""
+
+    def __init__(self, url, rate=None, burst=None, archive=False, timeout=60):
+        if not url.startswith("http"):
+            raise ValueError(f"RPC pool endpoints must be HTTP(S): {url}")
+        self.url = url
+        self.archive = archive
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.provider = HTTPProvider(url, request_kwargs={"timeout": timeout})
+        self.session = requests.Session()
+
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.calls = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return f"Endpoint({self.url[:40]}{', archive' if self.archive else ''})"
+
+    def is_open(self, now):
+        return self.open_until > now
+
+    def started(self, n):
+        with self.lock:
+            self.in_flight += 1
+            self.calls += n
+
+    def succeeded(self):
+        with self.lock:
+            self.in_flight -= 1
+            if self.trips:
+                print(f"🔌 RPC endpoint {self.url[:40]} is back")
+            self.failures = 0
+            self.trips = 0
+
+    def failed(self, error, threshold, cooldown):
+        with self.lock:
+            self.in_flight -= 1
+            self.errors += 1
+            self.failures += 1
+            # After an ejection a single failed probe ejects the endpoint again, for twice as long
+            if self.failures >= threshold:
+                seconds = min(cooldown * 2 ** self.trips, MAX_COOLDOWN)
+                self.trips += 1
+                self.open_until = time.monotonic() + seconds
+                print(f"🔌 RPC endpoint {self.url[:40]} ejected for {seconds}s after {self.failures} failures: {error}")
+
+
+class RPCPool(JSONBaseProvider):
+    """
+    web3 provider spreading requests over several HTTP endpoints.
+
+    Each endpoint has a token bucket (`rate` requests/s, `burst`), and a request
+    goes to the endpoint that can take it soonest, then to the one with fewest
+    requests in flight. Connection errors, HTTP errors and rate-limit responses
+    count as failures; FAILURE_THRESHOLD failures in a row eject the endpoint
+    for COOLDOWN seconds (doubling while it keeps failing) and the request is
+    retried on another endpoint. Other JSON-RPC errors are returned as usual.
+
+    State reads (eth_call, eth_getBalance, ...) at a block more than
+    HISTORICAL_DEPTH blocks behind head only go to endpoints marked `archive`.
+    The head is read with eth_blockNumber when needed and refreshed every
+    HEAD_REFRESH seconds.
+
+    BatchRPC sends its batches through post_batch(), so batching still works
+    with a pool.
+    """
+
+    def __init__(self, endpoints, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        super().__init__()
+        if not endpoints:
+            raise ValueError("RPC pool needs at least one endpoint")
+        self.endpoints = endpoints
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.head = None
+        self.head_updated = 0.0
+        self.lock = threading.Lock()
+        if not any(endpoint.archive for endpoint in endpoints):
+            print("⚠️ RPC pool has no archive endpoint, historical state reads go to every endpoint")
+
+    def __str__(self):
+        return f"RPC pool of {len(self.endpoints)} endpoints ({sum(e.archive for e in self.endpoints)} archive)"
+
+    @classmethod
+    def from_config(cls, path):
+        """
+        Pool from a JSON file: a list of endpoints, or {"endpoints": [...], "failure_threshold": 3, "cooldown": 30}.
+        An endpoint is {"url": ..., "rate": 25, "burst": 50, "archive": true}; everything but url is optional.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        if isinstance(config, list):
+            config = {"endpoints": config}
+        endpoints = [
+            Endpoint(entry["url"], entry.get("rate"), entry.get("burst"), entry.get("archive", False), entry.get("timeout", 60))
+            for entry in config["endpoints"]
+        ]
+        return cls(endpoints, config.get("failure_threshold", FAILURE_THRESHOLD), config.get("cooldown", COOLDOWN))
+
+    def is_connected(self, show_traceback=False):
+        return any(endpoint.provider.is_connected() for endpoint in self.endpoints)
+
+    isConnected = is_connected  # web3 v5
+
+    def needs_archive(self, method, params):
+        position = STATE_METHODS.get(method)
+        if position is None or not params or len(params) <= position:
+            return False
+        block = params[position]
+        if isinstance(block, dict):  # EIP-1898 {"blockNumber": ...} / {"blockHash": ...}
+            if "blockHash" in block:
+                return True
+            block = block.get("blockNumber")
+        if isinstance(block, str):
+            if not block.startswith("0x"):
+                return False  # latest, pending, safe, finalized, earliest
+            block = int(block, 16)
+        if not isinstance(block, int):
+            return False
+        head = self.current_head()
+        return head is None or block < head - HISTORICAL_DEPTH
+
+    def current_head(self):
+        """
+        Chain head for routing, read with eth_blockNumber when unknown or older than
+        HEAD_REFRESH seconds; None (every read treated as historical) if that fails.
+        """
+        if self.head is not None and time.monotonic() - self.head_updated < HEAD_REFRESH:
+            return self.head
+        with self.lock:
+            if self.head is None or time.monotonic() - self.head_updated >= HEAD_REFRESH:
+                try:
+                    self.make_request("eth_blockNumber", [])
+                except Exception as e:
+                    print(f"⚠️ RPC pool could not read the head block: {e}")
+        return self.head
+
+    def _choose(self, archive, n, tried):
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if (e.archive or not archive) and e not in tried]
+        if not candidates and archive:
+            candidates = [e for e in self.endpoints if e not in tried]
+        if not candidates:
+            return None
+        healthy = [e for e in candidates if not e.is_open(now)]
+        if not healthy:
+            # Everything is ejected: probe the endpoint that comes back first
+            return min(candidates, key=lambda e: e.open_until)
+        return min(healthy, key=lambda e: (e.bucket.delay(n), e.in_flight))
+
+    def _send(self, archive, n, send):
+        """send(endpoint) on endpoints in turn until one does not fail; returns its result"""
+        tried = []
+        error = None
+        while True:
+            endpoint = self._choose(archive, n, tried)
+            if endpoint is None:
+                raise error
+            tried.append(endpoint)
+
+            wait = endpoint.bucket.take(n)
+            if wait > 0:
+                time.sleep(wait)
+            endpoint.started(n)
+            try:
+                result = send(endpoint)
+            except BatchTooLarge:
+                endpoint.succeeded()
+                raise
+            except Exception as e:
+                endpoint.failed(e, self.failure_threshold, self.cooldown)
+                error = e
+                continue
+            endpoint.succeeded()
+            return result
+
+    def make_request(self, method, params):
+        def send(endpoint):
+            response = endpoint.provider.make_request(method, params)
+            if "error" in response and is_transient_error(RPCError(method, response["error"])):
+                raise RPCError(method, response["error"])
+            return response
+
+        response = self._send(self.needs_archive(method, params), 1, send)
+        if method == "eth_blockNumber" and isinstance(response.get("result"), str):
+            self.head = int(response["result"], 16)
+            self.head_updated = time.monotonic()
+        return response
+
+    def post_batch(self, payload):
+        """POST a JSON-RPC batch array to one endpoint and return the decoded response body"""
+        archive = any(self.needs_archive(call["method"], call["params"]) for call in payload)
+
+        def send(endpoint):
+            response = endpoint.session.post(endpoint.url, json=payload, timeout=endpoint.timeout)
+            if response.status_code == 413:
+                raise BatchTooLarge("request entity too large")
+            response.raise_for_status()
+            body = response.json()
+            if isinstance(body, dict) and is_transient_error(RPCError("batch", body.get("error", body))):
+                raise RPCError("batch", body.get("error", body))
+            return body
+
+        return self._send(archive, len(payload), send)
+
+    def print_report(self):
+        for endpoint in self.endpoints:
+            state = "ejected" if endpoint.is_open(time.monotonic()) else "ok"
+            print(f"📡 {endpoint.url[:40]}: {endpoint.calls} calls, {endpoint.errors} errors, {state}")
+
+
+def provider_from_env(default_url):
+    """RPCPool from the JSON file named by RPC_ENDPOINTS_PATH if it is set, else an HTTPProvider for default_url"""
+    path = os.getenv("RPC_ENDPOINTS_PATH")
+    if path:
+        return RPCPool.from_config(path)
+    return HTTPProvider(default_url)
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+
+import requests
+
+# Slack incoming webhooks accept about one message per second
+MIN_INTERVAL = 1.0
+# Messages joined into one digest, and the digest size kept under Slack's 4000 character text limit
+MAX_DIGEST_MESSAGES = 20
+MAX_DIGEST_CHARS = 3500
+# Seconds the worker waits after the first message so a burst goes out as one digest
+LINGER = 1.0
+# Delivered bytes at the front of the spool above which it is compacted while messages are still queued
+COMPACT_BYTES = 1024 * 1024
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"rate limited, retry after {retry_after}s")
+
+
+class SlackQueue:
+    """
+    Non-blocking Slack webhook delivery.
+
+    send() appends the message to a spool file (one JSON string per line) and
+    returns at once; a worker thread posts the spooled messages in order. A burst
+    is coalesced into digests of up to MAX_DIGEST_MESSAGES messages, posts are
+    spaced by MIN_INTERVAL and failed posts are retried with exponential backoff.
+    If Slack rejects a digest (400), its messages are sent again one at a time
+    and only the ones rejected on their own are dropped.
+
+    The spool only loses a message once Slack has accepted it, so undelivered
+    messages survive a restart. Delivery moves a byte offset kept in
+    `<spool>.offset` instead of rewriting the spool; the delivered part is cut
+    off once the queue is empty or it grows past COMPACT_BYTES.
+
+    At most `max_queue` messages are held in memory; the rest wait in the spool
+    file until the queue drains.
+    """
+
+    def __init__(self, webhook_url, spool_path, max_queue=1000, timeout=10, backoff=1.0, max_backoff=300):
+        self.webhook_url = webhook_url
+        self.spool_path = spool_path
+        self.offset_path = spool_path + ".offset"
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+
+        # Invariant: `pending` holds (message, end offset) of the spool lines from `head` to `read_pos`;
+        # `spooled_only` more lines follow in the file
+        self.pending = deque()
+        self.spooled_only = 0
+        self.head = self._read_offset()
+        self.read_pos = self.head
+        # Messages of a rejected digest still to be sent one at a time
+        self.singles = 0
+        self.cond = threading.Condition()
+        self.closing = False
+        self.last_post = 0.0
+        # Messages accepted by Slack, messages Slack rejected for good, and failed posts
+        self.delivered = 0
+        self.dropped = 0
+        self.failures = 0
+
+        for message, end in self._read_spool(self.head):
+            if len(self.pending) < self.max_queue:
+                self.pending.append((message, end))
+                self.read_pos = end
+            else:
+                self.spooled_only += 1
+        if self.pending:
+            print(f"slack: {len(self.pending) + self.spooled_only} undelivered messages in {self.spool_path}")
+
+        self.worker = threading.Thread(target=self._run, name="slack-queue", daemon=True)
+        self.worker.start()
+
+    def __len__(self):
+        with self.cond:
+            return len(self.pending) + self.spooled_only
+
+    def send(self, message):
+        """Queue a message for delivery; never waits for Slack"""
+        with self.cond:
+            with open(self.spool_path, "ab") as f:
+                f.write((json.dumps(message) + "\n").encode("utf-8"))
+                end = f.tell()
+            if len(self.pending) < self.max_queue and not self.spooled_only:
+                self.pending.append((message, end))
+                self.read_pos = end
+            else:
+                self.spooled_only += 1
+            self.cond.notify()
+
+    def close(self, timeout=10):
+        """Give the worker up to `timeout` seconds to deliver what is queued; the rest stays in the spool"""
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+        self.worker.join(timeout)
+
+    def _spool_id(self):
+        """Inode of the spool file, which changes with every compaction; None if there is no spool"""
+        try:
+            return os.stat(self.spool_path).st_ino
+        except OSError:
+            return None
+
+    def _read_offset(self):
+        """Byte offset of the first undelivered spool line; 0 if unknown or saved for another spool file"""
+        try:
+            with open(self.offset_path, "r", encoding="utf-8") as f:
+                offset, spool_id = (int(value) for value in f.read().split())
+        except (OSError, ValueError):
+            return 0
+        # A compaction that did not get to write its offset leaves the offset of the old file
+        return offset if spool_id == self._spool_id() else 0
+
+    def _write_offset(self):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(f"{self.head} {self._spool_id() or 0}")
+        os.replace(tmp_path, self.offset_path)
+
+    def _read_spool(self, offset, count=None):
+        """(message, end offset) of up to `count` spool lines from byte `offset`"""
+        if not os.path.exists(self.spool_path):
+            return []
+        lines = []
+        with open(self.spool_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                if line.strip():
+                    lines.append((json.loads(line), offset))
+                    if count is not None and len(lines) >= count:
+                        break
+        return lines
+
+    def _compact(self):
+        """Cut the delivered lines off the front of the spool"""
+        remaining = b""
+        if os.path.exists(self.spool_path):
+            with open(self.spool_path, "rb") as f:
+                f.seek(self.head)
+                remaining = f.read()
+        tmp_path = self.spool_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(remaining)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.spool_path)
+
+        shift = self.head
+        self.pending = deque((message, end - shift) for message, end in self.pending)
+        self.read_pos -= shift
+        self.head = 0
+
+    def _delivered(self, count):
+        """Drop the first `count` messages from the spool and refill the in-memory queue from it"""
+        with self.cond:
+            for _ in range(count):
+                _, self.head = self.pending.popleft()
+            if self.spooled_only and len(self.pending) < self.max_queue:
+                refill = self._read_spool(self.read_pos, min(self.spooled_only, self.max_queue - len(self.pending)))
+                for message, end in refill:
+                    self.pending.append((message, end))
+                    self.read_pos = end
+                self.spooled_only -= len(refill)
+
+            if (not self.pending and not self.spooled_only) or self.head > COMPACT_BYTES:
+                self._compact()
+            self._write_offset()
+
+    def _next_digest(self):
+        """(text, message count) of the next digest from the head of the queue"""
+        messages = []
+        size = 0
+        limit = 1 if self.singles else MAX_DIGEST_MESSAGES
+        for message, _ in self.pending:
+            if messages and (len(messages) >= limit or size + len(message) + 1 > MAX_DIGEST_CHARS):
+                break
+            messages.append(message)
+            size += len(message) + 1
+        return "\n".join(messages), len(messages)
+
+    def _post(self, text):
+        """True once Slack accepted the text, False if Slack rejected it for good; raises on errors worth retrying"""
+        response = self.session.post(self.webhook_url, json={"text": text}, timeout=self.timeout)
+        if response.status_code == 429:
+            retry_after = float(response.headers.get("Retry-After", self.backoff))
+            raise RateLimited(retry_after)
+        if response.status_code == 400:
+            # invalid_payload and similar: the same text would be rejected again
+            print(f"slack: message rejected ({response.text})")
+            return False
+        response.raise_for_status()
+        return True
+
+    def _run(self):
+        attempt = 0
+        while True:
+            with self.cond:
+                while not self.pending and not self.closing:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+
+            if attempt == 0 and not self.closing:
+                time.sleep(LINGER)
+            wait = self.last_post + MIN_INTERVAL - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            with self.cond:
+                text, count = self._next_digest()
+
+            try:
+                accepted = self._post(text)
+            except Exception as e:
+                self.failures += 1
+                attempt += 1
+                delay = e.retry_after if isinstance(e, RateLimited) else min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+                print(f"slack: delivery failed ({e}), retry {attempt} in {delay:.1f}s, {len(self)} messages queued")
+                if self.closing:
+                    return
+                time.sleep(delay)
+                continue
+            finally:
+                self.last_post = time.monotonic()
+
+            attempt = 0
+            if not accepted and count > 1:
+                # One bad message rejects the whole digest: find it by sending them one by one
+                print(f"slack: sending the {count} messages of the rejected digest one at a time")
+                self.singles = count
+                continue
+            if accepted:
+                self.delivered += count
+            else:
+                print("slack: dropping the rejected message")
+                self.dropped += count
+            self.singles = max(self.singles - count, 0)
+            self._delivered(count)
@@ -0,0 +1,112 @@
+import datetime
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.position_cache import PositionCache
+
+KST = datetime.timezone(datetime.timedelta(hours=9))
+
+
+def format_number(num):
+    if num % 1 == 0:
+        return int(num)
+    else:
+        return num
+
+
+def format_timestamp(timestamp):
+    return str(datetime.datetime.fromtimestamp(timestamp, KST)) + "(KST)"
+
+
+class Handler:
+    """
+    Turns the decoded events of one watch entry into Slack message lines.
+
+    select() gets all events of the entry in a block range at once, so any RPC
+    it needs can be batched; format() is called per event that was selected.
+    """
+
+    # True if format() needs the sender of the tx, looked up in one batch for all txs
+    needs_sender = False
+
+    def __init__(self, monitor, watch, options):
+        self.monitor = monitor
+        self.watch = watch
+        self.options = options
+
+    def select(self, events):
+        """Events worth a message"""
+        return events
+
+    def format(self, event, sender=None):
+        raise NotImplementedError
+
+
+class DepositManagerHandler(Handler):
+    """Deposited / WithdrawalRequested / WithdrawalProcessed of a DepositManager (v0 or v1)"""
+
+    LABELS = {
+        "Deposited": "Deposited",
+        "WithdrawalRequested": "Withdrawal Requested",
+        "WithdrawalProcessed": "Withdrawal Processed",
+    }
+
+    def __init__(self, monitor, watch, options):
+        super().__init__(monitor, watch, options)
+        self.labels = {**self.LABELS, **options.get("labels", {})}
+        self.layer2s = {address.lower(): name for address, name in options.get("layer2s", {}).items()}
+
+    def format(self, event, sender=None):
+        args = event["args"]
+        log = f"<https://etherscan.io/tx/{event['transactionHash'].hex()}|{self.labels[event['event']]} tx> - "
+        log += f"depositor: `{args['depositor']}`, "
+        log += f"{self.layer2s.get(args['layer2'].lower(), 'Unknown')},"
+        log += f" `{format_number(args['amount'] / 1e27)}` TON"
+        return log
+
+
+class UniswapPositionsHandler(Handler):
+    """IncreaseLiquidity / DecreaseLiquidity of NonfungiblePositionManager positions in pairs with a tracked token"""
+
+    LABELS = {
+        "IncreaseLiquidity": "IncreasedLiquidity",
+        "DecreaseLiquidity": "DecreasedLiquidity",
+    }
+    needs_sender = True
+
+    def __init__(self, monitor, watch, options):
+        super().__init__(monitor, watch, options)
+        self.tokens = options.get("tokens", {})
+        self.position_cache = PositionCache(options.get("position_cache", "positions.sqlite"))
+        self.instance = monitor.w3.eth.contract(address=watch.address, abi=watch.abi)
+        self.positions = {}
+
+    def is_tracked(self, position):
+        return position is not None and (position.token0 in self.tokens or position.token1 in self.tokens)
+
+    def select(self, events):
+        # Positions come from the cache, so events of untracked pairs are dropped before any other RPC
+        token_blocks = {}
+        for event in events:
+            token_blocks.setdefault(event["args"]["tokenId"], event["blockNumber"])
+        self.positions = self.position_cache.resolve(self.monitor.batch, self.instance, token_blocks)
+        return [event for event in events if self.is_tracked(self.positions[event["args"]["tokenId"]])]
+
+    def format(self, event, sender=None):
+        args = event["args"]
+        position = self.positions[args["tokenId"]]
+        pair = f"{self.tokens.get(position.token0, position.token0)}/{self.tokens.get(position.token1, position.token1)}"
+        log = f"<https://etherscan.io/tx/{event['transactionHash'].hex()}|{self.LABELS[event['event']]} tx> - "
+        log += f"{pair} - "
+        log += f"from: `{sender}`, "
+        log += f"liquidity: `{int(args['liquidity']/1e18)}({int(args['amount0']/1e18)}/{int(args['amount1']/1e18)})`, "
+        log += f"tickLower: `{position.tick_lower}`, tickUpper: `{position.tick_upper}`"
+        return log
+
+
+# "formatter" of a watch entry -> Handler class
+FORMATTERS = {
+    "deposit_manager": DepositManagerHandler,
+    "uniswap_positions": UniswapPositionsHandler,
+}
@@ -0,0 +1,329 @@
+from web3 import Web3, HTTPProvider, WebsocketProvider
+import time
+import json
+import argparse
+import logging
+import traceback
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.log_decoder import LogDecoder
+from common.rpc_batch import BatchRPC
+from common.slack_queue import SlackQueue
+from common.checkpoint import Checkpoint, Reorg
+from common.log_fetcher import fetch_logs, RangePlanner
+from common.metrics import Metrics
+from common.rpc_pool import RPCPool
+
+from handlers import FORMATTERS, format_timestamp
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+CHECKPOINT_PATH = "checkpoint.json"
+# Progress file of earlier versions, read once when there is no checkpoint yet
+LATEST_BLOCK_LOG_PATH = "latest_block"
+ENDPOINT_PATH = ".endpoint"
+# Several endpoints with rate limits and failover (see common/rpc_pool.py), used instead of .endpoint when present
+ENDPOINTS_PATH = ".endpoints.json"
+SLACK_PATH = ".slack"
+SLACK_SPOOL_PATH = "slack_spool"
+
+# Seconds to wait for the next block (one mainnet slot)
+POLL_INTERVAL = 12
+# Blocks per getLogs request
+MAX_BLOCK_RANGE = 100
+# Blocks behind head that are processed; reorgs deeper than this are rolled back and re-emitted
+CONFIRMATIONS = 2
+# Lag in blocks above which the gap is backfilled in catch-up mode
+CATCH_UP_LAG = 1000
+# First getLogs span of the backfill; RangePlanner halves it on provider limits and grows it through quiet ranges
+CATCH_UP_CHUNK_SIZE = 5000
+# Backfill ranges requested at the same time
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "4"))
+
+def get_file_data(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = f.read().strip()
+
+    print(f"{path}: {data}")
+    return data
+
+def read_contract(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Watch:
+    """One watch entry of the config: a contract address, its ABI and the events to report"""
+
+    def __init__(self, monitor, entry, base_dir):
+        self.name = entry["name"]
+        self.address = Web3.to_checksum_address(entry["address"])
+        self.abi = read_contract(os.path.join(base_dir, entry["abi"]))["abi"]
+        self.decoder = LogDecoder(self.abi, entry.get("events"))
+        if not self.decoder.decoders:
+            raise ValueError(f"{self.name}: none of the events {entry.get('events')} are in {entry['abi']}")
+        if entry["formatter"] not in FORMATTERS:
+            raise ValueError(f"{self.name}: unknown formatter {entry['formatter']}, expected one of {list(FORMATTERS)}")
+        self.handler = FORMATTERS[entry["formatter"]](monitor, self, entry.get("options", {}))
+        self.event_count = 0
+
+
+class Monitor:
+    """
+    One daemon for every watch entry in the config.
+
+    Each block range is read with a single getLogs over the list of watched
+    addresses and the union of their event topics; the logs are then
+    dispatched to the entry of their address and decoded with its ABI.
+
+    Progress is a Checkpoint of (number, hash) pairs. Every range must extend
+    the checkpointed chain; after a reorg the blocks past the fork point are
+    processed again and their events reported again.
+    """
+
+    def __init__(self, config_path, w3, slack, metrics=None):
+        self.w3 = w3
+        self.batch = BatchRPC(w3)
+        self.slack = slack
+        self.head = None
+        self.last_block_timestamp = None
+        self.reorgs = 0
+
+        config = read_contract(config_path)
+        self.confirmations = config.get("confirmations", CONFIRMATIONS)
+        self.checkpoint = Checkpoint(CHECKPOINT_PATH)
+        base_dir = os.path.dirname(os.path.abspath(config_path))
+        self.watches = {}
+        for entry in config["watches"]:
+            watch = Watch(self, entry, base_dir)
+            if watch.address.lower() in self.watches:
+                raise ValueError(f"{watch.name}: {watch.address} is already watched by {self.watches[watch.address.lower()].name}")
+            self.watches[watch.address.lower()] = watch
+            print(f"watching {watch.name} {watch.address}: {[d.name for d in watch.decoder.decoders.values()]}")
+
+        self.addresses = [watch.address for watch in self.watches.values()]
+        self.topics = []
+        for watch in self.watches.values():
+            self.topics += [topic for topic in watch.decoder.topics() if topic not in self.topics]
+
+        if metrics is not None:
+            self.register_metrics(metrics)
+
+    def register_metrics(self, metrics):
+        """Monitor and Slack queue metrics, read when they are scraped; RPC metrics come from the batch observer"""
+        self.batch.observers.append(metrics.observe_batch)
+
+        def lag_blocks():
+            if self.head is None or self.checkpoint.last_block is None:
+                return None
+            return self.head - self.checkpoint.last_block
+
+        def lag_seconds():
+            if self.last_block_timestamp is None:
+                return None
+            return round(time.time() - self.last_block_timestamp, 3)
+
+        metrics.gauge("monitor_head_block", "Latest block number reported by the node", collect=lambda: self.head)
+        metrics.gauge("monitor_last_block", "Last processed block number", collect=lambda: self.checkpoint.last_block)
+        metrics.gauge("monitor_head_lag_blocks", "Blocks between the head and the last processed block", collect=lag_blocks)
+        metrics.gauge("monitor_head_lag_seconds", "Seconds since the timestamp of the last processed block", collect=lag_seconds)
+        metrics.gauge("monitor_confirmations", "Blocks kept behind the head", collect=lambda: self.confirmations)
+        metrics.counter("monitor_reorgs_total", "Reorgs rolled back", collect=lambda: self.reorgs)
+        metrics.counter(
+            "monitor_events_total", "Events reported per watched contract", ["contract"],
+            collect=lambda: {(watch.name,): watch.event_count for watch in self.watches.values()},
+        )
+        metrics.gauge("slack_queue_depth", "Slack messages waiting for delivery", collect=lambda: len(self.slack))
+        metrics.counter("slack_delivered_total", "Slack messages delivered", collect=lambda: self.slack.delivered)
+        metrics.counter("slack_dropped_total", "Slack messages rejected by Slack", collect=lambda: self.slack.dropped)
+        metrics.counter("slack_failures_total", "Failed Slack posts (retried)", collect=lambda: self.slack.failures)
+
+    def filter_params(self):
+        return {"address": self.addresses, "topics": [self.topics]}
+
+    def get_logs(self, from_block, to_block):
+        return self.w3.eth.get_logs({"fromBlock": from_block, "toBlock": to_block, **self.filter_params()})
+
+    def decode(self, logs):
+        """[(watch, event)] in log order, with only the events each handler selected"""
+        decoded = []
+        by_watch = {}
+        for log in logs:
+            watch = self.watches.get(log["address"].lower())
+            if watch is None:
+                continue
+            event = watch.decoder.decode(log)
+            if event is None:
+                # A topic of another watch entry emitted by this address
+                continue
+            decoded.append((watch, event))
+            by_watch.setdefault(watch, []).append(event)
+
+        selected = set()
+        for watch, events in by_watch.items():
+            for event in watch.handler.select(events):
+                selected.add((event["transactionHash"], event["logIndex"]))
+        return [(watch, event) for watch, event in decoded if (event["transactionHash"], event["logIndex"]) in selected]
+
+    def process_logs(self, logs, blocks=None):
+        """Decode and dispatch the logs, and queue one message per tx; returns the messages"""
+        txs = {}
+        for watch, event in self.decode(logs):
+            txs.setdefault(event["transactionHash"], []).append((watch, event))
+        if not txs:
+            return []
+
+        # Block timestamps and, for the handlers that show it, the tx sender: one batch each
+        if blocks is None:
+            blocks = self.batch.get_blocks(set(events[0][1]["blockNumber"] for events in txs.values()))
+        sender_txs = [tx_hash for tx_hash, events in txs.items() if any(watch.handler.needs_sender for watch, _ in events)]
+        senders = {}
+        if sender_txs:
+            senders = {tx_hash: tx["from"] for tx_hash, tx in zip(sender_txs, self.batch.get_transactions(sender_txs))}
+
+        msgs = []
+        for tx_hash, events in txs.items():
+            lines = [watch.handler.format(event, senders.get(tx_hash)) for watch, event in events]
+            msgs.append(f"{format_timestamp(blocks[events[0][1]['blockNumber']]['timestamp'])} " + "\n".join(lines))
+            for watch, _ in events:
+                watch.event_count += 1
+
+        for msg in msgs:
+            print("msg:", msg)
+            self.slack.send(msg)
+        return msgs
+
+    def start(self):
+        """Checkpoint to continue from: the saved one, else latest_block of earlier versions, else the safe head"""
+        if len(self.checkpoint):
+            print(f"checkpoint: block {self.checkpoint.last_block}")
+            return
+        try:
+            with open(LATEST_BLOCK_LOG_PATH, "r", encoding="utf-8") as f:
+                self.checkpoint.start(int(f.read()))
+        except (OSError, ValueError):
+            block = self.w3.eth.get_block(self.w3.eth.block_number - self.confirmations)
+            self.checkpoint.start(block["number"], block["hash"])
+        print(f"checkpoint: starting after block {self.checkpoint.last_block}")
+
+    def handle_reorg(self, reorg):
+        self.reorgs += 1
+        number = self.checkpoint.rewind(self.batch.get_blocks)
+        msg = f"⚠️ chain reorg: block {reorg.number} was replaced, events after block {number} are reported again"
+        print(msg)
+        self.slack.send(msg)
+
+    def apply_range(self, from_block, to_block, logs):
+        """
+        Report the logs of from_block ~ to_block and checkpoint to_block.
+
+        Returns False, without reporting anything, if the range does not extend
+        the checkpointed chain (the checkpoint is rolled back) or its logs are
+        not all from the same chain.
+        """
+        try:
+            blocks = self.checkpoint.check_range(self.batch.get_blocks, from_block, to_block, logs)
+        except Reorg as reorg:
+            self.handle_reorg(reorg)
+            return False
+        if blocks is None:
+            return False
+
+        self.process_logs(logs, blocks)
+        self.checkpoint.record(blocks[to_block], [blocks[log["blockNumber"]] for log in logs])
+        self.last_block_timestamp = blocks[to_block]["timestamp"]
+        return True
+
+    def safe_head(self):
+        self.head = self.w3.eth.block_number
+        return self.head - self.confirmations
+
+    def poll(self):
+        """One getLogs round over at most MAX_BLOCK_RANGE confirmed blocks; returns False when there was nothing to report"""
+        from_block = self.checkpoint.last_block + 1
+        to_block = min(self.safe_head(), from_block + MAX_BLOCK_RANGE - 1)
+        if to_block < from_block:
+            return False
+
+        print(f"blocks {from_block} - {to_block}")
+        return self.apply_range(from_block, to_block, self.get_logs(from_block, to_block))
+
+    def catch_up(self, to_block):
+        """
+        Backfill up to to_block with large adaptive getLogs ranges, MAX_IN_FLIGHT at a time
+        (one at a time over a websocket endpoint).
+
+        fetch_logs yields the ranges in block order, so messages go out in
+        block order and the checkpoint moves forward after every range.
+        Returns False if the backfill stopped before to_block.
+        """
+        from_block = self.checkpoint.last_block + 1
+        print(f"🚀 catching up {to_block - from_block + 1} blocks: {from_block} - {to_block}")
+        planner = RangePlanner(CATCH_UP_CHUNK_SIZE)
+        # A sync WebsocketProvider shares one socket and cannot serve requests from several threads
+        max_in_flight = MAX_IN_FLIGHT if isinstance(self.w3.provider, (HTTPProvider, RPCPool)) else 1
+        started = time.time()
+        for chunk in fetch_logs(self.w3, self.filter_params(), from_block, to_block, CATCH_UP_CHUNK_SIZE, max_in_flight, planner):
+            if chunk.error is not None:
+                # The checkpoint stays at the end of the last good range; polling continues from there
+                print(f"⚠️ blocks {chunk.start} - {chunk.end} could not be fetched: {chunk.error}")
+                return False
+            if not self.apply_range(chunk.start, chunk.end, chunk.logs):
+                return False
+            done = chunk.end - from_block + 1
+            print(f"   {chunk.end} ({done / (to_block - from_block + 1) * 100:.1f}%, {done / (time.time() - started):.0f} blocks/s)")
+        planner.print_report()
+        return True
+
+    def follow(self):
+        """Catch up if far behind, otherwise one polling round; returns False when the caller should wait"""
+        safe_head = self.safe_head()
+        if safe_head - self.checkpoint.last_block > CATCH_UP_LAG:
+            return self.catch_up(safe_head)
+        return self.poll()
+
+    def run(self):
+        while True:
+            try:
+                if not self.follow():
+                    time.sleep(POLL_INTERVAL)
+            except Exception as e:
+                logging.error(traceback.format_exc())
+                time.sleep(POLL_INTERVAL)
+
+
+def get_provider():
+    if os.path.exists(ENDPOINTS_PATH):
+        pool = RPCPool.from_config(ENDPOINTS_PATH)
+        print(f"{ENDPOINTS_PATH}: {pool}")
+        return pool
+    url = get_file_data(ENDPOINT_PATH)
+    if url.startswith("ws"):
+        return WebsocketProvider(url)
+    return HTTPProvider(url)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default=CONFIG_PATH, help="watch entries (address, abi, events, formatter, options)")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on 127.0.0.1:PORT/metrics")
+    args = parser.parse_args()
+
+    w3 = Web3(get_provider())
+    slack = SlackQueue(get_file_data(SLACK_PATH), SLACK_SPOOL_PATH)
+
+    metrics = None
+    if args.metrics_port:
+        metrics = Metrics()
+        w3.middleware_onion.add(metrics.rpc_middleware, "metrics")
+        metrics.serve(args.metrics_port)
+
+    monitor = Monitor(args.config, w3, slack, metrics)
+    monitor.start()
+    try:
+        monitor.run()
+    finally:
+        slack.close()
+
+if __name__ == '__main__':
+    main()
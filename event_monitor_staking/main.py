@@ -1,17 +1,40 @@
 from web3 import Web3, WebsocketProvider
+from hexbytes import HexBytes
 import time
 import json
+import asyncio
+import argparse
+import websockets
 import logging
 import traceback
-import requests
 import datetime
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.log_decoder import LogDecoder
+from common.rpc_batch import BatchRPC
+from common.slack_queue import SlackQueue
+from common.checkpoint import Checkpoint, Reorg
 
 ADDRESS_DEPOSIT_MANAGER = "0x56E465f654393fa48f007Ed7346105c7195CEe43"
 BUILD_DEPOSIT_MANAGER_PATH = "DepositManager.json"
 
+CHECKPOINT_PATH = "checkpoint.json"
+# Progress file of earlier versions, read once when there is no checkpoint yet
 LATEST_BLOCK_LOG_PATH = "latest_block"
 ENDPOINT_PATH = ".endpoint"
 SLACK_PATH = ".slack"
+SLACK_SPOOL_PATH = "slack_spool"
+
+# Seconds to wait for the next block when polling
+POLL_INTERVAL = 60
+# Seconds without any subscription message (a new head arrives every ~12s) before reconnecting
+SUBSCRIPTION_TIMEOUT = 120
+# Blocks behind head that are read with getLogs and checkpointed
+CONFIRMATIONS = 2
+# Logs remembered so a log seen twice (pushed and read with getLogs, or pushed again after a reconnect) is only reported once
+RECENT_LOG_COUNT = 1000
 
 def get_file_data(path):
     data = None
@@ -26,20 +49,22 @@ slack_url = get_file_data(SLACK_PATH)
 
 w3 = Web3(WebsocketProvider(endpoint_url))
 
-event_hash_deposited = w3.keccak(text="Deposited(address,address,uint256)").hex()
-event_hash_withdrawal_requested = w3.keccak(text="WithdrawalRequested(address,address,uint256)").hex()
-event_hash_withdrawal_processed = w3.keccak(text="WithdrawalProcessed(address,address,uint256)").hex()
+batch = BatchRPC(w3)
+slack = SlackQueue(slack_url.strip(), SLACK_SPOOL_PATH)
+checkpoint = Checkpoint(CHECKPOINT_PATH)
 
-def get_from_block():
-    from_block = w3.eth.get_block("latest")["number"]
+def start_checkpoint():
+    """Checkpoint to continue from: the saved one, else latest_block of earlier versions, else the confirmed head"""
+    if len(checkpoint):
+        print(f"checkpoint: block {checkpoint.last_block}")
+        return
     try:
         with open(LATEST_BLOCK_LOG_PATH, "r", encoding="utf-8") as f:
-            from_block = int(f.read())
-    except:
-        pass
-
-    print(f"from_block: {from_block}")
-    return from_block
+            checkpoint.start(int(f.read()))
+    except (OSError, ValueError):
+        block = w3.eth.get_block(w3.eth.get_block("latest")["number"] - CONFIRMATIONS)
+        checkpoint.start(block["number"], block["hash"])
+    print(f"checkpoint: starting after block {checkpoint.last_block}")
 
 def read_contract(path):
     with open(path, "r", encoding="utf-8") as f:
@@ -52,10 +77,6 @@ def get_contract_instance(path, address):
         abi=compiled["abi"])
     return instance
 
-def save_latest_block(block_number):
-    with open(LATEST_BLOCK_LOG_PATH, "w", encoding="utf-8") as f:
-        f.write(str(block_number))
-
 layer2s = {
     "0x39A13a796A3Cd9f480C28259230D2EF0a7026033": "Tokamak1",
     "0x42CCF0769e87CB2952634F607DF1C7d62e0bBC52": "Level 19",
@@ -82,9 +103,8 @@ def format_number(num):
     else:
         return num
 
-def parse_event_deposited(instance, receipt):
+def parse_event_deposited(result):
     log = ""
-    result = instance.events.Deposited().processReceipt(receipt)
 
     newline = False
     for x in result:
@@ -98,9 +118,8 @@ def parse_event_deposited(instance, receipt):
 
     return log
 
-def parse_event_requested(instance, receipt):
+def parse_event_requested(result):
     log = ""
-    result = instance.events.WithdrawalRequested().processReceipt(receipt)
 
     newline = False
     for x in result:
@@ -114,9 +133,8 @@ def parse_event_requested(instance, receipt):
 
     return log
 
-def parse_event_processed(instance, receipt):
+def parse_event_processed(result):
     log = ""
-    result = instance.events.WithdrawalProcessed().processReceipt(receipt)
 
     newline = False
     for x in result:
@@ -131,57 +149,58 @@ def parse_event_processed(instance, receipt):
     return log
 
 def send_message(msg):
-    payload = {"text": msg}
-    requests.post(slack_url, json=payload)
+    # Queued and posted by a worker thread, so block processing never waits for Slack
+    slack.send(msg)
 
-def make_log(instance, event, receipt):
+decoder = LogDecoder(read_contract(BUILD_DEPOSIT_MANAGER_PATH)["abi"], ["Deposited", "WithdrawalRequested", "WithdrawalProcessed"])
+
+event_parsers = {
+    "Deposited": parse_event_deposited,
+    "WithdrawalRequested": parse_event_requested,
+    "WithdrawalProcessed": parse_event_processed,
+}
+
+def make_log(events, timestamp):
+    """One message for the decoded events of one tx, grouped by event type"""
     log = ""
 
-    block = w3.eth.getBlock(event["blockNumber"])
     tz = datetime.timezone(datetime.timedelta(hours=9))
-    log += str(datetime.datetime.fromtimestamp(block["timestamp"], tz))
+    log += str(datetime.datetime.fromtimestamp(timestamp, tz))
     log += "(KST) "
 
-    if event["topics"][0].hex() == event_hash_deposited:
-        log += parse_event_deposited(instance, receipt)
-    elif event["topics"][0].hex() == event_hash_withdrawal_requested:
-        log += parse_event_requested(instance, receipt)
-    elif event["topics"][0].hex() == event_hash_withdrawal_processed:
-        log += parse_event_processed(instance, receipt)
+    parsed = []
+    for name, parser in event_parsers.items():
+        result = [event for event in events if event["event"] == name]
+        if result:
+            parsed.append(parser(result))
+    log += "\n".join(parsed)
 
     return log
 
-def get_events():
-    try:
-        monitoring_events = [
-            event_hash_deposited,
-            event_hash_withdrawal_requested,
-            event_hash_withdrawal_processed
-        ]
-
-        instance = get_contract_instance(BUILD_DEPOSIT_MANAGER_PATH, ADDRESS_DEPOSIT_MANAGER)
-
-        from_block = get_from_block() + 1
-        to_block = min(w3.eth.get_block("latest")["number"], from_block + 100)
-
-        if to_block < from_block:
-            print("waiting for next block")
-            time.sleep(60)
-            return
-
-        logs = w3.eth.getLogs({
-            'fromBlock': from_block,
-            'toBlock': to_block,
-            'address': ADDRESS_DEPOSIT_MANAGER,
-        })
-
-        events = list(filter(lambda log: log["topics"][0].hex() in monitoring_events, logs))
-        events2 = list({event["transactionHash"]:event for event in events}.values())
+# (tx hash, log index) of the logs reported last, oldest first
+reported_logs = {}
+
+def process_events(logs, blocks=None):
+    """Decode logs as returned by getLogs and send one message per tx, without fetching receipts; reported logs are skipped"""
+    txs = {}
+    log_ids = {}
+    for log in logs:
+        log_id = (log["transactionHash"], log["logIndex"])
+        if log_id in reported_logs or log_id in log_ids:
+            continue
+        log_ids[log_id] = True
+
+        event = decoder.decode(log)
+        if event is not None:
+            txs.setdefault(event["transactionHash"], []).append(event)
+    if txs:
+        # One block lookup per block, in one batch
+        if blocks is None:
+            blocks = batch.get_blocks(set(events[0]["blockNumber"] for events in txs.values()))
 
         msgs = []
-        for event in events2:
-            receipt = w3.eth.getTransactionReceipt(event["transactionHash"])
-            log = make_log(instance, event, receipt)
+        for events in txs.values():
+            log = make_log(events, blocks[events[0]["blockNumber"]]["timestamp"])
             msgs.append(log)
 
         for msg in msgs:
@@ -189,14 +208,179 @@ def get_events():
             print("msg:", msg)
             send_message(msg)
 
-        save_latest_block(to_block)
+    # Only once the messages are queued, so the logs of a failed round are reported on the retry
+    reported_logs.update(log_ids)
+    while len(reported_logs) > RECENT_LOG_COUNT:
+        reported_logs.pop(next(iter(reported_logs)))
+
+monitoring_events = decoder.topics()
+
+def poll_events(wait=True):
+    """
+    One polling round over at most 100 confirmed blocks; returns False when there was nothing to
+    process. The range must extend the checkpointed chain, see handle_reorg(). Errors are raised.
+    """
+    from_block = checkpoint.last_block + 1
+    to_block = min(w3.eth.get_block("latest")["number"] - CONFIRMATIONS, from_block + 100)
+
+    if to_block < from_block:
+        if wait:
+            print("waiting for next block")
+            time.sleep(POLL_INTERVAL)
+        return False
+
+    logs = w3.eth.getLogs({
+        'fromBlock': from_block,
+        'toBlock': to_block,
+        'address': ADDRESS_DEPOSIT_MANAGER,
+    })
+
+    try:
+        blocks = checkpoint.check_range(batch.get_blocks, from_block, to_block, logs)
+    except Reorg as reorg:
+        handle_reorg(reorg)
+        return True
+    if blocks is None:
+        if wait:
+            time.sleep(POLL_INTERVAL)
+        return False
+
+    process_events(logs, blocks)
+    checkpoint.record(blocks[to_block], [blocks[log["blockNumber"]] for log in logs])
+    return True
+
+def handle_reorg(reorg):
+    """Roll the checkpoint back to the newest block still on the chain; the blocks after it are read again"""
+    number = checkpoint.rewind(batch.get_blocks)
+    msg = f"⚠️ chain reorg: block {reorg.number} was replaced, blocks after {number} are read again"
+    print(msg)
+    send_message(msg)
+
+def get_events(wait=True):
+    """poll_events() for the polling loops: an error is logged and retried after a pause"""
+    try:
+        return poll_events(wait)
     except Exception as e:
         logging.error(traceback.format_exc())
         time.sleep(60)
+    return True
+
+def catch_up():
+    """
+    Poll until the checkpoint is the confirmed head; returns the last processed block.
+
+    Errors propagate, so a failing RPC ends the subscription and main() falls back to polling.
+    """
+    while poll_events(wait=False):
+        pass
+    return checkpoint.last_block
+
+def format_log(log):
+    """Raw eth_subscription log -> the fields used by the decoder, as returned by getLogs"""
+    return {
+        "address": log["address"],
+        "blockNumber": int(log["blockNumber"], 16),
+        "logIndex": int(log["logIndex"], 16),
+        "transactionHash": HexBytes(log["transactionHash"]),
+        "topics": [HexBytes(topic) for topic in log["topics"]],
+        "data": HexBytes(log["data"]),
+        "removed": log.get("removed", False),
+    }
+
+async def subscribe_events():
+    """
+    Push mode: eth_subscribe to DepositManager logs and new heads on the websocket
+    endpoint and report each event as soon as its log arrives.
+
+    Blocks missed before the subscription was open (or while disconnected) are read
+    with getLogs first. The logs and newHeads subscriptions are not ordered with
+    each other, so a new head does not mean the logs of earlier blocks have all
+    arrived: on every new head the confirmed blocks after the checkpoint are read
+    again with getLogs, which reports any log the subscription missed or has not
+    pushed yet, and only then is the checkpoint advanced. Logs are grouped per tx,
+    so a tx with several events gives one message as in polling mode.
+    """
+    async with websockets.connect(endpoint_url.strip(), max_size=None, max_queue=None) as ws:
+        log_filter = {"address": ADDRESS_DEPOSIT_MANAGER, "topics": [monitoring_events]}
+        await ws.send(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["logs", log_filter]}))
+        await ws.send(json.dumps({"jsonrpc": "2.0", "id": 2, "method": "eth_subscribe", "params": ["newHeads"]}))
+
+        # Subscription ids, notifications that arrive before both are confirmed are kept
+        subscriptions = {}
+        notifications = []
+        while len(subscriptions) < 2:
+            message = json.loads(await asyncio.wait_for(ws.recv(), SUBSCRIPTION_TIMEOUT))
+            if "id" not in message:
+                notifications.append(message)
+                continue
+            if "error" in message:
+                raise Exception(f"eth_subscribe failed: {message['error']}")
+            subscriptions[message["result"]] = "logs" if message["id"] == 1 else "newHeads"
+        print(f"subscribed: {subscriptions}")
+
+        # New notifications wait in the socket while the gap since the checkpoint is polled
+        last_block = await asyncio.to_thread(catch_up)
+        print(f"caught up to block {last_block}, waiting for events")
+
+        # Logs of the tx being received; a tx is reported as one message once its logs are complete
+        pending = []
+
+        async def flush():
+            if pending:
+                events = list(pending)
+                pending.clear()
+                await asyncio.to_thread(process_events, events)
+
+        while True:
+            if notifications:
+                message = notifications.pop(0)
+            else:
+                message = json.loads(await asyncio.wait_for(ws.recv(), SUBSCRIPTION_TIMEOUT))
+
+            params = message.get("params", {})
+            kind = subscriptions.get(params.get("subscription"))
+            result = params.get("result")
+
+            if kind == "newHeads":
+                head = int(result["number"], 16)
+                await flush()
+                if head - CONFIRMATIONS > last_block:
+                    # Pushed logs are reported already; getLogs adds the ones not pushed (yet)
+                    last_block = await asyncio.to_thread(catch_up)
+
+            elif kind == "logs":
+                event = format_log(result)
+                if event["removed"]:
+                    print(f"skipping removed log (reorg): block {event['blockNumber']} tx {event['transactionHash'].hex()}")
+                    continue
+                # Blocks up to last_block were already read with getLogs
+                if event["blockNumber"] <= last_block:
+                    continue
+
+                # The logs of a tx are pushed together, so a new tx hash means the previous tx is complete
+                if pending and pending[-1]["transactionHash"] != event["transactionHash"]:
+                    await flush()
+                pending.append(event)
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--poll", action="store_true", help="poll with getLogs only, no websocket subscriptions")
+    args = parser.parse_args()
+    start_checkpoint()
+
+    if args.poll:
+        while True:
+            get_events()
+
     while True:
+        try:
+            asyncio.run(subscribe_events())
+        except Exception as e:
+            logging.error(traceback.format_exc())
+
+        # Fallback while the subscription is down: one polling round, then subscribe again
+        print("subscription closed, polling")
         get_events()
 
 if __name__ == '__main__':
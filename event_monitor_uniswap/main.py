@@ -3,15 +3,30 @@ import time
 import json
 import logging
 import traceback
-import requests
 import datetime
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.log_decoder import LogDecoder
+from common.rpc_batch import BatchRPC
+from common.slack_queue import SlackQueue
+from common.position_cache import PositionCache
+from common.checkpoint import Checkpoint, Reorg
 
 ADDRESS_MANAGER = "0xC36442b4a4522E871399CD717aBDD847Ab11FE88"
 BUILD_MANAGER_PATH = "NonfungiblePositionManager.json"
 
+CHECKPOINT_PATH = "checkpoint.json"
+# Progress file of earlier versions, read once when there is no checkpoint yet
 LATEST_BLOCK_LOG_PATH = "latest_block"
 ENDPOINT_PATH = ".endpoint"
 SLACK_PATH = ".slack"
+SLACK_SPOOL_PATH = "slack_spool"
+POSITION_CACHE_PATH = "positions.sqlite"
+
+# Blocks behind head that are read and checkpointed
+CONFIRMATIONS = 2
 
 def get_file_data(path):
     data = None
@@ -33,19 +48,23 @@ slack_url = get_file_data(SLACK_PATH)
 
 w3 = Web3(WebsocketProvider(endpoint_url))
 
-event_hash_IncreaseLiquidity = w3.keccak(text="IncreaseLiquidity(uint256,uint128,uint256,uint256)").hex()
-event_hash_DecreaseLiquidity = w3.keccak(text="DecreaseLiquidity(uint256,uint128,uint256,uint256)").hex()
+batch = BatchRPC(w3)
+slack = SlackQueue(slack_url.strip(), SLACK_SPOOL_PATH)
+position_cache = PositionCache(POSITION_CACHE_PATH)
+checkpoint = Checkpoint(CHECKPOINT_PATH)
 
-def get_from_block():
-    from_block = w3.eth.get_block("latest")["number"]
+def start_checkpoint():
+    """Checkpoint to continue from: the saved one, else latest_block of earlier versions, else the confirmed head"""
+    if len(checkpoint):
+        print(f"checkpoint: block {checkpoint.last_block}")
+        return
     try:
         with open(LATEST_BLOCK_LOG_PATH, "r", encoding="utf-8") as f:
-            from_block = int(f.read())
-    except:
-        pass
-
-    print(f"from_block: {from_block}")
-    return from_block
+            checkpoint.start(int(f.read()))
+    except (OSError, ValueError):
+        block = w3.eth.get_block(w3.eth.get_block("latest")["number"] - CONFIRMATIONS)
+        checkpoint.start(block["number"], block["hash"])
+    print(f"checkpoint: starting after block {checkpoint.last_block}")
 
 def read_contract(path):
     with open(path, "r", encoding="utf-8") as f:
@@ -58,10 +77,6 @@ def get_contract_instance(path, address):
         abi=compiled["abi"])
     return instance
 
-def save_latest_block(block_number):
-    with open(LATEST_BLOCK_LOG_PATH, "w", encoding="utf-8") as f:
-        f.write(str(block_number))
-
 def format_number(num):
     if num % 1 == 0:
         return int(num)
@@ -83,36 +98,34 @@ def parse_pair(token0: str, token1: str):
 
     return result
 
-def parse_event_increased_liquidity(instance, receipt):
+def is_tracked(position):
+    """True if the pair of a position has one of the tracked tokens; None (not readable) is not tracked"""
+    return position is not None and (position.token0 in tokens or position.token1 in tokens)
+
+def get_positions(instance, events):
+    """tokenId -> Position for the events, None where it could not be read"""
+    token_blocks = {}
+    for event in events:
+        token_blocks.setdefault(event['args']['tokenId'], event['blockNumber'])
+    return position_cache.resolve(batch, instance, token_blocks)
+
+def parse_event_increased_liquidity(positions, result, operator):
     log = ""
-    result = instance.events.IncreaseLiquidity().processReceipt(receipt)
 
     newline = False
     for x in result:
-        operator = ""
         tickLower = "-"
         tickUpper = "-"
         token0 = ""
         token1 = ""
-        tx = w3.eth.get_transaction_receipt(x['transactionHash'])
-        operator = tx['from']
-        try:
-            #TODO: handle MEV tx
-            positions = instance.functions.positions(x['args']['tokenId']).call(block_identifier=x['blockNumber'])
-#operator = positions[1]
-            tickLower = positions[5]
-            tickUpper = positions[6]
-            token0 = positions[2]
-            token1 = positions[3]
-            if token0 not in tokens and token1 not in tokens:
-                return None
-        except Exception as e:
-            print("#" * 80)
-            print("error:")
-#print(str(e) == "execution reverted: Invalid token ID")
-            print(e)
-            print(f"tx: {tx['transactionHash'].hex()}")
+        #TODO: handle MEV tx
+        position = positions.get(x['args']['tokenId'])
+        if not is_tracked(position):
             return None
+        tickLower = position.tick_lower
+        tickUpper = position.tick_upper
+        token0 = position.token0
+        token1 = position.token1
 
         pair = parse_pair(token0, token1)
 
@@ -127,35 +140,23 @@ def parse_event_increased_liquidity(instance, receipt):
 
     return log
 
-def parse_event_decreased_liquidity(instance, receipt):
+def parse_event_decreased_liquidity(positions, result, operator):
     log = ""
-    result = instance.events.DecreaseLiquidity().processReceipt(receipt)
 
     newline = False
     for x in result:
-        operator = ""
         tickLower = "-"
         tickUpper = "-"
         token0 = ""
         token1 = ""
-        tx = w3.eth.get_transaction_receipt(x['transactionHash'])
-        operator = tx['from']
-        try:
-            #TODO: handle MEV tx
-            positions = instance.functions.positions(x['args']['tokenId']).call(block_identifier=x['blockNumber'])
-#operator = positions[1]
-            tickLower = positions[5]
-            tickUpper = positions[6]
-            token0 = positions[2]
-            token1 = positions[3]
-            if token0 not in tokens and token1 not in tokens:
-                return None
-        except Exception as e:
-            print("#" * 80)
-            print("error:")
-            print(e)
-            print(f"tx: {tx['transactionHash'].hex()}")
+        #TODO: handle MEV tx
+        position = positions.get(x['args']['tokenId'])
+        if not is_tracked(position):
             return None
+        tickLower = position.tick_lower
+        tickUpper = position.tick_upper
+        token0 = position.token0
+        token1 = position.token1
 
         pair = parse_pair(token0, token1)
 
@@ -171,39 +172,50 @@ def parse_event_decreased_liquidity(instance, receipt):
     return log
 
 def send_message(msg):
-    payload = {"text": msg}
-    requests.post(slack_url, json=payload)
+    # Queued and posted by a worker thread, so block processing never waits for Slack
+    slack.send(msg)
+
+decoder = LogDecoder(read_contract(BUILD_MANAGER_PATH)["abi"], ["IncreaseLiquidity", "DecreaseLiquidity"])
+
+event_parsers = {
+    "IncreaseLiquidity": parse_event_increased_liquidity,
+    "DecreaseLiquidity": parse_event_decreased_liquidity,
+}
 
-def make_log(instance, event, receipt):
+def make_log(positions, events, timestamp, operator):
+    """One message for the decoded events of one tx; None when a position is not a monitored pair"""
     log = ""
 
-    block = w3.eth.getBlock(event["blockNumber"])
     tz = datetime.timezone(datetime.timedelta(hours=9))
-    log += str(datetime.datetime.fromtimestamp(block["timestamp"], tz))
+    log += str(datetime.datetime.fromtimestamp(timestamp, tz))
     log += "(KST) "
 
-    buf = None
-    if event["topics"][0].hex() == event_hash_IncreaseLiquidity:
-        buf = parse_event_increased_liquidity(instance, receipt)
-    elif event["topics"][0].hex() == event_hash_DecreaseLiquidity:
-        buf = parse_event_decreased_liquidity(instance, receipt)
-    if buf is None:
-        return None
-    log += buf
+    parsed = []
+    for name, parser in event_parsers.items():
+        result = [event for event in events if event["event"] == name]
+        if not result:
+            continue
+        buf = parser(positions, result, operator)
+        if buf is None:
+            return None
+        parsed.append(buf)
+    log += "\n".join(parsed)
 
     return log
 
+def handle_reorg(reorg):
+    """Roll the checkpoint back to the newest block still on the chain; events after it are reported again"""
+    number = checkpoint.rewind(batch.get_blocks)
+    msg = f"⚠️ chain reorg: block {reorg.number} was replaced, events after block {number} are reported again"
+    print(msg)
+    send_message(msg)
+
 def get_events():
     try:
-        monitoring_events = [
-            event_hash_IncreaseLiquidity,
-            event_hash_DecreaseLiquidity
-        ]
-
         instance = get_contract_instance(BUILD_MANAGER_PATH, ADDRESS_MANAGER)
 
-        from_block = get_from_block() + 1
-        to_block = min(w3.eth.get_block("latest")["number"], from_block + 1000)
+        from_block = checkpoint.last_block + 1
+        to_block = min(w3.eth.get_block("latest")["number"] - CONFIRMATIONS, from_block + 1000)
 
         if to_block < from_block:
             print("waiting for next block")
@@ -217,30 +229,57 @@ def get_events():
             'fromBlock': from_block,
             'toBlock': to_block,
             'address': ADDRESS_MANAGER,
+            "topics": [decoder.topics()]
         })
 
-        events = list(filter(lambda log: log["topics"][0].hex() in monitoring_events, logs))
-        events2 = list({event["transactionHash"]:event for event in events}.values())
+        # The range must extend the checkpointed chain and its logs come from one chain
+        try:
+            blocks = checkpoint.check_range(batch.get_blocks, from_block, to_block, logs)
+        except Reorg as reorg:
+            handle_reorg(reorg)
+            return
+        if blocks is None:
+            time.sleep(60)
+            return
+
+        # Decoded straight from the logs, grouped by tx
+        txs = {}
+        for log in logs:
+            event = decoder.decode(log)
+            if event is not None:
+                txs.setdefault(event["transactionHash"], []).append(event)
+
+        # Positions first (mostly from the cache), so txs of untracked pairs are dropped before any other RPC
+        positions = get_positions(instance, [event for events in txs.values() for event in events])
+        txs = {
+            tx_hash: events for tx_hash, events in txs.items()
+            if all(is_tracked(positions[event['args']['tokenId']]) for event in events)
+        }
+        print(f"positions: {len(positions)} ({position_cache.hits} cache hits, {position_cache.misses} misses in total)")
 
         msgs = []
-        for event in events2:
-            receipt = w3.eth.getTransactionReceipt(event["transactionHash"])
-            log = make_log(instance, event, receipt)
-            if log is not None:
-                msgs.append(log)
+        if txs:
+            # Sender of every tx in one batch; block timestamps come with the checked headers
+            senders = [tx["from"] for tx in batch.get_transactions(list(txs))]
+
+            for events, operator in zip(txs.values(), senders):
+                log = make_log(positions, events, blocks[events[0]["blockNumber"]]["timestamp"], operator)
+                if log is not None:
+                    msgs.append(log)
 
         for msg in msgs:
             print("$"*80)
             print("msg:", msg)
             send_message(msg)
 
-        save_latest_block(to_block)
+        checkpoint.record(blocks[to_block], [blocks[log["blockNumber"]] for log in logs])
     except Exception as e:
         logging.error(traceback.format_exc())
         time.sleep(60)
 
 
 def main():
+    start_checkpoint()
     while True:
         get_events()
 
@@ -7,13 +7,28 @@ import csv
 from web3 import Web3, HTTPProvider
 from datetime import datetime
 import asyncio
+import argparse
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.log_fetcher import fetch_logs, RangePlanner
+from common.rpc_batch import BatchRPC
+from common.multicall import multicall
+from common.log_decoder import LogDecoder
+from common.event_store import EventStore, DEFAULT_EVENT_STORE_PATH
+from common.ledger import replay
+from common import profiler
+from common.rpc_pool import provider_from_env
+
 # Load .env file
 load_dotenv()
 
 RPC_ENDPOINT = os.getenv("RPC_ENDPOINT_URL")
 
+# Local event store filled by get_all_transactions/sync_events.py, used by --offline
+EVENT_STORE_PATH = os.getenv("EVENT_STORE_PATH", DEFAULT_EVENT_STORE_PATH)
+CHAIN_ID = 1  # Ethereum mainnet
+
 ADDRESS_DEPOSIT_MANAGER = "0x0b58ca72b12F01FC05F8f252e226f3E2089BD00E"
 PATH_DEPOSIT_MANAGER = "DepositManager.json"
 
@@ -29,6 +44,12 @@ BLOCK_NUMBER_SNAPSHOT = 22846796
 # Block chunk size setting (number of blocks to read at once)
 BLOCK_CHUNK_SIZE = 9990
 
+# Number of chunks requested from the RPC at the same time (1 = sequential)
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "4"))
+
+# Number of JSON-RPC calls sent in one batch request
+RPC_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE", "100"))
+
 # layer2s = [
 #     "0xf3B17FDB808c7d0Df9ACd24dA34700ce069007DF",
 #     "0x44e3605d0ed58FD125E9C47D1bf25a4406c13b57",
@@ -56,60 +77,62 @@ def get_contract_instance(w3, path, address):
         abi=compiled["abi"])
     return instance
 
-def get_stakers(w3, from_block, to_block):
-    instance = get_contract_instance(w3, PATH_DEPOSIT_MANAGER, ADDRESS_DEPOSIT_MANAGER)
-    event_signature_hash = w3.keccak(text="Deposited(address,address,uint256)").hex()
+def get_stakers(w3, from_block, to_block, strict=False):
+    decoder = LogDecoder(get_compiled_contract(PATH_DEPOSIT_MANAGER)["abi"], ["Deposited"])
+    event_signature_hash = decoder.topics()[0]
 
     total_blocks = to_block - from_block + 1
-    total_chunks = (total_blocks + BLOCK_CHUNK_SIZE - 1) // BLOCK_CHUNK_SIZE
 
     print(f"📊 Total block range: {from_block} ~ {to_block} ({total_blocks:,} blocks)")
-    print(f"📦 Chunk size: {BLOCK_CHUNK_SIZE:,} blocks")
-    print(f"📦 Total chunks: {total_chunks}")
+    print(f"📦 Initial chunk size: {BLOCK_CHUNK_SIZE:,} blocks (adaptive)")
+    print(f"⚡ Chunks in flight: {MAX_IN_FLIGHT}")
     print(f"🔍 Starting Deposited event search...")
 
     all_logs = []
     stakers = set([])
     total_events = 0
 
-    # Process blocks in chunks
-    for chunk_idx in range(total_chunks):
-        chunk_start = from_block + (chunk_idx * BLOCK_CHUNK_SIZE)
-        chunk_end = min(chunk_start + BLOCK_CHUNK_SIZE - 1, to_block)
-
-        print(f"\n📦 Chunk {chunk_idx + 1}/{total_chunks}: blocks {chunk_start} ~ {chunk_end}")
+    filter_params = {
+        'address': ADDRESS_DEPOSIT_MANAGER,
+        "topics": [event_signature_hash]
+    }
+
+    # Process blocks in chunks, split on RPC limits and retried on transient errors
+    planner = RangePlanner(BLOCK_CHUNK_SIZE)
+    chunks = fetch_logs(w3, filter_params, from_block, to_block, BLOCK_CHUNK_SIZE, MAX_IN_FLIGHT, planner)
+    for chunk_idx, chunk in enumerate(profiler.timed(chunks, "fetch logs")):
+        progress = (chunk.end - from_block + 1) / total_blocks * 100
+        print(f"\n📦 Chunk {chunk_idx + 1}: blocks {chunk.start} ~ {chunk.end} ({progress:.1f}%)")
+
+        if chunk.error is not None:
+            print(f"   ❌ Chunk {chunk_idx + 1} query failed: {str(chunk.error)}")
+            if strict:
+                raise chunk.error
+            continue
 
-        try:
-            logs = w3.eth.get_logs({
-                'fromBlock': chunk_start,
-                'toBlock': chunk_end,
-                'address': ADDRESS_DEPOSIT_MANAGER,
-                "topics": [event_signature_hash]
-            })
+        print(f"   ✅ Found {len(chunk.logs)} events")
+        all_logs.extend(chunk.logs)
+        total_events += len(chunk.logs)
 
-            print(f"   ✅ Found {len(logs)} events")
-            all_logs.extend(logs)
-            total_events += len(logs)
-
-        except Exception as e:
-            print(f"   ❌ Chunk {chunk_idx + 1} query failed: {str(e)}")
-            continue
+    print()
+    planner.print_report()
 
     print(f"\n✅ Total {total_events} Deposited events found")
     print(f"📋 Event details:")
 
     # Process each log directly to ensure all events are aggregated
-    for i, log in enumerate(all_logs, 1):
-        # Extract event data directly from log
-        decoded_log = instance.events.Deposited().process_log(log)
-        depositor = decoded_log["args"]["depositor"]
-        amount = decoded_log["args"]["amount"]
-        tx_hash = log["transactionHash"].hex()
-        block_number = log["blockNumber"]
+    with profiler.stage("decode"):
+        for i, log in enumerate(all_logs, 1):
+            # Extract event data directly from log
+            decoded_log = decoder.decode(log)
+            depositor = decoded_log["args"]["depositor"]
+            amount = decoded_log["args"]["amount"]
+            tx_hash = log["transactionHash"].hex()
+            block_number = log["blockNumber"]
 
-        stakers.add(depositor)
+            stakers.add(depositor)
 
-        # print(f"[{i:3d}/{len(all_logs)}] Block {block_number} | TX: {tx_hash[:10]}... | Depositor: {depositor[:10]}... | Amount: {float(amount)/1e27:.4f}")
+            # print(f"[{i:3d}/{len(all_logs)}] Block {block_number} | TX: {tx_hash[:10]}... | Depositor: {depositor[:10]}... | Amount: {float(amount)/1e27:.4f}")
 
     print(f"🎯 Found {len(stakers)} unique stakers")
     return stakers, total_events
@@ -123,6 +146,29 @@ def get_total_staked_amount(instance_seigmanager, account):
     #     staked_amount += instance_seigmanager.functions.stakeOf(layer2, account).call()
     return staked_amount
 
+def get_total_staked_amounts(w3, batch, instance_seigmanager, accounts, block_number):
+    """stakeOf for many accounts at one block, packed into Multicall3 aggregate calls"""
+    functions = [instance_seigmanager.functions.stakeOf(account) for account in accounts]
+    return multicall(w3, functions, block_identifier=block_number, batch=batch)
+
+def get_principals_offline(to_block):
+    """
+    Stakers and their principal (Deposited - WithdrawalRequested) at to_block,
+    replayed from the local event store without any RPC. Seigniorage is not included.
+    """
+    store = EventStore(EVENT_STORE_PATH)
+    missing = store.missing_ranges(CHAIN_ID, ADDRESS_DEPOSIT_MANAGER, BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED, to_block)
+    if missing:
+        store.close()
+        print(f"⚠️ Event store is missing blocks {missing}, run `python sync_events.py sync` in get_all_transactions first")
+        return None, 0
+
+    with profiler.stage("replay event store"):
+        ledger = replay(store, CHAIN_ID, ADDRESS_DEPOSIT_MANAGER, get_compiled_contract(PATH_DEPOSIT_MANAGER)["abi"], to_block)
+    store.close()
+    print(f"📚 Replayed {len(ledger):,} events of {len(ledger.keys):,} (layer2, depositor) pairs up to block {to_block}")
+    return ledger.stakers_at(to_block), ledger.event_counts["Deposited"]
+
 def save_results_to_files(stakers_ordered, total_deposited_events, unique_stakers_count):
     """Save results to multiple file formats"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -192,28 +238,50 @@ def save_results_to_files(stakers_ordered, total_deposited_events, unique_staker
     # return csv_filename, json_filename, summary_filename
     return csv_filename, summary_filename
 
-def get_all_stakers():
+def get_all_stakers(offline=False, snapshot_block=BLOCK_NUMBER_SNAPSHOT, w3=None, strict=False):
+    """
+    [(staker, stakeOf in WTON wei)] at snapshot_block sorted by amount, the stakers count and the Deposited events count.
+
+    A failed log range, connection or event store gap is reported and skipped, or
+    raised with `strict` so callers never get a partial list.
+    """
     print("🚀 Starting staker query...")
-    print(f"🔗 RPC endpoint: {RPC_ENDPOINT[:50]}...")
 
-    w3 = Web3(HTTPProvider(RPC_ENDPOINT))
+    if offline:
+        print(f"\n💰 Principal of each staker at block {snapshot_block} from the local event store (no RPC)...")
+        principals, total_events = get_principals_offline(snapshot_block)
+        if principals is None:
+            if strict:
+                raise ValueError(f"Event store is missing blocks up to {snapshot_block}, run `sync` first")
+            return [], 0, 0
+        stakers_ordered = sorted(principals.items(), key=lambda x: x[1], reverse=True)
+        return stakers_ordered, len(stakers_ordered), total_events
+
+    if w3 is None:
+        w3 = profiler.install(Web3(provider_from_env(RPC_ENDPOINT)))
+    print(f"🔗 RPC endpoint: {str(w3.provider)[:50]}...")
 
     # Check connection
     if w3.is_connected():
         print("✅ Blockchain connection successful")
     else:
         print("❌ Blockchain connection failed")
-        return []
+        if strict:
+            raise ConnectionError(f"Blockchain connection failed: {str(w3.provider)[:50]}")
+        return [], 0, 0
 
     # current_block_number = w3.eth.getBlock("latest")["number"]
-    stakers, total_events = get_stakers(w3, BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED, BLOCK_NUMBER_SNAPSHOT)
+    stakers, total_events = get_stakers(w3, BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED, snapshot_block, strict)
 
-    print(f"\n💰 Querying current staking amounts for each staker...")
+    print(f"\n💰 Querying staking amounts for each staker at block {snapshot_block} (multicall)...")
     instance_seigmanager = get_contract_instance(w3, PATH_SEIG_MANAGER, ADDRESS_SEIG_MANAGER)
 
+    stakers = list(stakers)
+    with profiler.stage("stakeOf multicall"):
+        amounts = get_total_staked_amounts(w3, BatchRPC(w3, RPC_BATCH_SIZE), instance_seigmanager, stakers, snapshot_block)
+
     stakers_ordered = []
-    for i, staker in enumerate(stakers, 1):
-        amount = get_total_staked_amount(instance_seigmanager, staker)
+    for i, (staker, amount) in enumerate(zip(stakers, amounts), 1):
         stakers_ordered.append((staker, amount))
         print(f"[{i:3d}/{len(stakers)}] {staker}: {float(amount)/1e27:.4f} TON")
 
@@ -222,7 +290,13 @@ def get_all_stakers():
     return stakers_ordered, len(stakers), total_events
 
 if __name__ == '__main__':
-    ordered_stakers, unique_count, total_events = get_all_stakers()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--offline", action="store_true", help="principal (without seigniorage) replayed from the local event store instead of stakeOf calls")
+    profiler.add_arguments(parser)
+    args = parser.parse_args()
+    profiler.start(args)
+
+    ordered_stakers, unique_count, total_events = get_all_stakers(args.offline)
 
     # Output results to console
     print("\n" + "="*80)
@@ -236,11 +310,13 @@ if __name__ == '__main__':
     print("💾 Saving results to files...")
     print("="*50)
 
-    csv_file, summary_file = save_results_to_files(
-        ordered_stakers, total_events, unique_count
-    )
+    with profiler.stage("write files"):
+        csv_file, summary_file = save_results_to_files(
+            ordered_stakers, total_events, unique_count
+        )
 
     print("\n✅ All tasks completed!")
     print(f"📁 Generated files:")
     print(f"   - {csv_file}")
-    print(f"   - {summary_file}")
\ No newline at end of file
+    print(f"   - {summary_file}")
+    profiler.finish(args)
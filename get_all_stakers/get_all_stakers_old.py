@@ -1,11 +1,17 @@
 import json
 import sys
+import os
 import time
 import pprint
 from web3 import Web3, WebsocketProvider
 from datetime import datetime
 import asyncio
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.rpc_batch import BatchRPC
+from common.multicall import multicall
+from common.log_decoder import LogDecoder
+
 RPC_ENDPOINT = "YOUR_INFURA_URL"
 
 ADDRESS_DEPOSIT_MANAGER = "0x56E465f654393fa48f007Ed7346105c7195CEe43"
@@ -17,6 +23,9 @@ PATH_SEIG_MANAGER = "SeigManager.json"
 BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED = 10837675
 BLOCK_NUMBER_SNAPSHOT = 14995351
 
+# Number of JSON-RPC calls sent in one batch request
+RPC_BATCH_SIZE = 100
+
 layer2s = [
     "0x42CCF0769e87CB2952634F607DF1C7d62e0bBC52",
     "0x39A13a796A3Cd9f480C28259230D2EF0a7026033",
@@ -44,8 +53,8 @@ def get_contract_instance(w3, path, address):
     return instance
 
 def get_stakers(w3, from_block, to_block):
-    instance = get_contract_instance(w3, PATH_DEPOSIT_MANAGER, ADDRESS_DEPOSIT_MANAGER)
-    event_signature_hash = w3.keccak(text="Deposited(address,address,uint256)").hex()
+    decoder = LogDecoder(get_compiled_contract(PATH_DEPOSIT_MANAGER)["abi"], ["Deposited"])
+    event_signature_hash = decoder.topics()[0]
     logs = w3.eth.getLogs({
         'fromBlock': from_block,
         'toBlock': to_block,
@@ -53,15 +62,11 @@ def get_stakers(w3, from_block, to_block):
         "topics": [event_signature_hash]
     })
 
-    txs = list(map(lambda x: (x["blockNumber"], x["transactionHash"].hex()), logs))
-
     stakers = set([])
 
-    for tx in txs:
-        receipt = w3.eth.getTransactionReceipt(tx[1])
-
-        tmp = instance.events.Deposited().processReceipt(receipt)
-        depositor = tmp[0]["args"]["depositor"]
+    # The depositor is in the log itself, no receipt needed
+    for log in logs:
+        depositor = decoder.decode(log)["args"]["depositor"]
         stakers.add(depositor)
 
     return stakers
@@ -72,6 +77,12 @@ def get_total_staked_amount(instance_seigmanager, account):
         staked_amount += instance_seigmanager.functions.stakeOf(layer2, account).call()
     return staked_amount
 
+def get_total_staked_amounts(w3, batch, instance_seigmanager, accounts, block_number):
+    """stakeOf(layer2, account) summed over layer2s for many accounts at one block, packed into Multicall3 aggregate calls"""
+    functions = [instance_seigmanager.functions.stakeOf(layer2, account) for account in accounts for layer2 in layer2s]
+    amounts = multicall(w3, functions, block_identifier=block_number, batch=batch)
+    return [sum(amounts[i * len(layer2s):(i + 1) * len(layer2s)]) for i in range(len(accounts))]
+
 def get_all_stakers():
     w3 = Web3(WebsocketProvider(RPC_ENDPOINT))
     current_block_number = w3.eth.getBlock("latest")["number"]
@@ -79,9 +90,11 @@ def get_all_stakers():
 
     instance_seigmanager = get_contract_instance(w3, PATH_SEIG_MANAGER, ADDRESS_SEIG_MANAGER)
 
+    stakers = list(stakers)
+    amounts = get_total_staked_amounts(w3, BatchRPC(w3, RPC_BATCH_SIZE), instance_seigmanager, stakers, BLOCK_NUMBER_SNAPSHOT)
+
     stakers_ordered = []
-    for staker in stakers:
-        amount = get_total_staked_amount(instance_seigmanager, staker)
+    for staker, amount in zip(stakers, amounts):
         stakers_ordered.append((staker, amount))
 
     stakers_ordered.sort(key=lambda x: x[1], reverse=True)
@@ -1,11 +1,22 @@
 import json
 import sys
+import os
 import time
 import pprint
-from web3 import Web3, WebsocketProvider
+from web3 import Web3
 from datetime import datetime
 import asyncio
+import argparse
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.rpc_batch import BatchRPC
+from common.log_decoder import LogDecoder
+from common.log_fetcher import fetch_logs, RangePlanner
+from common.multicall import multicall
+from common import profiler
+from common.rpc_pool import provider_from_env
+
+# HTTP URL; a websocket connection cannot serve MAX_IN_FLIGHT concurrent getLogs
 RPC_ENDPOINT = "YOUR_INFURA_URL"
 
 ADDRESS_DEPOSIT_MANAGER = "0x56E465f654393fa48f007Ed7346105c7195CEe43"
@@ -15,6 +26,16 @@ PATH_STAKE_TON = "StakeTONProxy.json"
 BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED = 10837675
 BLOCK_NUMBER_EVENT_START = 12223496
 BLOCK_NUMBER_SNAPSHOT = 14995351
+BLOCK_NUMBER_PHASE1_START = 12880649
+
+# Block chunk size of the vault scan, adapted to the RPC limits as it goes
+BLOCK_CHUNK_SIZE = 9990
+
+# Number of chunks requested from the RPC at the same time (1 = sequential)
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "4"))
+
+# Number of JSON-RPC calls sent in one batch request
+RPC_BATCH_SIZE = 100
 
 stake_ton_contract_addresses = [
     "0x9a8294566960Ab244d78D266FFe0f284cDf728F1"
@@ -33,64 +54,73 @@ def get_contract_instance(w3, path, address):
         abi=compiled["abi"])
     return instance
 
-def get_stakers(w3, contract_address, from_block, to_block):
-    event_signature_hash = w3.keccak(text="Staked(address,uint256)").hex()
-    logs = w3.eth.getLogs({
-        'fromBlock': from_block,
-        'toBlock': to_block,
-        'address': contract_address,
-        "topics": [event_signature_hash]
-    })
-
-    txs = list(map(lambda x: (x["blockNumber"], x["transactionHash"].hex()), logs))
-
-    stakers = set([])
-    stakers_block = {}
-
-    accumulateAmount = {}
-
-    instance = get_contract_instance(w3, PATH_STAKE_TON, contract_address)    
-    end_block = instance.functions.endBlock().call()
-    print(f"end_block: {end_block}")
-    for tx in txs:
-        receipt = w3.eth.getTransactionReceipt(tx[1])
-        
-        tmp = instance.events.Staked().processReceipt(receipt)
-        params = tmp[0]["args"]
-
-        if params["to"] not in accumulateAmount:
-            accumulateAmount[params["to"]] = params["amount"]
-        else:
-            accumulateAmount[params["to"]] += params["amount"]
+def get_stakers(w3, batch, contract_addresses, from_block, to_block, snapshot_block):
+    """
+    {user: amount staked at snapshot_block, summed over every vault} (TON wei, exact integers).
+
+    All vaults are scanned with one address-list getLogs per range, Staked(to, amount)
+    is decoded from the logs themselves, and getUserStaked of every (vault, user)
+    pair is read with Multicall3 aggregate calls at the snapshot block.
+    """
+    decoder = LogDecoder(get_compiled_contract(PATH_STAKE_TON)["abi"], ["Staked"])
+    filter_params = {
+        'address': contract_addresses,
+        "topics": [decoder.topics()[0]]
+    }
+
+    users = {Web3.to_checksum_address(address): set() for address in contract_addresses}
+    planner = RangePlanner(BLOCK_CHUNK_SIZE)
+    chunks = fetch_logs(w3, filter_params, from_block, to_block, BLOCK_CHUNK_SIZE, MAX_IN_FLIGHT, planner)
+    for chunk in profiler.timed(chunks, "fetch logs"):
+        if chunk.error is not None:
+            raise chunk.error
+        with profiler.stage("decode"):
+            for log in chunk.logs:
+                users[Web3.to_checksum_address(log["address"])].add(decoder.decode(log)["args"]["to"])
+    for address, vault_users in users.items():
+        print(f"{address}: {len(vault_users)} stakers")
+
+    abi = get_compiled_contract(PATH_STAKE_TON)["abi"]
+    pairs = [(address, user) for address, vault_users in users.items() for user in sorted(vault_users)]
+    functions = [w3.eth.contract(address=address, abi=abi).functions.getUserStaked(user) for address, user in pairs]
+    with profiler.stage("getUserStaked calls"):
+        user_staked = multicall(w3, functions, block_identifier=snapshot_block, batch=batch)
 
     current_balances = {}
-    for k, v in accumulateAmount.items():
-        currentAmount = instance.functions.getUserStaked(k).call(block_identifier=BLOCK_NUMBER_SNAPSHOT)
-        if k not in current_balances:
-            current_balances[k] = currentAmount[0]
-        else:
-            current_balances[k] += currentAmount[0]
-
+    for (_, user), staked in zip(pairs, user_staked):
+        current_balances[user] = current_balances.get(user, 0) + staked[0]
     return current_balances
 
-def get_phase1_stakers():
-    w3 = Web3(WebsocketProvider(RPC_ENDPOINT))
+def get_phase1_balances(snapshot_block=BLOCK_NUMBER_SNAPSHOT, w3=None):
+    """{user: phase-1 amount staked at snapshot_block} in TON wei"""
+    if w3 is None:
+        w3 = profiler.install(Web3(provider_from_env(RPC_ENDPOINT)))
+    batch = BatchRPC(w3, RPC_BATCH_SIZE)
+    return get_stakers(w3, batch, stake_ton_contract_addresses, BLOCK_NUMBER_PHASE1_START, snapshot_block, snapshot_block)
 
-    current_balances = {}
-    for x in stake_ton_contract_addresses:
-        balances = get_stakers(w3, x, 12880649, BLOCK_NUMBER_SNAPSHOT)
-        for k, v in balances.items():
-            if k not in current_balances:
-                current_balances[k] = float(v)/1e18
-            else:
-                current_balances[k] += float(v)/1e18
+def get_phase1_stakers():
+    current_balances = {k: float(v)/1e18 for k, v in get_phase1_balances().items()}
     ordered = sorted(current_balances.items(), key=lambda x: x[1], reverse=True)
     return ordered
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--block", type=int, help="snapshot block; prints exact wei amounts at it")
+    profiler.add_arguments(parser)
+    args = parser.parse_args()
+    profiler.start(args)
+
+    if args.block is not None:
+        balances = get_phase1_balances(args.block)
+        for user, amount in sorted(balances.items(), key=lambda x: x[1], reverse=True):
+            print(f"{user}: {amount}")
+        profiler.finish(args)
+        sys.exit(0)
+
     ordered = get_phase1_stakers()
     print("#" * 80)
     print("#" * 80)
     print(ordered)
     for x in ordered:
-        print(f"{x[0]}: {x[1]:.4f}")
\ No newline at end of file
+        print(f"{x[0]}: {x[1]:.4f}")
+    profiler.finish(args)
@@ -1,18 +1,35 @@
-import get_phase1_stakers
+import os
+import sys
+import argparse
+from web3 import Web3
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import profiler
+from common.rpc_pool import provider_from_env
+
 import get_all_stakers
+import snapshot
 
 if __name__ == '__main__':
-    ordered = get_phase1_stakers.get_phase1_stakers()
+    parser = argparse.ArgumentParser(description="Phase 1 stakers and all stakers merged at one block")
+    subparsers = parser.add_subparsers(dest="command")
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="staked amount of every address at a block")
+    snapshot_parser.add_argument("--block", type=int, default=get_all_stakers.BLOCK_NUMBER_SNAPSHOT)
+    snapshot_parser.add_argument("--sources", nargs="+", choices=snapshot.SOURCES, default=list(snapshot.SOURCES))
+    snapshot_parser.add_argument("--refresh", action="store_true", help="query the chain even if the snapshot is cached")
+    profiler.add_arguments(snapshot_parser)
 
-    stakers = get_all_stakers.get_all_stakers()
-    all_stakers = {x[0] : float(x[1])/1e27 for x in stakers}
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(["snapshot"] + sys.argv[1:])
+    profiler.start(args)
 
-    for x in ordered:
-        if x[0] not in all_stakers:
-            all_stakers[x[0]] = x[1]
-        else:
-          all_stakers[x[0]] += x[1]
+    w3 = profiler.install(Web3(provider_from_env(get_all_stakers.RPC_ENDPOINT)))
+    result = snapshot.take_snapshot(args.block, args.sources, w3, args.refresh)
 
-    all_stakers = sorted(all_stakers.items(), key=lambda x: x[1], reverse=True)
+    all_stakers = sorted(result["total"].items(), key=lambda x: x[1], reverse=True)
     for x in all_stakers:
-        print(f"{x[0]}: {x[1]:.4f}")
\ No newline at end of file
+        print(f"{x[0]}: {snapshot.format_wton(x[1])}")
+    print(f"🎯 {len(all_stakers)} stakers at block {args.block}, total {snapshot.format_wton(sum(result['total'].values()))} TON")
+    profiler.finish(args)
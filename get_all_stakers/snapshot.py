@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import get_all_stakers
+import get_phase1_stakers
+
+# Phase-1 vault amounts are TON (18 decimals), stakeOf amounts are WTON (27 decimals)
+TON_TO_WTON = 10 ** 9
+WTON_DECIMALS = 27
+
+SOURCES = ("stakers", "phase1")
+
+SNAPSHOT_CACHE_PATH = os.getenv("SNAPSHOT_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshots"))
+
+
+def source_config(source):
+    """Everything besides the block that a source's numbers depend on; part of the cache key"""
+    if source == "stakers":
+        return {
+            "deposit_manager": get_all_stakers.ADDRESS_DEPOSIT_MANAGER,
+            "seig_manager": get_all_stakers.ADDRESS_SEIG_MANAGER,
+            "from_block": get_all_stakers.BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED,
+        }
+    return {
+        "vaults": sorted(get_phase1_stakers.stake_ton_contract_addresses),
+        "from_block": get_phase1_stakers.BLOCK_NUMBER_PHASE1_START,
+    }
+
+
+def cache_key(block, sources):
+    key = {
+        "chain_id": get_all_stakers.CHAIN_ID,
+        "block": block,
+        "sources": {source: source_config(source) for source in sorted(sources)},
+    }
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return key, digest
+
+
+def cache_path(block, sources):
+    _, digest = cache_key(block, sources)
+    return os.path.join(SNAPSHOT_CACHE_PATH, f"{digest}.json")
+
+
+def load_snapshot(block, sources=SOURCES):
+    """Cached snapshot of `sources` at `block`, or None; amounts are int WTON wei"""
+    path = cache_path(block, sources)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        cached = json.load(f)
+    return {
+        "key": cached["key"],
+        "total": {address: int(amount) for address, amount in cached["total"].items()},
+        "sources": {
+            source: {address: int(amount) for address, amount in amounts.items()}
+            for source, amounts in cached["sources"].items()
+        },
+    }
+
+
+def _save_snapshot(block, sources, result):
+    key, digest = cache_key(block, sources)
+    os.makedirs(SNAPSHOT_CACHE_PATH, exist_ok=True)
+    path = os.path.join(SNAPSHOT_CACHE_PATH, f"{digest}.json")
+    # uint256 amounts are stored as strings so every JSON reader keeps them exact
+    data = {
+        "key": key,
+        "total": {address: str(amount) for address, amount in result["total"].items()},
+        "sources": {
+            source: {address: str(amount) for address, amount in amounts.items()}
+            for source, amounts in result["sources"].items()
+        },
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_source(source, block, w3):
+    """{address: amount in WTON wei} of one source at `block`; raises rather than return a partial source"""
+    if source == "stakers":
+        ordered, _, _ = get_all_stakers.get_all_stakers(snapshot_block=block, w3=w3, strict=True)
+        return dict(ordered)
+    balances = get_phase1_stakers.get_phase1_balances(block, w3)
+    return {address: amount * TON_TO_WTON for address, amount in balances.items()}
+
+
+def take_snapshot(block, sources=SOURCES, w3=None, refresh=False):
+    """
+    Staked amounts of every address at `block` from `sources`, as exact WTON wei integers.
+
+    The sources are read at the same block in parallel and merged by integer
+    addition. Results are cached in a file named by the hash of (chain, block,
+    sources and their contract addresses), so repeated runs and downstream jobs
+    get the same numbers without touching the chain. A source that fails raises
+    and nothing is cached.
+    """
+    sources = sorted(set(sources))
+    if not refresh:
+        cached = load_snapshot(block, sources)
+        if cached is not None:
+            print(f"💾 Snapshot at block {block} ({', '.join(sources)}) from {cache_path(block, sources)}")
+            return cached
+
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        futures = {source: executor.submit(read_source, source, block, w3) for source in sources}
+        amounts = {source: future.result() for source, future in futures.items()}
+
+    total = {}
+    for source_amounts in amounts.values():
+        for address, amount in source_amounts.items():
+            total[address] = total.get(address, 0) + amount
+    total = {address: amount for address, amount in total.items() if amount}
+
+    result = {"key": cache_key(block, sources)[0], "total": total, "sources": amounts}
+    path = _save_snapshot(block, sources, result)
+    print(f"💾 Snapshot saved to {path}")
+    return result
+
+
+def format_wton(amount, decimals=4):
+    """WTON wei as a TON string, truncated to `decimals` without going through float"""
+    whole, fraction = divmod(amount, 10 ** WTON_DECIMALS)
+    return f"{whole}.{fraction // 10 ** (WTON_DECIMALS - decimals):0{decimals}d}"
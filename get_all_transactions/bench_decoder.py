@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import random
+import argparse
+from web3 import Web3
+from web3.datastructures import AttributeDict
+from hexbytes import HexBytes
+from eth_abi import encode
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.log_decoder import LogDecoder
+from common.event_store import EventStore, DEFAULT_EVENT_STORE_PATH
+
+import v1_get_all_events
+
+EVENT_NAMES = ["Deposited", "WithdrawalRequested", "WithdrawalProcessed"]
+
+
+def make_logs(w3, count):
+    """Synthetic DepositManager logs shaped like the ones returned by w3.eth.get_logs"""
+    topics = [w3.keccak(text=f"{name}(address,address,uint256)") for name in EVENT_NAMES]
+    depositors = [Web3.to_checksum_address(f"0x{random.getrandbits(160):040x}") for _ in range(500)]
+    logs = []
+    for i in range(count):
+        layer2 = random.choice(v1_get_all_events.LAYER2S)
+        logs.append(AttributeDict({
+            "address": v1_get_all_events.ADDRESS_DEPOSIT_MANAGER,
+            "blockNumber": 18417896 + i,
+            "blockHash": HexBytes(random.getrandbits(256).to_bytes(32, "big")),
+            "logIndex": i % 7,
+            "transactionIndex": i % 11,
+            "transactionHash": HexBytes(random.getrandbits(256).to_bytes(32, "big")),
+            "topics": [random.choice(topics), HexBytes(bytes(12) + bytes.fromhex(layer2[2:]))],
+            "data": HexBytes(encode(["address", "uint256"], [random.choice(depositors), random.getrandbits(100)])),
+            "removed": False,
+        }))
+    return logs
+
+
+def load_logs(w3, limit):
+    store = EventStore(os.getenv("EVENT_STORE_PATH", DEFAULT_EVENT_STORE_PATH))
+    topics = [w3.keccak(text=f"{name}(address,address,uint256)") for name in EVENT_NAMES]
+    logs = []
+    for log in store.iter_logs(1, v1_get_all_events.ADDRESS_DEPOSIT_MANAGER, topic0s=topics):
+        logs.append(AttributeDict(log))
+        if len(logs) >= limit:
+            break
+    store.close()
+    return logs
+
+
+def bench(name, func, logs):
+    start = time.perf_counter()
+    results = [func(log) for log in logs]
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {elapsed:8.3f} s  {len(logs) / elapsed:>12,.0f} logs/s")
+    return results, elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare LogDecoder with web3's process_log")
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--from-store", action="store_true", help="decode logs from the local event store instead of synthetic ones")
+    args = parser.parse_args()
+
+    w3 = Web3()
+    abi = v1_get_all_events.get_compiled_contract(v1_get_all_events.PATH_DEPOSIT_MANAGER)["abi"]
+    instance = w3.eth.contract(address=v1_get_all_events.ADDRESS_DEPOSIT_MANAGER, abi=abi)
+
+    logs = load_logs(w3, args.count) if args.from_store else make_logs(w3, args.count)
+    print(f"📊 Decoding {len(logs):,} logs")
+
+    event_by_topic = {w3.keccak(text=f"{name}(address,address,uint256)"): name for name in EVENT_NAMES}
+
+    def process_log(log):
+        return instance.events[event_by_topic[log["topics"][0]]]().process_log(log)
+
+    decoder = LogDecoder(abi, EVENT_NAMES)
+
+    expected, slow = bench("web3 process_log", process_log, logs)
+    actual, fast = bench("LogDecoder.decode", decoder.decode, logs)
+
+    for a, b in zip(expected, actual):
+        assert a["event"] == b["event"] and dict(a["args"]) == b["args"], (a, b)
+    print(f"✅ Same results, {slow / fast:.1f}x faster")
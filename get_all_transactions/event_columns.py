@@ -0,0 +1,184 @@
+import csv
+import sys
+import time
+import argparse
+from decimal import Decimal
+
+try:
+    import numpy as np
+except ImportError as e:  # only this module needs numpy, the fetch and sync scripts do not
+    raise ImportError("event_columns.py needs numpy: pip install numpy") from e
+
+# 256-bit amounts are split into 8 unsigned 32-bit lanes, most significant first, held
+# in int64 so that sums over up to 2**31 rows (and signed net sums) cannot overflow
+LANES = 8
+LANE_BITS = 32
+
+# EventType values written by the exporters that move stake
+STAKE_IN = "Deposited"
+STAKE_OUT = "Unstaking"  # WithdrawalRequested
+
+
+def split_amounts(amounts):
+    """(n, LANES) int64 lanes of exact uint256 amounts"""
+    raw = b"".join(int(amount).to_bytes(LANES * LANE_BITS // 8, "big") for amount in amounts)
+    return np.frombuffer(raw, dtype=">u4").reshape(-1, LANES).astype(np.int64)
+
+
+def combine_lanes(lanes):
+    """Exact Python ints from (n, LANES) lane sums; carries between lanes are resolved by Python ints"""
+    values = np.zeros(len(lanes), dtype=object)
+    for k in range(LANES):
+        values = (values << LANE_BITS) + lanes[:, k].astype(object)
+    return values
+
+
+def encode(values):
+    """Dictionary encoding: (sorted categories, int32 codes)"""
+    categories, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    return categories, codes.astype(np.int32)
+
+
+def to_wton(amount):
+    return Decimal(amount) / Decimal('1e27')
+
+
+class EventColumns:
+    """
+    Columnar form of the v0/v1 event CSVs (logs_events/*.csv).
+
+    Layer2Address, Depositor and EventType are dictionary encoded (`*_categories`
+    plus int32 `*_codes`), Amount is kept exact as `amount_lanes`. Group-bys sum
+    the lanes per group with numpy and only turn the group totals back into ints.
+    """
+
+    def __init__(self, rows):
+        block_numbers, timestamps, tx_hashes, event_types, layer2_names, layer2s, depositors, amounts = [], [], [], [], [], [], [], []
+        for row in rows:
+            block_numbers.append(int(row["BlockNumber"]))
+            timestamps.append(row["Timestamp"].replace(" ", "T"))
+            tx_hashes.append(row["TxHash"])
+            event_types.append(row["EventType"])
+            layer2_names.append(row["Layer2Name"])
+            layer2s.append(row["Layer2Address"])
+            depositors.append(row["Depositor"])
+            amounts.append(row["Amount"])
+
+        self.block_number = np.array(block_numbers, dtype=np.int64)
+        self.timestamp = np.array(timestamps, dtype="datetime64[s]")
+        self.tx_hash = np.array(tx_hashes, dtype=str)
+        self.event_type_categories, self.event_type_codes = encode(event_types)
+        self.layer2_categories, self.layer2_codes = encode(layer2s)
+        self.depositor_categories, self.depositor_codes = encode(depositors)
+        self.amount_lanes = split_amounts(amounts) if amounts else np.zeros((0, LANES), dtype=np.int64)
+
+        # Layer2Name of every layer2 category
+        names = dict(zip(layer2s, layer2_names))
+        self.layer2_names = np.array([names[layer2] for layer2 in self.layer2_categories], dtype=str)
+
+    @classmethod
+    def load(cls, *paths):
+        """Load and concatenate CSV files written by v0/v1_get_all_events.py or sync_events.py"""
+        rows = []
+        for path in paths:
+            with open(path, newline='', encoding='utf-8') as f:
+                rows.extend(csv.DictReader(f))
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.block_number)
+
+    def event_type_mask(self, *event_types):
+        codes = np.flatnonzero(np.isin(self.event_type_categories, event_types))
+        return np.isin(self.event_type_codes, codes)
+
+    def block_mask(self, from_block=None, to_block=None):
+        mask = np.ones(len(self), dtype=bool)
+        if from_block is not None:
+            mask &= self.block_number >= from_block
+        if to_block is not None:
+            mask &= self.block_number <= to_block
+        return mask
+
+    def _group(self, key):
+        if key == "layer2":
+            return self.layer2_categories, self.layer2_codes
+        if key == "depositor":
+            return self.depositor_categories, self.depositor_codes
+        if key == "event_type":
+            return self.event_type_categories, self.event_type_codes
+        raise ValueError(f"Unknown group key: {key}")
+
+    def sum_by(self, key, mask=None, signs=None):
+        """
+        {category: exact int} of Amount summed per layer2, depositor or event_type.
+
+        `mask` selects rows, `signs` (+1/-1/0 per row) turns the sum into a net amount.
+        """
+        categories, codes = self._group(key)
+        lanes = self.amount_lanes
+        if signs is not None:
+            lanes = lanes * signs[:, None]
+        if mask is not None:
+            codes, lanes = codes[mask], lanes[mask]
+
+        sums = np.zeros((len(categories), LANES), dtype=np.int64)
+        np.add.at(sums, codes, lanes)
+        present = np.bincount(codes, minlength=len(categories)) > 0
+        return dict(zip(categories[present].tolist(), combine_lanes(sums[present]).tolist()))
+
+    def stake_signs(self):
+        """+1 for Deposited, -1 for Unstaking (WithdrawalRequested), 0 for Withdrawal"""
+        return self.event_type_mask(STAKE_IN).astype(np.int64) - self.event_type_mask(STAKE_OUT).astype(np.int64)
+
+    def net_stake_by(self, key, to_block=None):
+        """Deposited - WithdrawalRequested amounts per layer2 or depositor, up to to_block"""
+        mask = self.block_mask(to_block=to_block) if to_block is not None else None
+        return self.sum_by(key, mask, self.stake_signs())
+
+
+def net_stake_loop(paths, key):
+    """Row by row reference of EventColumns.net_stake_by, used by --check"""
+    column = {"layer2": "Layer2Address", "depositor": "Depositor"}[key]
+    totals = {}
+    for path in paths:
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                sign = {STAKE_IN: 1, STAKE_OUT: -1}.get(row["EventType"], 0)
+                totals[row[column]] = totals.get(row[column], 0) + sign * int(row["Amount"])
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Net stake per layer2 / depositor from logs_events CSVs")
+    parser.add_argument("paths", nargs="+", help="e.g. logs_events/*.csv")
+    parser.add_argument("--top", type=int, default=20, help="number of depositors to print")
+    parser.add_argument("--to-block", type=int, help="only events up to this block")
+    parser.add_argument("--check", action="store_true", help="compare with a row by row loop over the CSVs")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    events = EventColumns.load(*args.paths)
+    loaded = time.perf_counter()
+    print(f"📊 Loaded {len(events):,} events, {len(events.layer2_categories)} layer2s, {len(events.depositor_categories):,} depositors in {(loaded - start) * 1000:.1f} ms")
+
+    by_layer2 = events.net_stake_by("layer2", args.to_block)
+    by_depositor = events.net_stake_by("depositor", args.to_block)
+    print(f"⚡ Group-bys: {(time.perf_counter() - loaded) * 1000:.1f} ms")
+
+    names = dict(zip(events.layer2_categories, events.layer2_names))
+    print(f"\n🏦 Net stake per layer2 (WTON):")
+    for layer2, amount in sorted(by_layer2.items(), key=lambda item: -item[1]):
+        print(f"   {names[layer2]:<15} {layer2} {to_wton(amount):>40}")
+
+    print(f"\n👤 Top {args.top} depositors by net stake (WTON):")
+    for depositor, amount in sorted(by_depositor.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"   {depositor} {to_wton(amount):>40}")
+
+    if args.check:
+        if args.to_block is not None:
+            sys.exit("--check compares full files, drop --to-block")
+        for key, result in (("layer2", by_layer2), ("depositor", by_depositor)):
+            expected = net_stake_loop(args.paths, key)
+            assert expected == result, f"{key} totals differ"
+        print(f"\n✅ Same totals as the row by row loop")
@@ -0,0 +1,150 @@
+import csv
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+
+from common import profiler
+from common.log_fetcher import fetch_logs
+
+CSV_HEADER = ['BlockNumber', 'Timestamp', 'TxHash', 'EventType', 'Layer2Name', 'Layer2Address', 'Depositor', 'Amount', 'AmountWTON']
+
+
+def fetched_chunks(chunks, from_block, to_block):
+    """Logs of each fetched chunk (from fetch_logs), with progress; failed chunks are reported and skipped"""
+    total_blocks = to_block - from_block + 1
+    for chunk_idx, chunk in enumerate(profiler.timed(chunks, "fetch logs")):
+        progress = (chunk.end - from_block + 1) / total_blocks * 100
+        print(f"\n📦 Chunk {chunk_idx + 1}: blocks {chunk.start} ~ {chunk.end} ({progress:.1f}%)")
+
+        if chunk.error is not None:
+            print(f"   ❌ Chunk {chunk_idx + 1} query failed: {str(chunk.error)}")
+            continue
+
+        print(f"   ✅ Found {len(chunk.logs)} events")
+        yield chunk.logs
+
+
+def scan_events(w3, filter_params, from_block, to_block, planner, max_in_flight, decoder, event_types, layer2s, layer2s_names, block_index):
+    """
+    CSV rows of the logs matching filter_params in from_block ~ to_block, yielded chunk by chunk as the logs arrive.
+
+    Chunks start at planner.span blocks and are fetched up to max_in_flight at a
+    time but handed on in block order; the planner splits ranges the RPC
+    rejects and grows them again through sparse ranges. Each chunk is decoded
+    and given its block timestamps before the next one is read.
+    """
+    total_blocks = to_block - from_block + 1
+    print(f"📊 Total block range: {from_block} ~ {to_block} ({total_blocks:,} blocks)")
+    print(f"📦 Initial chunk size: {planner.span:,} blocks (adaptive)")
+    print(f"⚡ Chunks in flight: {max_in_flight}")
+    print(f"🔍 Starting multi-event search ({', '.join(event_types)})...")
+
+    chunks = fetch_logs(w3, filter_params, from_block, to_block, planner.span, max_in_flight, planner)
+    yield from decode_chunks(fetched_chunks(chunks, from_block, to_block), decoder, event_types, layer2s, layer2s_names, block_index)
+
+    print()
+    planner.print_report()
+
+
+def save_csv(row_chunks, csv_filename):
+    """Stream rows to the CSV file, flushed after every chunk; returns the number of rows written"""
+    print(f"📄 Writing CSV file: {csv_filename}")
+    total_events = write_csv(row_chunks, csv_filename)
+    print(f"📄 CSV file saved: {csv_filename}")
+    return total_events
+
+
+def batched(logs, size):
+    """Lists of up to `size` logs, for log sources that are not chunked already (e.g. EventStore.iter_logs)"""
+    logs = iter(logs)
+    while True:
+        batch = list(islice(logs, size))
+        if not batch:
+            return
+        yield batch
+
+
+def decode_chunks(chunks, decoder, event_types, layer2s, layer2s_names, block_index):
+    """
+    CSV rows of each chunk of logs, decoded and enriched with block timestamps.
+
+    Timestamps of a chunk are fetched in one go before its rows are built, so
+    only one chunk of logs and rows is held in memory at a time.
+    """
+    for logs in chunks:
+        block_numbers = set(log["blockNumber"] for log in logs)
+        try:
+            with profiler.stage("block timestamps"):
+                fetched = block_index.ensure(block_numbers)
+            if fetched:
+                print(f"   🕒 Block timestamps: {fetched} fetched, {len(block_numbers) - fetched} from local index")
+        except Exception as e:
+            print(f"   ⚠️ Failed to prefetch block timestamps: {e}")
+
+        with profiler.stage("decode"):
+            rows = decode_rows(logs, decoder, event_types, layer2s, layer2s_names, block_index)
+        yield rows
+
+
+def decode_rows(logs, decoder, event_types, layer2s, layer2s_names, block_index):
+    """CSV rows of one chunk of logs whose block timestamps are in the block index"""
+    rows = []
+    for log in logs:
+        tx_hash = log["transactionHash"].hex()
+        block_number = log["blockNumber"]
+        try:
+            block_timestamp = datetime.fromtimestamp(block_index.timestamp(block_number))
+        except Exception as e:
+            print(f"   ⚠️ Failed to get block {block_number} timestamp: {e}")
+            block_timestamp = datetime.now()  # fallback
+
+        decoded_log = decoder.decode(log)
+        if decoded_log is None:
+            print(f"   Block {block_number} | TX: {tx_hash[:10]}... | Unknown event type: {log['topics'][0].hex()}")
+            continue
+
+        event_type = event_types[decoded_log["event"]]
+        layer2 = decoded_log["args"]["layer2"]
+        depositor = decoded_log["args"]["depositor"]
+        amount = decoded_log["args"]["amount"]
+
+        # Convert to WTON (decimal 27 units)
+        wton_amount = Decimal(str(amount)) / Decimal('1e27')
+
+        rows.append((
+            block_number,
+            block_timestamp,
+            tx_hash,
+            event_type,
+            layer2s_names[layer2s.index(layer2)] if layer2 in layer2s else "Unknown",
+            layer2,
+            depositor,
+            str(amount),
+            str(wton_amount),
+        ))
+    return rows
+
+
+def write_csv(row_chunks, csv_filename, verbose=True):
+    """
+    Write rows to the CSV as each chunk arrives and flush after every chunk.
+
+    The file can be read while the scan is still running, and a failed run
+    keeps every chunk written before the failure. Returns the number of rows.
+    """
+    total_rows = 0
+    with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(CSV_HEADER)
+        csvfile.flush()
+
+        for rows in row_chunks:
+            with profiler.stage("write csv"):
+                writer.writerows(rows)
+                csvfile.flush()
+                total_rows += len(rows)
+
+                if verbose:
+                    for block_number, block_timestamp, tx_hash, event_type, _, _, depositor, amount, wton_amount in rows:
+                        print(f"   Block {block_number} | {block_timestamp} | TX: {tx_hash[:10]}... | Type: {event_type} | Depositor: {depositor[:10]}... | Amount: {amount} |  WTON: {wton_amount}")
+    return total_rows
@@ -0,0 +1,137 @@
+import os
+import sys
+import argparse
+from web3 import Web3, HTTPProvider
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.event_store import EventStore, DEFAULT_EVENT_STORE_PATH, sync
+from common.block_index import BlockIndex
+from common.rpc_batch import BatchRPC
+from common.rpc_pool import provider_from_env
+from common.log_decoder import LogDecoder
+
+from event_pipeline import batched, decode_chunks, write_csv
+
+import v0_get_all_events
+import v1_get_all_events
+
+# Load .env file
+load_dotenv()
+
+RPC_ENDPOINT = os.getenv("RPC_ENDPOINT_URL")
+EVENT_STORE_PATH = os.getenv("EVENT_STORE_PATH", DEFAULT_EVENT_STORE_PATH)
+
+BLOCK_CHUNK_SIZE = 9990
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "4"))
+RPC_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE", "100"))
+
+# Blocks behind head that are not synced yet, so the store never holds logs of reorged blocks
+CONFIRMATIONS = 12
+
+# DepositManager deployments: sync start (contract creation) and the default export range
+DEPLOYMENTS = {
+    "v0": {
+        "address": v0_get_all_events.ADDRESS_DEPOSIT_MANAGER,
+        "created_block": 10837675,
+        "export_from_block": 10837675,
+        "export_to_block": 18231453,  # simple staking patch block
+        "layer2s": v0_get_all_events.LAYER2S,
+        "layer2s_names": v0_get_all_events.LAYER2S_NAMES,
+    },
+    "v1": {
+        "address": v1_get_all_events.ADDRESS_DEPOSIT_MANAGER,
+        "created_block": 18416838,
+        "export_from_block": 18417896,  # first update seigniorage after the patch
+        "export_to_block": None,  # last synced block
+        "layer2s": v1_get_all_events.LAYER2S,
+        "layer2s_names": v1_get_all_events.LAYER2S_NAMES,
+    },
+}
+
+# Stored logs decoded and written per batch, so exports of any range use bounded memory
+EXPORT_BATCH_SIZE = 5000
+
+
+def sync_all(w3, store, to_block=None):
+    chain_id = w3.eth.chain_id
+    if to_block is None:
+        to_block = w3.eth.get_block("latest")["number"] - CONFIRMATIONS
+
+    for name, deployment in DEPLOYMENTS.items():
+        address = deployment["address"]
+        last_block = store.last_synced_block(chain_id, address)
+        print(f"\n📦 {name} DepositManager {address}")
+        print(f"   last synced block: {last_block}, syncing up to {to_block}")
+
+        planner = sync(w3, store, address, deployment["created_block"], to_block, BLOCK_CHUNK_SIZE, MAX_IN_FLIGHT, chain_id)
+        planner.print_report()
+        print(f"   stored logs: {store.count_logs(chain_id, address):,}")
+
+
+def export_csv(w3, store, name, from_block=None, to_block=None):
+    """Write the v0/v1 CSV for a block range from the local store"""
+    chain_id = w3.eth.chain_id
+    deployment = DEPLOYMENTS[name]
+    address = deployment["address"]
+    from_block = from_block or deployment["export_from_block"]
+    to_block = to_block or deployment["export_to_block"] or store.last_synced_block(chain_id, address)
+
+    missing = store.missing_ranges(chain_id, address, from_block, to_block)
+    if missing:
+        print(f"⚠️ Blocks not synced yet, run `sync` first: {missing}")
+        return None
+
+    event_types = v1_get_all_events.EVENT_TYPES
+    decoder = LogDecoder(v1_get_all_events.get_compiled_contract(v1_get_all_events.PATH_DEPOSIT_MANAGER)["abi"], event_types.keys())
+    logs = store.iter_logs(chain_id, address, from_block, to_block, topic0s=decoder.topics())
+
+    block_index = BlockIndex(w3, v1_get_all_events.BLOCK_INDEX_PATH, batch=BatchRPC(w3, RPC_BATCH_SIZE))
+    rows = decode_chunks(batched(logs, EXPORT_BATCH_SIZE), decoder, event_types, deployment["layer2s"], deployment["layer2s_names"], block_index)
+
+    csv_filename = f"{name}_{from_block}_{to_block}.csv"
+    try:
+        total_events = write_csv(rows, csv_filename, verbose=False)
+    finally:
+        block_index.save()
+
+    print(f"📄 CSV file saved: {csv_filename} ({total_events} events)")
+    return csv_filename
+
+
+def print_status(w3, store):
+    chain_id = w3.eth.chain_id
+    for name, deployment in DEPLOYMENTS.items():
+        address = deployment["address"]
+        print(f"📦 {name} DepositManager {address}")
+        print(f"   synced ranges: {store.synced_ranges(chain_id, address)}")
+        print(f"   stored logs: {store.count_logs(chain_id, address):,}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local DepositManager event store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="fetch blocks after the last synced one for both deployments")
+    sync_parser.add_argument("--to-block", type=int, help=f"default: latest - {CONFIRMATIONS}")
+
+    export_parser = subparsers.add_parser("export", help="write the v0/v1 CSV from the store")
+    export_parser.add_argument("deployment", choices=DEPLOYMENTS.keys())
+    export_parser.add_argument("--from-block", type=int)
+    export_parser.add_argument("--to-block", type=int)
+
+    subparsers.add_parser("status", help="show synced ranges")
+
+    args = parser.parse_args()
+
+    w3 = Web3(provider_from_env(RPC_ENDPOINT))
+    store = EventStore(EVENT_STORE_PATH)
+
+    if args.command == "sync":
+        sync_all(w3, store, args.to_block)
+    elif args.command == "export":
+        export_csv(w3, store, args.deployment, args.from_block, args.to_block)
+    else:
+        print_status(w3, store)
+
+    store.close()
@@ -3,12 +3,21 @@ import sys
 import time
 import pprint
 import os
-import csv
 from web3 import Web3, HTTPProvider
 from datetime import datetime
 import asyncio
+import argparse
 from dotenv import load_dotenv
-from decimal import Decimal
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.log_fetcher import RangePlanner
+from common.block_index import BlockIndex
+from common.rpc_batch import BatchRPC
+from common.log_decoder import LogDecoder
+from common import profiler
+from common.rpc_pool import provider_from_env
+
+from event_pipeline import scan_events, save_csv
 
 # Load .env file
 load_dotenv()
@@ -28,6 +37,22 @@ BLOCK_NUMBER_SNAPSHOT = 18231453 # simple staking patch block
 # Block chunk size setting (number of blocks to read at once)
 BLOCK_CHUNK_SIZE = 9990
 
+# Number of chunks requested from the RPC at the same time (1 = sequential)
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "4"))
+
+# Number of JSON-RPC calls sent in one batch request
+RPC_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE", "100"))
+
+# Local block number -> (timestamp, hash) index, shared by all scripts
+BLOCK_INDEX_PATH = os.getenv("BLOCK_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".block_index"))
+
+# DepositManager events and the EventType written for each
+EVENT_TYPES = {
+    "Deposited": "Deposited",
+    "WithdrawalRequested": "Unstaking",
+    "WithdrawalProcessed": "Withdrawal",
+}
+
 LAYER2S = [
     "0x42CCF0769e87CB2952634F607DF1C7d62e0bBC52",
     "0x39A13a796A3Cd9f480C28259230D2EF0a7026033",
@@ -67,145 +92,50 @@ def get_contract_instance(w3, path, address):
         address=checksum_address,
         abi=compiled["abi"])
     return instance
-
-def get_events(w3, from_block, to_block):
-    instance = get_contract_instance(w3, PATH_DEPOSIT_MANAGER, ADDRESS_DEPOSIT_MANAGER)
-    staking_signature_hash = w3.keccak(text="Deposited(address,address,uint256)").hex()
-    unstaking_signature_hash = w3.keccak(text="WithdrawalRequested(address,address,uint256)").hex()
-    withdraw_signature_hash = w3.keccak(text="WithdrawalProcessed(address,address,uint256)").hex()
-
-    total_blocks = to_block - from_block + 1
-    total_chunks = (total_blocks + BLOCK_CHUNK_SIZE - 1) // BLOCK_CHUNK_SIZE
-
-    print(f"📊 Total block range: {from_block} ~ {to_block} ({total_blocks:,} blocks)")
-    print(f"📦 Chunk size: {BLOCK_CHUNK_SIZE:,} blocks")
-    print(f"📦 Total chunks: {total_chunks}")
-    print(f"🔍 Starting multi-event search (Deposited, WithdrawalRequested, WithdrawalProcessed)...")
-
-    all_logs = []
-    transactions = []
-    total_events = 0
-
-    # Process blocks in chunks
-    for chunk_idx in range(total_chunks):
-        chunk_start = from_block + (chunk_idx * BLOCK_CHUNK_SIZE)
-        chunk_end = min(chunk_start + BLOCK_CHUNK_SIZE - 1, to_block)
-
-        print(f"\n📦 Chunk {chunk_idx + 1}/{total_chunks}: blocks {chunk_start} ~ {chunk_end}")
-
-        try:
-            logs = w3.eth.get_logs({
-                'fromBlock': chunk_start,
-                'toBlock': chunk_end,
-                'address': ADDRESS_DEPOSIT_MANAGER,
-                "topics": [[staking_signature_hash, unstaking_signature_hash, withdraw_signature_hash]]
-            })
-
-            print(f"   ✅ Found {len(logs)} events")
-            all_logs.extend(logs)
-            total_events += len(logs)
-
-        except Exception as e:
-            print(f"   ❌ Chunk {chunk_idx + 1} query failed: {str(e)}")
-            continue
-
-    print(f"\n✅ Total {total_events} events found")
-    print(f"📋 Event details:")
-
-
-    # Process each log directly to ensure all events are aggregated
-    for i, log in enumerate(all_logs, 1):
-        # Check event type by comparing the first topic (event signature hash)
-        event_signature = log["topics"][0].hex()
-        tx_hash = log["transactionHash"].hex()
-        block_number = log["blockNumber"]
-        # Get block timestamp
-        try:
-            block_info = w3.eth.get_block(block_number)
-            block_timestamp = datetime.fromtimestamp(block_info["timestamp"])
-        except Exception as e:
-            print(f"   ⚠️ Failed to get block {block_number} timestamp: {e}")
-            block_timestamp = datetime.now()  # fallback
-
-        # Determine event type and decode accordingly
-        if event_signature == staking_signature_hash or event_signature == unstaking_signature_hash or event_signature == withdraw_signature_hash:
-
-            if event_signature == staking_signature_hash:
-                # Deposited event
-                decoded_log = instance.events.Deposited().process_log(log)
-                event_type = "Deposited"
-
-            elif event_signature == unstaking_signature_hash:
-                # WithdrawalRequested event
-                decoded_log = instance.events.WithdrawalRequested().process_log(log)
-                event_type = "Unstaking"
-
-            else:
-                # WithdrawalProcessed event
-                decoded_log = instance.events.WithdrawalProcessed().process_log(log)
-                event_type = "Withdrawal"
-
-            layer2 = decoded_log["args"]["layer2"]
-            depositor = decoded_log["args"]["depositor"]
-            amount = decoded_log["args"]["amount"]
-
-            # Convert to WTON (decimal 27 units)
-            amount_decimal = Decimal(str(amount))
-            wton_amount = amount_decimal / Decimal('1e27')
-
-            transactions.append((
-                block_number,
-                block_timestamp,
-                tx_hash,
-                event_type,
-                LAYER2S_NAMES[LAYER2S.index(layer2)] if layer2 in LAYER2S else "Unknown",
-                layer2,
-                depositor,
-                amount,
-                wton_amount,
-            ))
-
-            print(f"[{i:3d}/{len(all_logs)}] Block {block_number} | {block_timestamp} | TX: {tx_hash[:10]}... | Type: {event_type} | Depositor: {depositor[:10]}... | Amount: {amount} |  WTON: {wton_amount}")
-
-        else:
-            print(f"[{i:3d}/{len(all_logs)}] Block {block_number} |({block_timestamp} | TX: {tx_hash[:10]}... | Unknown event type: {event_signature}")
-            continue
-
-    return transactions, total_events
+
+def get_events(w3, from_block, to_block, block_index):
+    """CSV rows of the DepositManager events in from_block ~ to_block, yielded chunk by chunk as the logs arrive"""
+    # topic0 -> decoder table for Deposited, WithdrawalRequested and WithdrawalProcessed
+    decoder = LogDecoder(get_compiled_contract(PATH_DEPOSIT_MANAGER)["abi"], EVENT_TYPES.keys())
+    filter_params = {
+        'address': ADDRESS_DEPOSIT_MANAGER,
+        "topics": [decoder.topics()]
+    }
+    planner = RangePlanner(BLOCK_CHUNK_SIZE)
+    return scan_events(w3, filter_params, from_block, to_block, planner, MAX_IN_FLIGHT, decoder, EVENT_TYPES, LAYER2S, LAYER2S_NAMES, block_index)
 
 
-def save_results_to_files(transactions):
-    """Save results to multiple file formats"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    # 1. Save to CSV file
-    csv_filename = f"v0_{BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED}_{BLOCK_NUMBER_SNAPSHOT}.csv"
-    with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['BlockNumber', 'Timestamp', 'TxHash', 'EventType', 'Layer2Name', 'Layer2Address', 'Depositor', 'Amount', 'AmountWTON'])
-
-        for block_number, block_timestamp, tx_hash, event_type, layer2_name, layer2_address, depositor, amount, wton_amount in transactions:
-            writer.writerow([block_number, block_timestamp, tx_hash, event_type, layer2_name, layer2_address, depositor, str(amount), str(wton_amount)])
-
-    print(f"📄 CSV file saved: {csv_filename}")
-
-    return csv_filename
+def save_results_to_files(row_chunks, from_block, to_block):
+    """Stream rows to the CSV file, flushed after every chunk"""
+    csv_filename = f"v0_{from_block}_{to_block}.csv"
+    return csv_filename, save_csv(row_chunks, csv_filename)
 
 
 def get_all_events():
-    w3 = Web3(HTTPProvider(RPC_ENDPOINT))
+    """Export the events to the CSV; returns the number of events written (the rows are in the CSV, not in memory)"""
+    w3 = profiler.install(Web3(provider_from_env(RPC_ENDPOINT)))
     # current_block_number = w3.eth.getBlock("latest")["number"]
-    transactions, total_events = get_events(w3, BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED, BLOCK_NUMBER_SNAPSHOT)
+    from_block, to_block = BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED, BLOCK_NUMBER_SNAPSHOT
 
-    # Save results to files
-    csv_filename = save_results_to_files(transactions)
+    # Fetch timestamps once per block, only for blocks not indexed by a previous run
+    block_index = BlockIndex(w3, BLOCK_INDEX_PATH, batch=BatchRPC(w3, RPC_BATCH_SIZE))
+    try:
+        csv_filename, total_events = save_results_to_files(get_events(w3, from_block, to_block, block_index), from_block, to_block)
+    finally:
+        block_index.save()
 
     print(f"\n🎉 Analysis completed!")
     print(f"📊 Total events processed: {total_events}")
     print(f"📄 Results saved to: {csv_filename}")
 
-    return transactions
+    return total_events
 
 if __name__ == '__main__':
-    transactions = get_all_events()
-    print(f"\n📋 Summary: {len(transactions)} total events processed")
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    profiler.add_arguments(parser)
+    args = parser.parse_args()
+    profiler.start(args)
+
+    total_events = get_all_events()
+    print(f"\n📋 Summary: {total_events} total events processed")
+    profiler.finish(args)
\ No newline at end of file
@@ -1,11 +1,19 @@
 import json
 import sys
-import time
-import pprint
-from web3 import Web3, WebsocketProvider
+import os
+import argparse
+from web3 import Web3
 from datetime import datetime
-import asyncio
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.rpc_batch import BatchRPC
+from common.log_decoder import LogDecoder
+from common.block_index import BlockIndex
+from common.rpc_pool import provider_from_env
+
+from staker_index import StakerIndex
+
+# HTTP URL; a websocket connection cannot serve MAX_IN_FLIGHT concurrent getLogs
 RPC_ENDPOINT = "INSERT YOUR URL"
 
 ADDRESS_DEPOSIT_MANAGER = "0x56E465f654393fa48f007Ed7346105c7195CEe43"
@@ -14,10 +22,22 @@ PATH_DEPOSIT_MANAGER = "DepositManager.json"
 BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED = 10837675
 BLOCK_NUMBER_EVENT_START = 12223496
 
+# Number of JSON-RPC calls sent in one batch request
+RPC_BATCH_SIZE = 100
+
+BLOCK_CHUNK_SIZE = 9990
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "4"))
+
+# Blocks behind head that are not indexed yet, so the index never holds deposits of reorged blocks
+CONFIRMATIONS = 12
+
+STAKER_INDEX_PATH = os.getenv("STAKER_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "stakers.sqlite"))
+BLOCK_INDEX_PATH = os.getenv("BLOCK_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".block_index"))
+
 def get_compiled_contract(file_path):
     with open(file_path, "r", encoding="utf-8") as f:
         return json.load(f)
-        
+
     return None
 
 def get_contract_instance(w3, path, address):
@@ -27,45 +47,54 @@ def get_contract_instance(w3, path, address):
         abi=compiled["abi"])
     return instance
 
-w3 = Web3(WebsocketProvider(RPC_ENDPOINT))
-instance = get_contract_instance(w3, PATH_DEPOSIT_MANAGER, ADDRESS_DEPOSIT_MANAGER)    
-event_signature_hash = w3.keccak(text="Deposited(address,address,uint256)").hex()
+def update_index(w3, index, to_block=None):
+    """Add the first deposits of the blocks after the last indexed one"""
+    if to_block is None:
+        to_block = w3.eth.get_block("latest")["number"] - CONFIRMATIONS
+    decoder = LogDecoder(get_compiled_contract(PATH_DEPOSIT_MANAGER)["abi"], ["Deposited"])
+    block_index = BlockIndex(w3, BLOCK_INDEX_PATH, batch=BatchRPC(w3, RPC_BATCH_SIZE))
+
+    print(f"🔄 Indexing blocks {(index.last_block() or BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED - 1) + 1} ~ {to_block}")
+    added = index.update(w3, decoder, BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED, to_block, BLOCK_CHUNK_SIZE, block_index, MAX_IN_FLIGHT)
+    print(f"✅ {added} new stakers, {len(index)} in the index up to block {index.last_block()}")
 
-def get_stakers(w3, from_block, to_block):
-    logs = w3.eth.getLogs({
-        'fromBlock': from_block,
-        'toBlock': to_block,
-        'address': ADDRESS_DEPOSIT_MANAGER,
-        "topics": [event_signature_hash]
-    })
+def parse_date(value):
+    return datetime.fromisoformat(value)
 
-    txs = list(map(lambda x: (x["blockNumber"], x["transactionHash"].hex()), logs))
+def print_stakers(stakers):
+    for staker in stakers:
+        date_time = datetime.fromtimestamp(staker["timestamp"])
+        print(f"{staker['depositor']}: {staker['block']}, {date_time}, {staker['layer2']}, {staker['tx_hash']}")
+    print(f"🎯 {len(stakers)} new stakers")
 
-    stakers = set([])
-    stakers_block = {}
 
-    for tx in txs:
-        receipt = w3.eth.getTransactionReceipt(tx[1])
-        
-        tmp = instance.events.Deposited().processReceipt(receipt)
-        depositor = tmp[0]["args"]["depositor"]
-        stakers.add(depositor)
-        if (depositor in stakers_block and stakers_block[depositor] > tx[0]) or depositor not in stakers_block:
-            stakers_block[depositor] = int(tx[0])
-    return (stakers, stakers_block)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stakers by the block of their first deposit")
+    subparsers = parser.add_subparsers(dest="command")
 
-original_stakers, original_stakers_blocks = get_stakers(w3, BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED, BLOCK_NUMBER_EVENT_START)
+    update_parser = subparsers.add_parser("update", help="index the deposits of the blocks after the last indexed one")
+    update_parser.add_argument("--to-block", type=int, help=f"default: latest - {CONFIRMATIONS}")
 
-current_block_number = w3.eth.getBlock("latest")["number"]
-new_stakers, new_stakers_block = get_stakers(w3, BLOCK_NUMBER_EVENT_START-1, current_block_number)
-new_stakers = new_stakers - original_stakers
+    query_parser = subparsers.add_parser("query", help="stakers first seen in a block or date range, from the index only")
+    query_parser.add_argument("--from-block", type=int)
+    query_parser.add_argument("--to-block", type=int, help="inclusive")
+    query_parser.add_argument("--from-date", type=parse_date, help="e.g. 2021-04-12 or 2021-04-12T09:00")
+    query_parser.add_argument("--to-date", type=parse_date, help="exclusive")
 
-new_stakers = sorted(new_stakers, key=lambda x: new_stakers_block[x])
+    args = parser.parse_args()
+    index = StakerIndex(STAKER_INDEX_PATH, ADDRESS_DEPOSIT_MANAGER)
 
-for new_staker in new_stakers:
-    block = w3.eth.getBlock(new_stakers_block[new_staker])
-    date_time = datetime.fromtimestamp(block["timestamp"])
-    print(f"{new_staker}: {new_stakers_block[new_staker]}, {date_time}")
+    if args.command == "query":
+        if args.from_date or args.to_date:
+            stakers = index.first_seen_between_dates(args.from_date or 0, args.to_date or datetime.now())
+        else:
+            stakers = index.first_seen_between_blocks(args.from_block or BLOCK_NUMBER_EVENT_START + 1, args.to_block or index.last_block() or 0)
+        print_stakers(stakers)
+    else:
+        # Default run: bring the index up to date, then list the stakers first seen after BLOCK_NUMBER_EVENT_START
+        w3 = Web3(provider_from_env(RPC_ENDPOINT))
+        update_index(w3, index, getattr(args, "to_block", None))
+        if args.command is None:
+            print_stakers(index.first_seen_between_blocks(BLOCK_NUMBER_EVENT_START + 1, index.last_block()))
 
-date_time = datetime.fromtimestamp(current_block_number)    
-print(f"current block: {current_block_number}, {date_time}")
\ No newline at end of file
+    index.close()
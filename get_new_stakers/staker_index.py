@@ -0,0 +1,108 @@
+import sqlite3
+from datetime import datetime
+
+from common.log_fetcher import fetch_logs, RangePlanner
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stakers (
+    depositor TEXT PRIMARY KEY,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    tx_hash TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    layer2 TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS stakers_by_block ON stakers (block_number);
+CREATE INDEX IF NOT EXISTS stakers_by_timestamp ON stakers (timestamp);
+
+CREATE TABLE IF NOT EXISTS progress (
+    address TEXT PRIMARY KEY,
+    last_block INTEGER NOT NULL
+);
+"""
+
+
+class StakerIndex:
+    """
+    depositor -> first Deposited (block, logIndex, tx, timestamp, layer2) of a DepositManager, in a SQLite file.
+
+    update() scans only the blocks after the last indexed one, so keeping the
+    index current costs a few getLogs per run. Queries by block or date range
+    are answered from the file without any RPC.
+    """
+
+    def __init__(self, path, address):
+        self.address = address
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM stakers").fetchone()[0]
+
+    def last_block(self):
+        row = self.conn.execute("SELECT last_block FROM progress WHERE address = ?", (self.address,)).fetchone()
+        return None if row is None else row[0]
+
+    def _add_chunk(self, first_seen, block_index, end):
+        """Store the first deposits of one fetched range and mark the range indexed, in one transaction"""
+        block_index.ensure(event["blockNumber"] for event in first_seen.values())
+        rows = [
+            (depositor, event["blockNumber"], event["logIndex"], event["transactionHash"].hex(),
+             block_index.timestamp(event["blockNumber"]), event["args"]["layer2"])
+            for depositor, event in first_seen.items()
+        ]
+        with self.conn:
+            # Ranges come in block order, so a depositor already in the index was seen earlier
+            self.conn.executemany("INSERT OR IGNORE INTO stakers VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.conn.execute("INSERT OR REPLACE INTO progress (address, last_block) VALUES (?, ?)", (self.address, end))
+
+    def update(self, w3, decoder, start_block, to_block, chunk_size, block_index, max_in_flight=1):
+        """Index the Deposited logs of last indexed block + 1 (or start_block) ~ to_block; returns the new stakers count"""
+        last_block = self.last_block()
+        from_block = start_block if last_block is None else last_block + 1
+        if from_block > to_block:
+            return 0
+
+        before = len(self)
+        filter_params = {"address": self.address, "topics": [decoder.topics()[0]]}
+        planner = RangePlanner(chunk_size)
+        for chunk in fetch_logs(w3, filter_params, from_block, to_block, chunk_size, max_in_flight, planner):
+            if chunk.error is not None:
+                # Later ranges are not stored, so the next update resumes from this one
+                print(f"   ❌ blocks {chunk.start} ~ {chunk.end} failed, stopping at block {chunk.start - 1}: {chunk.error}")
+                break
+
+            first_seen = {}
+            for log in chunk.logs:
+                event = decoder.decode(log)
+                first_seen.setdefault(event["args"]["depositor"], event)
+            self._add_chunk(first_seen, block_index, chunk.end)
+            if first_seen:
+                print(f"   ✅ blocks {chunk.start} ~ {chunk.end}: {len(chunk.logs)} deposits")
+        block_index.save()
+        return len(self) - before
+
+    def _query(self, column, start, end):
+        cursor = self.conn.execute(
+            "SELECT depositor, block_number, tx_hash, timestamp, layer2 FROM stakers"
+            f" WHERE {column} >= ? AND {column} < ? ORDER BY block_number, log_index",
+            (start, end),
+        )
+        return [
+            {"depositor": depositor, "block": block, "tx_hash": tx_hash, "timestamp": timestamp, "layer2": layer2}
+            for depositor, block, tx_hash, timestamp, layer2 in cursor
+        ]
+
+    def first_seen_between_blocks(self, from_block, to_block):
+        """Stakers whose first deposit is in from_block ~ to_block (inclusive), in order of appearance"""
+        return self._query("block_number", from_block, to_block + 1)
+
+    def first_seen_between_dates(self, start, end):
+        """Stakers whose first deposit is at or after `start` and before `end` (datetimes or unix timestamps)"""
+        start = int(start.timestamp()) if isinstance(start, datetime) else int(start)
+        end = int(end.timestamp()) if isinstance(end, datetime) else int(end)
+        return self._query("timestamp", start, end)
@@ -0,0 +1,314 @@
+import csv
+import heapq
+import os
+import sys
+import sqlite3
+import argparse
+from collections import defaultdict
+from web3 import Web3
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.event_store import EventStore, DEFAULT_EVENT_STORE_PATH, sync
+from common.rpc_batch import BatchRPC
+from common.rpc_pool import provider_from_env
+from common.log_decoder import LogDecoder
+from common.ledger import PRINCIPAL_EVENTS
+from common.multicall import multicall_blocks
+from common import profiler
+
+from reward_engine import DEPOSITED_ABI, COMITTED_ABI, COINAGES_ABI, DEFAULT_CACHE_PATH, BLOCKS_PER_ROUND
+
+# Load .env file
+load_dotenv()
+
+RPC_ENDPOINT = os.getenv("RPC_ENDPOINT_URL")
+EVENT_STORE_PATH = os.getenv("EVENT_STORE_PATH", DEFAULT_EVENT_STORE_PATH)
+CHAIN_ID = 1  # Ethereum mainnet
+
+ADDRESS_DEPOSIT_MANAGER = "0x56E465f654393fa48f007Ed7346105c7195CEe43"
+ADDRESS_SEIG_MANAGER = "0x710936500aC59e8551331871Cbad3D33d5e0D909"
+BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED = 10837675
+
+BLOCK_CHUNK_SIZE = 9990
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "4"))
+RPC_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE", "100"))
+
+# Blocks behind head that are not synced yet, so the store never holds logs of reorged blocks
+CONFIRMATIONS = 12
+
+RAY = 10 ** 27
+
+WITHDRAWAL_REQUESTED_ABI = dict(DEPOSITED_ABI, name="WithdrawalRequested")
+# AutoRefactorCoinageI.factor(), the getter SeigManager itself reads (`coinage.factor()` in the
+# source of get_all_stakers/SeigManager.json). It already includes the refactor doublings.
+FACTOR_ABI = {
+    "constant": True,
+    "inputs": [],
+    "name": "factor",
+    "outputs": [{"name": "", "type": "uint256"}],
+    "stateMutability": "view",
+    "type": "function",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS coinage_factors (
+    coinage TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    factor TEXT NOT NULL,
+    PRIMARY KEY (coinage, block)
+);
+
+CREATE TABLE IF NOT EXISTS coinages (
+    layer2 TEXT PRIMARY KEY,
+    coinage TEXT NOT NULL
+);
+"""
+
+
+class FactorIndex:
+    """
+    (coinage, block) -> factor() of AutoRefactorCoinage contracts, in a SQLite file,
+    with the coinage of every layer2 so reports need no RPC.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def coinages(self):
+        return dict(self.conn.execute("SELECT layer2, coinage FROM coinages"))
+
+    def put_coinages(self, coinages):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO coinages (layer2, coinage) VALUES (?, ?)", coinages.items())
+
+    def close(self):
+        self.conn.close()
+
+    def blocks(self, coinage):
+        return {row[0] for row in self.conn.execute("SELECT block FROM coinage_factors WHERE coinage = ?", (coinage,))}
+
+    def get(self, coinage, block):
+        row = self.conn.execute(
+            "SELECT factor FROM coinage_factors WHERE coinage = ? AND block = ?", (coinage, block)
+        ).fetchone()
+        # uint256 factors are stored as text
+        return None if row is None else int(row[0])
+
+    def put_many(self, factors):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO coinage_factors (coinage, block, factor) VALUES (?, ?, ?)",
+                [(coinage, block, str(factor)) for (coinage, block), factor in factors.items()],
+            )
+
+
+def apply_factor(balance, factor):
+    """Coinage balance of a RAY-based stored balance under `factor`, rounded like DSMath.rmul"""
+    return (balance * factor + RAY // 2) // RAY
+
+
+def rebase(amount, factor):
+    """RAY-based stored balance of a coinage balance of `amount` under `factor`, rounded like DSMath.rdiv"""
+    return (amount * RAY + factor // 2) // factor
+
+
+class CommitIndexer:
+    """
+    Per-commit seigniorage of every delegator, computed locally.
+
+    A coinage (AutoRefactorCoinage) balance is a stored amount scaled by the
+    coinage factor, and seigniorage is paid by raising the factor at each
+    Comitted block. So the factor is read once per commit block (plus
+    once before a coinage's first commit) and kept in a FactorIndex; the stored
+    amounts come from replaying the Deposited / WithdrawalRequested events of
+    the EventStore, which mint and burn coinage. Rewards at a commit are then
+    the balance of every delegator of the layer2 under the new factor minus
+    the balance under the previous one, with no per-account RPC.
+
+    The operator commission is minted by the commit itself without a
+    DepositManager event, so operator balances of layer2s that take a
+    commission are not covered.
+    """
+
+    def __init__(self, w3, store, factors, batch, deposit_manager=ADDRESS_DEPOSIT_MANAGER,
+                 seig_manager=ADDRESS_SEIG_MANAGER, chain_id=CHAIN_ID):
+        self.w3 = w3
+        self.store = store
+        self.factors = factors
+        self.batch = batch
+        self.chain_id = chain_id
+        self.deposit_manager = deposit_manager
+        self.seig_manager = w3.eth.contract(address=seig_manager, abi=[COINAGES_ABI])
+        self.deposits = LogDecoder([DEPOSITED_ABI, WITHDRAWAL_REQUESTED_ABI], PRINCIPAL_EVENTS.keys())
+        self.comitted = LogDecoder([COMITTED_ABI])
+        self.coinages = factors.coinages()
+
+    def missing_ranges(self, to_block):
+        missing = []
+        for address in (self.deposit_manager, self.seig_manager.address):
+            missing += self.store.missing_ranges(self.chain_id, address, BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED, to_block)
+        return missing
+
+    def commit_events(self, to_block):
+        logs = self.store.iter_logs(self.chain_id, self.seig_manager.address, 0, to_block, topic0s=self.comitted.topics())
+        return (self.comitted.decode(log) for log in logs)
+
+    def deposit_events(self, to_block):
+        logs = self.store.iter_logs(self.chain_id, self.deposit_manager, 0, to_block, topic0s=self.deposits.topics())
+        return (self.deposits.decode(log) for log in logs)
+
+    def resolve_coinages(self, layer2s):
+        missing = [layer2 for layer2 in layer2s if layer2 not in self.coinages]
+        if missing:
+            functions = [self.seig_manager.functions.coinages(layer2) for layer2 in missing]
+            resolved = dict(zip(missing, self.batch.call(functions)))
+            self.factors.put_coinages(resolved)
+            self.coinages.update(resolved)
+        return self.coinages
+
+    def factor_blocks(self, to_block):
+        """coinage -> blocks whose factor the replay needs: each commit, and the block before the first"""
+        commits = defaultdict(list)
+        for event in self.commit_events(to_block):
+            commits[event["args"]["layer2"]].append(event["blockNumber"])
+        coinages = self.resolve_coinages(sorted(commits))
+
+        # Layer2s without a commit yet pay no rewards and are left out
+        return {coinages[layer2]: {blocks[0] - 1, *blocks} for layer2, blocks in commits.items()}
+
+    def index_factors(self, to_block):
+        """Read and store the factor of every commit up to to_block that is not indexed yet"""
+        needed = defaultdict(list)
+        for coinage, blocks in self.factor_blocks(to_block).items():
+            for block in blocks - self.factors.blocks(coinage):
+                needed[block].append(coinage)
+        print(f"🔍 Factor states to read: {sum(len(c) for c in needed.values())} at {len(needed)} blocks")
+
+        blocks = sorted(needed)
+        for i in range(0, len(blocks), BLOCKS_PER_ROUND):
+            functions = {}
+            for block in blocks[i:i + BLOCKS_PER_ROUND]:
+                functions[block] = []
+                for coinage in needed[block]:
+                    instance = self.w3.eth.contract(address=coinage, abi=[FACTOR_ABI])
+                    functions[block].append(instance.functions.factor())
+            with profiler.stage("factor calls"):
+                values = multicall_blocks(self.w3, functions, self.batch)
+            factors = {}
+            for block in functions:
+                for coinage, factor in zip(needed[block], values[block]):
+                    factors[(coinage, block)] = factor
+            self.factors.put_many(factors)
+            print(f"   ✅ blocks {blocks[i]} ~ {blocks[min(i + BLOCKS_PER_ROUND, len(blocks)) - 1]}")
+
+    def rewards(self, from_block, to_block):
+        """Yield (block, layer2, depositor, reward) for every commit in from_block ~ to_block and delegator with a balance"""
+        blocks = self.factor_blocks(to_block)
+        coinages = {coinage: layer2 for layer2, coinage in self.coinages.items()}
+        state = {}  # layer2 -> factor of its coinage at the current point of the replay
+        for coinage, coinage_blocks in blocks.items():
+            missing = coinage_blocks - self.factors.blocks(coinage)
+            if missing:
+                raise ValueError(f"Factor of {coinage} at {len(missing)} blocks is not indexed, run `sync` first")
+            state[coinages[coinage]] = self.factors.get(coinage, min(coinage_blocks))
+
+        balances = defaultdict(dict)  # layer2 -> depositor -> RAY-based stored balance
+        events = heapq.merge(
+            self.deposit_events(to_block), self.commit_events(to_block),
+            key=lambda event: (event["blockNumber"], event["logIndex"]),
+        )
+        for event in events:
+            layer2 = event["args"]["layer2"]
+            if event["event"] == "Comitted":
+                block = event["blockNumber"]
+                before = state[layer2]
+                after = self.factors.get(self.coinages[layer2], block)
+                state[layer2] = after
+                if block < from_block:
+                    continue
+                for depositor, balance in balances[layer2].items():
+                    reward = apply_factor(balance, after) - apply_factor(balance, before)
+                    if reward:
+                        yield block, layer2, depositor, reward
+                continue
+
+            # DepositManager.deposit mints coinage, requestWithdrawal burns it. A layer2 without
+            # a commit up to to_block pays nothing, so its factor does not matter.
+            depositor = event["args"]["depositor"]
+            current = state.get(layer2, RAY)
+            balance = balances[layer2].get(depositor)
+            amount = apply_factor(balance, current) if balance else 0
+            amount += PRINCIPAL_EVENTS[event["event"]] * event["args"]["amount"]
+            balances[layer2][depositor] = rebase(max(amount, 0), current)
+
+
+def write_report(rows, path, per_commit):
+    totals = defaultdict(lambda: [0, 0])
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        if per_commit:
+            writer.writerow(["block", "layer2", "depositor", "reward"])
+        for block, layer2, depositor, reward in rows:
+            total = totals[(layer2, depositor)]
+            total[0] += reward
+            total[1] += 1
+            if per_commit:
+                writer.writerow([block, layer2, depositor, reward])
+        if not per_commit:
+            writer.writerow(["layer2", "depositor", "reward", "commits"])
+            for (layer2, depositor), (reward, commits) in sorted(totals.items(), key=lambda x: -x[1][0]):
+                writer.writerow([layer2, depositor, reward, commits])
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Per-commit staking rewards of every delegator from coinage factors")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="store DepositManager / SeigManager logs and read the factor of new commits")
+    sync_parser.add_argument("--to-block", type=int, help=f"default: latest - {CONFIRMATIONS}")
+
+    report_parser = subparsers.add_parser("report", help="write rewards from the store and the factor index, no RPC")
+    report_parser.add_argument("--from-block", type=int, default=BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED)
+    report_parser.add_argument("--to-block", type=int, help="default: last synced block")
+    report_parser.add_argument("--per-commit", action="store_true", help="one row per commit and delegator instead of totals")
+    report_parser.add_argument("--output", help="CSV file, default commit_rewards_<from>_<to>.csv")
+
+    for subparser in (sync_parser, report_parser):
+        subparser.add_argument("--factors", default=DEFAULT_CACHE_PATH, help="SQLite file of the factor index")
+        profiler.add_arguments(subparser)
+    args = parser.parse_args()
+    profiler.start(args)
+
+    w3 = Web3(provider_from_env(RPC_ENDPOINT))
+    profiler.install(w3)
+    store = EventStore(EVENT_STORE_PATH)
+    factors = FactorIndex(args.factors)
+    indexer = CommitIndexer(w3, store, factors, BatchRPC(w3, RPC_BATCH_SIZE))
+
+    if args.command == "sync":
+        to_block = args.to_block or w3.eth.block_number - CONFIRMATIONS
+        for address in (ADDRESS_DEPOSIT_MANAGER, ADDRESS_SEIG_MANAGER):
+            print(f"\n📦 {address}: syncing up to {to_block}")
+            planner = sync(w3, store, address, BLOCK_NUMBER_DEPOSIT_MANAGER_CREATED, to_block, BLOCK_CHUNK_SIZE, MAX_IN_FLIGHT, CHAIN_ID)
+            planner.print_report()
+        if indexer.missing_ranges(to_block):
+            print(f"⚠️ Blocks still missing from the store: {indexer.missing_ranges(to_block)}")
+        else:
+            indexer.index_factors(to_block)
+    else:
+        to_block = args.to_block or min(store.last_synced_block(CHAIN_ID, a) or 0 for a in (ADDRESS_DEPOSIT_MANAGER, ADDRESS_SEIG_MANAGER))
+        missing = indexer.missing_ranges(to_block)
+        if missing:
+            print(f"⚠️ Blocks not synced yet, run `sync` first: {missing}")
+        else:
+            output = args.output or f"commit_rewards_{args.from_block}_{to_block}.csv"
+            with profiler.stage("replay"):
+                totals = write_report(indexer.rewards(args.from_block, to_block), output, args.per_commit)
+            print(f"📄 Rewards of {len(totals)} delegators saved to {output}")
+
+    factors.close()
+    store.close()
+    profiler.finish(args)
@@ -1,84 +1,87 @@
-import json
-from web3 import Web3, HTTPProvider
+import csv
+import os
+import sys
+import argparse
+from web3 import Web3
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.rpc_batch import BatchRPC
+from common import profiler
+from common.rpc_pool import provider_from_env
+from reward_engine import RewardEngine, BalanceCache, DEFAULT_CACHE_PATH
 
 ADDRESS_DEPOSIT_MANAGER = "0x56E465f654393fa48f007Ed7346105c7195CEe43"
-PATH_DEPOSIT_MANAGER = "DepositManager.json"
-
 ADDRESS_SEIG_MANAGER = "0x710936500aC59e8551331871Cbad3D33d5e0D909"
-PATH_SEIG_MANAGER = "SeigManager.json"
-
-PATH_COINAGE = "AutoRefactorCoinage.json"
 
 rpc_url = "INSERT YOUR URL"
 
-def get_compiled_contract(file_path):
-    with open(file_path, "r", encoding="utf-8") as f:
-        return json.load(f)
-        
-    return None
-  
-def get_contract_instance(w3, path, address):
-    compiled = get_compiled_contract(path)
-    instance = w3.eth.contract(
-        address=address,
-        abi=compiled["abi"])
-    return instance
+# Number of JSON-RPC calls sent in one batch request
+RPC_BATCH_SIZE = 100
 
+w3 = Web3(provider_from_env(rpc_url))
+batch = BatchRPC(w3, RPC_BATCH_SIZE)
 
-w3 = Web3(HTTPProvider(rpc_url))
-instance_deposit_manager = get_contract_instance(w3, PATH_DEPOSIT_MANAGER, ADDRESS_DEPOSIT_MANAGER)
-instance_seig_manager = get_contract_instance(w3, PATH_SEIG_MANAGER, ADDRESS_SEIG_MANAGER)
 
-event_signature_hash_deposited = w3.keccak(text="Deposited(address,address,uint256)").hex()
-event_signature_hash_comitted = w3.keccak(text="Comitted(address)").hex()
+def get_engine(cache_path=DEFAULT_CACHE_PATH):
+    cache = BalanceCache(cache_path) if cache_path else None
+    return RewardEngine(w3, ADDRESS_DEPOSIT_MANAGER, ADDRESS_SEIG_MANAGER, batch, cache)
+
 
 def get_staked_tx(address, layer2, from_block, to_block):
-    logs = w3.eth.getLogs({
-        'fromBlock': from_block,
-        'toBlock': to_block,
-        'address': ADDRESS_DEPOSIT_MANAGER,
-        "topics": [event_signature_hash_deposited]
-    })
-
-    txs = list(map(lambda x: (x["blockNumber"], x["transactionHash"].hex()), logs))
-
-    staked_info = []
-    for tx in txs:
-        receipt = w3.eth.getTransactionReceipt(tx[1])
-        
-        tmp = instance_deposit_manager.events.Deposited().processReceipt(receipt)
-        depositor = tmp[0]["args"]["depositor"]
-        if depositor == address:
-            staked_info.append((tx[0], tx[1]))
-    
-    min_block = min([x[0] for x in staked_info])
-
-    logs = w3.eth.getLogs({
-        'fromBlock': min_block,
-        'address': ADDRESS_SEIG_MANAGER,
-        "topics": [event_signature_hash_comitted, "0x" + layer2[2:].zfill(64)]
-    })
-
-    blocks = list(map(lambda x: x["blockNumber"], logs))
-    blocks = sorted(blocks)
-
-    coinage_address = instance_seig_manager.functions.coinages(layer2).call()
-    instance_coinage = get_contract_instance(w3, PATH_COINAGE, coinage_address)
-
-    rewards = []
-    for block in blocks:
-        balance1 = instance_coinage.functions.balanceOf(address).call(block_identifier=block-1)
-        balance2 = instance_coinage.functions.balanceOf(address).call(block_identifier=block)
-        rewards.append((block, balance2 - balance1))
-
-    return rewards
+    """[(commit block, reward)] of one staker on one layer2"""
+    rewards = get_engine().rewards([(address, layer2)], int(from_block), int(to_block))
+    return next(iter(rewards.values()))
+
+
+def read_pairs(args):
+    pairs = [tuple(pair.split(":")) for pair in args.pair]
+    if args.pairs_file:
+        with open(args.pairs_file, "r", encoding="utf-8") as f:
+            pairs += [(row["staker"], row["layer2"]) for row in csv.DictReader(f)]
+    return pairs
+
+
+def write_rewards(path, rewards):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["staker", "layer2", "block", "reward"])
+        for (staker, layer2), history in rewards.items():
+            for block, reward in history:
+                writer.writerow([staker, layer2, block, reward])
+
 
 staker_address = ""
 layer2_address = ""
 from_block = "10837698"
 to_block = "12000000"
 
-rewards = get_staked_tx(staker_address, layer2_address, from_block, to_block)
-for reward in rewards:
-    print(f"block: {reward[0]}, reward: {reward[1]}")
-print(f"total reward: {sum([x[1] for x in rewards])}")
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pair", action="append", default=[], metavar="STAKER:LAYER2",
+                        help="staker and layer2 addresses; repeat for more pairs")
+    parser.add_argument("--pairs-file", help="CSV file with staker and layer2 columns")
+    parser.add_argument("--from-block", type=int, default=int(from_block))
+    parser.add_argument("--to-block", type=int, default=int(to_block), help="last block of the first-deposit scan")
+    parser.add_argument("--commits-to-block", type=int, help="last commit block (default: latest, as the first-deposit range only bounds deposits)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="SQLite balance cache ('' to disable)")
+    parser.add_argument("--output", help="write every reward to this CSV file")
+    profiler.add_arguments(parser)
+    args = parser.parse_args()
+    profiler.start(args)
+    profiler.install(w3)
+
+    pairs = read_pairs(args) or [(staker_address, layer2_address)]
+    engine = get_engine(args.cache)
+    rewards = engine.rewards(pairs, args.from_block, args.to_block, args.commits_to_block)
+
+    for (staker, layer2), history in rewards.items():
+        print(f"\n👤 {staker} on {layer2}")
+        for block, reward in history:
+            print(f"block: {block}, reward: {reward}")
+        print(f"total reward: {sum(reward for _, reward in history)}")
+    if engine.cache is not None:
+        print(f"\n💾 Balance cache: {engine.cache.hits} hits, {engine.cache.misses} misses")
+    if args.output:
+        write_rewards(args.output, rewards)
+        print(f"📄 Rewards saved to {args.output}")
+    profiler.finish(args)
@@ -0,0 +1,244 @@
+import os
+import sqlite3
+from collections import defaultdict
+
+from web3 import Web3
+
+from common.log_fetcher import fetch_logs, RangePlanner
+from common.log_decoder import LogDecoder
+from common.multicall import multicall_blocks
+from common import profiler
+
+# Only the ABI entries the engine uses, so no AutoRefactorCoinage.json is needed
+DEPOSITED_ABI = {
+    "anonymous": False,
+    "inputs": [
+        {"indexed": True, "name": "layer2", "type": "address"},
+        {"indexed": False, "name": "depositor", "type": "address"},
+        {"indexed": False, "name": "amount", "type": "uint256"},
+    ],
+    "name": "Deposited",
+    "type": "event",
+}
+COMITTED_ABI = {
+    "anonymous": False,
+    "inputs": [{"indexed": True, "name": "layer2", "type": "address"}],
+    "name": "Comitted",
+    "type": "event",
+}
+COINAGES_ABI = {
+    "constant": True,
+    "inputs": [{"name": "layer2", "type": "address"}],
+    "name": "coinages",
+    "outputs": [{"name": "", "type": "address"}],
+    "stateMutability": "view",
+    "type": "function",
+}
+BALANCE_OF_ABI = {
+    "constant": True,
+    "inputs": [{"name": "account", "type": "address"}],
+    "name": "balanceOf",
+    "outputs": [{"name": "", "type": "uint256"}],
+    "stateMutability": "view",
+    "type": "function",
+}
+
+BLOCK_CHUNK_SIZE = 50000
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "4"))
+
+# Commit blocks whose balance reads share one round of JSON-RPC batches (and one cache write)
+BLOCKS_PER_ROUND = 200
+
+# Cache keys looked up in one SELECT (3 bound parameters each, under SQLite's 999 limit)
+CACHE_KEYS_PER_QUERY = 300
+
+DEFAULT_CACHE_PATH = os.getenv("REWARD_CACHE_PATH", "rewards_cache.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS balances (
+    coinage TEXT NOT NULL,
+    account TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    balance TEXT NOT NULL,
+    PRIMARY KEY (coinage, account, block)
+)
+"""
+
+
+def address_topic(address):
+    return "0x" + address[2:].lower().zfill(64)
+
+
+class BalanceCache:
+    """
+    (coinage, account, block) -> coinage balanceOf, in a SQLite file.
+
+    A balance at a past block never changes, so every historical read is made
+    once; later runs over overlapping pairs or ranges only read what is new.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.conn.close()
+
+    def get_many(self, keys):
+        """Cached balances of the (coinage, account, block) keys, as a dict of the ones found"""
+        keys = list(keys)
+        found = {}
+        for i in range(0, len(keys), CACHE_KEYS_PER_QUERY):
+            chunk = keys[i:i + CACHE_KEYS_PER_QUERY]
+            cursor = self.conn.execute(
+                "SELECT coinage, account, block, balance FROM balances WHERE (coinage, account, block) IN"
+                f" (VALUES {', '.join(['(?, ?, ?)'] * len(chunk))})",
+                [value for key in chunk for value in key],
+            )
+            # balances are uint256, stored as text
+            for coinage, account, block, balance in cursor:
+                found[(coinage, account, block)] = int(balance)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, balances):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO balances (coinage, account, block, balance) VALUES (?, ?, ?, ?)",
+                [(coinage, account, block, str(balance)) for (coinage, account, block), balance in balances.items()],
+            )
+
+
+class RewardEngine:
+    """
+    Seigniorage rewards of many (staker, layer2) pairs.
+
+    The reward of a pair at a commit is the change of the staker's coinage
+    balance across the Comitted block of its layer2. Every pair is handled
+    together: one Deposited scan finds each staker's first deposit, one Comitted
+    scan gives the commit blocks of every layer2 (shared by all its stakers),
+    and the balances before and at each commit block are read with multicalls
+    grouped per block, all in shared JSON-RPC batches and through `cache`.
+    """
+
+    def __init__(self, w3, deposit_manager, seig_manager, batch, cache=None):
+        self.w3 = w3
+        self.deposit_manager = Web3.to_checksum_address(deposit_manager)
+        self.seig_manager = w3.eth.contract(address=Web3.to_checksum_address(seig_manager), abi=[COINAGES_ABI])
+        self.batch = batch
+        self.cache = cache
+        self.deposited = LogDecoder([DEPOSITED_ABI])
+        self.comitted = LogDecoder([COMITTED_ABI])
+        self.coinage_addresses = {}
+
+    def _scan(self, address, decoder, layer2s, from_block, to_block, stage):
+        filter_params = {
+            "address": address,
+            "topics": [decoder.topics()[0], [address_topic(layer2) for layer2 in layer2s]],
+        }
+        planner = RangePlanner(BLOCK_CHUNK_SIZE)
+        chunks = fetch_logs(self.w3, filter_params, from_block, to_block, BLOCK_CHUNK_SIZE, MAX_IN_FLIGHT, planner)
+        for chunk in profiler.timed(chunks, stage):
+            if chunk.error is not None:
+                raise chunk.error
+            for log in chunk.logs:
+                yield decoder.decode(log)
+
+    def first_deposits(self, pairs, from_block, to_block):
+        """(staker, layer2) -> block of the first Deposited of the pair in the range; pairs without one are left out"""
+        pairs = set(pairs)
+        first = {}
+        layer2s = sorted({layer2 for _, layer2 in pairs})
+        for event in self._scan(self.deposit_manager, self.deposited, layer2s, from_block, to_block, "fetch Deposited logs"):
+            pair = (event["args"]["depositor"], event["args"]["layer2"])
+            if pair in pairs and pair not in first:
+                first[pair] = event["blockNumber"]
+        return first
+
+    def commit_blocks(self, layer2s, from_block, to_block):
+        """layer2 -> sorted Comitted blocks of the layer2 in the range"""
+        blocks = defaultdict(set)
+        for event in self._scan(self.seig_manager.address, self.comitted, layer2s, from_block, to_block, "fetch Comitted logs"):
+            blocks[event["args"]["layer2"]].add(event["blockNumber"])
+        return {layer2: sorted(blocks[layer2]) for layer2 in layer2s}
+
+    def coinages(self, layer2s):
+        """layer2 -> its coinage (AutoRefactorCoinage) address, read once per layer2"""
+        missing = [layer2 for layer2 in layer2s if layer2 not in self.coinage_addresses]
+        if missing:
+            functions = [self.seig_manager.functions.coinages(layer2) for layer2 in missing]
+            self.coinage_addresses.update(zip(missing, self.batch.call(functions)))
+        return {layer2: self.coinage_addresses[layer2] for layer2 in layer2s}
+
+    def balances(self, keys):
+        """(coinage, account, block) -> balanceOf, from the cache or read in multicalls grouped per block"""
+        keys = list(dict.fromkeys(keys))
+        result = self.cache.get_many(keys) if self.cache is not None else {}
+        missing = [key for key in keys if key not in result]
+
+        by_block = defaultdict(list)
+        for key in missing:
+            by_block[key[2]].append(key)
+        blocks = sorted(by_block)
+        for i in range(0, len(blocks), BLOCKS_PER_ROUND):
+            round_keys = {block: by_block[block] for block in blocks[i:i + BLOCKS_PER_ROUND]}
+            functions = {
+                block: [
+                    self.w3.eth.contract(address=coinage, abi=[BALANCE_OF_ABI]).functions.balanceOf(account)
+                    for coinage, account, _ in block_keys
+                ]
+                for block, block_keys in round_keys.items()
+            }
+            with profiler.stage("balanceOf calls"):
+                values = multicall_blocks(self.w3, functions, self.batch)
+            read = {}
+            for block, block_keys in round_keys.items():
+                read.update(zip(block_keys, values[block]))
+            if self.cache is not None:
+                self.cache.put_many(read)
+            result.update(read)
+        return result
+
+    def rewards(self, pairs, from_block, to_block, commits_to_block=None):
+        """
+        (staker, layer2) -> [(commit block, reward)] for every commit after the first deposit of the pair.
+
+        First deposits are searched in from_block ~ to_block; commits are taken up to
+        commits_to_block, by default the latest block.
+        """
+        pairs = [(Web3.to_checksum_address(staker), Web3.to_checksum_address(layer2)) for staker, layer2 in pairs]
+        first = self.first_deposits(pairs, from_block, to_block)
+        print(f"✅ First deposits found for {len(first)} of {len(pairs)} pairs")
+
+        layer2s = sorted({layer2 for _, layer2 in first})
+        if not layer2s:
+            return {pair: [] for pair in pairs}
+        start = min(first.values())
+        if commits_to_block is None:
+            commits_to_block = self.w3.eth.block_number
+        commits = self.commit_blocks(layer2s, start, commits_to_block)
+        coinages = self.coinages(layer2s)
+        print(f"✅ {sum(len(blocks) for blocks in commits.values())} commits of {len(layer2s)} layer2s")
+
+        windows = {}
+        keys = []
+        for pair, first_block in first.items():
+            staker, layer2 = pair
+            coinage = coinages[layer2]
+            blocks = [block for block in commits[layer2] if block >= first_block]
+            windows[pair] = blocks
+            for block in blocks:
+                keys += [(coinage, staker, block - 1), (coinage, staker, block)]
+        balances = self.balances(keys)
+
+        rewards = {pair: [] for pair in pairs}
+        for (staker, layer2), blocks in windows.items():
+            coinage = coinages[layer2]
+            rewards[(staker, layer2)] = [
+                (block, balances[(coinage, staker, block)] - balances[(coinage, staker, block - 1)])
+                for block in blocks
+            ]
+        return rewards
@@ -0,0 +1,13 @@
+import os
+import sys
+
+# The scripts import `common` from the repository root and their siblings from their own directory
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def add_script_dir(name):
+    """Make the modules of a script directory (get_staking_rewards, ...) importable"""
+    path = os.path.join(ROOT, name)
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from common.block_index import BlockIndex
+
+GENESIS_TIME = 1600000000
+
+
+def timestamp_of(number):
+    # 12 s blocks with a skipped slot every 10 blocks, and two blocks sharing a timestamp
+    if number == 501:
+        number = 500
+    return GENESIS_TIME + 12 * number + 12 * (number // 10)
+
+
+class FakeEth:
+    def __init__(self, latest):
+        self.latest = latest
+        self.requested = []
+
+    def get_block(self, number):
+        if number == "latest":
+            number = self.latest
+        self.requested.append(number)
+        return {"number": number, "timestamp": timestamp_of(number), "hash": number.to_bytes(32, "big")}
+
+
+def brute_force(target, latest):
+    return next(n for n in range(latest + 1) if timestamp_of(n) >= target)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return BlockIndex(SimpleNamespace(eth=FakeEth(latest=1000)), str(tmp_path / "blocks"))
+
+
+def test_block_at_matches_linear_scan(index):
+    for target in (GENESIS_TIME, GENESIS_TIME + 1, timestamp_of(37), timestamp_of(37) + 1, timestamp_of(500), timestamp_of(1000)):
+        assert index.block_at(target) == brute_force(target, 1000)
+
+
+def test_block_at_accepts_datetimes(index):
+    when = datetime.fromtimestamp(timestamp_of(250) - 5, tz=timezone.utc)
+    assert index.block_at(when) == 250
+    assert index.block_before(when) == 249
+
+
+def test_block_at_after_latest_block_raises(index):
+    with pytest.raises(ValueError):
+        index.block_at(timestamp_of(1000) + 1)
+
+
+def test_indexed_blocks_narrow_the_search(index):
+    index.block_at(timestamp_of(600))
+    index.w3.eth.requested.clear()
+    # 600 and its neighbours are indexed now, so the answer needs no new reads
+    assert index.block_at(timestamp_of(600)) == 600
+    assert index.w3.eth.requested == []
+
+
+def test_index_survives_reload(index, tmp_path):
+    index.block_at(timestamp_of(123))
+    index.save()
+    reloaded = BlockIndex(SimpleNamespace(eth=FakeEth(latest=1000)), str(tmp_path / "blocks"))
+    assert len(reloaded) == len(index)
+    assert reloaded.get(123) == (timestamp_of(123), (123).to_bytes(32, "big"))
+    assert reloaded.block_at(timestamp_of(123)) == 123
+    assert reloaded.w3.eth.requested == []
@@ -0,0 +1,101 @@
+import pytest
+
+from common.checkpoint import Checkpoint, Reorg
+
+
+class Chain:
+    """Blocks by number; fork(n) replaces block n and everything after it"""
+
+    def __init__(self, length):
+        self.blocks = {}
+        self.version = 0
+        for number in range(length):
+            self.add(number)
+
+    def add(self, number):
+        parent = self.blocks[number - 1]["hash"] if number else "0x00"
+        self.blocks[number] = {"number": number, "hash": f"0x{self.version:02x}{number:062x}", "parentHash": parent}
+
+    def fork(self, number):
+        self.version += 1
+        for n in range(number, len(self.blocks)):
+            self.add(n)
+
+    def get_blocks(self, numbers):
+        return {number: self.blocks.get(number) for number in numbers}
+
+    def log(self, number):
+        return {"blockNumber": number, "blockHash": self.blocks[number]["hash"]}
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    return Checkpoint(str(tmp_path / "checkpoint.json"))
+
+
+def process(checkpoint, chain, from_block, to_block, log_blocks=()):
+    logs = [chain.log(n) for n in log_blocks]
+    blocks = checkpoint.check_range(chain.get_blocks, from_block, to_block, logs)
+    checkpoint.record(blocks[to_block], [blocks[log["blockNumber"]] for log in logs])
+
+
+def test_ranges_that_extend_the_chain_are_accepted(checkpoint, tmp_path):
+    chain = Chain(300)
+    checkpoint.start(99, chain.blocks[99]["hash"])
+    process(checkpoint, chain, 100, 149, [120, 120, 130])
+    process(checkpoint, chain, 150, 199)
+    assert [number for number, _ in checkpoint.blocks] == [99, 120, 130, 149, 199]
+
+    reloaded = Checkpoint(str(tmp_path / "checkpoint.json"))
+    assert list(reloaded.blocks) == list(checkpoint.blocks)
+
+
+def test_reorg_rewinds_to_the_newest_block_still_on_the_chain(checkpoint):
+    chain = Chain(300)
+    checkpoint.start(99, chain.blocks[99]["hash"])
+    process(checkpoint, chain, 100, 149, [120, 130])
+    chain.fork(125)
+
+    with pytest.raises(Reorg) as e:
+        checkpoint.check_range(chain.get_blocks, 150, 199, [])
+    assert e.value.number == 149
+    # 130 was replaced, 120 was not: only the blocks after 120 are processed again
+    assert checkpoint.rewind(chain.get_blocks) == 120
+    assert checkpoint.last_block == 120
+    process(checkpoint, chain, 121, 199, [130])
+    assert checkpoint.last_hash == chain.blocks[199]["hash"]
+
+
+def test_reorg_deeper_than_the_buffer_keeps_the_oldest_block(tmp_path):
+    chain = Chain(300)
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"), depth=3)
+    checkpoint.start(10, chain.blocks[10]["hash"])
+    for to_block in (20, 30, 40):
+        process(checkpoint, chain, checkpoint.last_block + 1, to_block)
+    chain.fork(15)
+    assert checkpoint.rewind(chain.get_blocks) == 20
+    # Without a hash the next range is accepted without a parent check
+    assert checkpoint.last_hash is None
+    process(checkpoint, chain, 21, 50)
+
+
+def test_logs_from_another_fork_are_retried(checkpoint):
+    chain = Chain(300)
+    checkpoint.start(99, chain.blocks[99]["hash"])
+    stale = chain.log(120)
+    chain.fork(110)
+    assert checkpoint.check_range(chain.get_blocks, 100, 149, [stale]) is None
+    assert checkpoint.last_block == 99
+
+
+def test_node_behind_is_retried(checkpoint):
+    chain = Chain(150)
+    checkpoint.start(99, chain.blocks[99]["hash"])
+    assert checkpoint.check_range(chain.get_blocks, 100, 199, []) is None
+
+
+def test_range_must_follow_the_checkpoint(checkpoint):
+    chain = Chain(300)
+    checkpoint.start(99, chain.blocks[99]["hash"])
+    with pytest.raises(ValueError):
+        checkpoint.check_range(chain.get_blocks, 101, 149, [])
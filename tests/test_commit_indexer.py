@@ -0,0 +1,82 @@
+from conftest import add_script_dir
+
+add_script_dir("get_staking_rewards")
+from commit_indexer import RAY, FactorIndex, apply_factor, rebase
+
+REFACTOR_BOUNDARY = 10 ** 28
+REFACTOR_DIVIDER = 2
+
+
+def rmul(x, y):
+    return (x * y + RAY // 2) // RAY
+
+
+def rdiv(x, y):
+    return (x * RAY + y // 2) // y
+
+
+class Coinage:
+    """AutoRefactorCoinage's balance math: (balance, refactoredCount) per account, _factor kept under REFACTOR_BOUNDARY"""
+
+    def __init__(self):
+        self._factor = RAY
+        self.refactor_count = 0
+        self.balances = {}
+
+    def factor(self):
+        return self._factor * REFACTOR_DIVIDER ** self.refactor_count
+
+    def set_factor(self, factor):
+        count = 0
+        while factor >= REFACTOR_BOUNDARY:
+            factor //= REFACTOR_DIVIDER
+            count += 1
+        self._factor, self.refactor_count = factor, count
+
+    def balance_of(self, account):
+        balance, refactored_count = self.balances.get(account, (0, 0))
+        return rmul(balance, self._factor) * REFACTOR_DIVIDER ** (self.refactor_count - refactored_count)
+
+    def mint(self, account, amount):
+        self.balances[account] = (rdiv(self.balance_of(account) + amount, self._factor), self.refactor_count)
+
+
+def test_apply_factor_matches_balance_of_across_refactors():
+    coinage = Coinage()
+    stored = {}
+    deposits = {"alice": 1500 * 10 ** 27, "bob": 3 * 10 ** 18 + 7, "carol": 12345678901234567890123}
+    factor = RAY
+    mints = 0
+    for step in range(40):
+        # Seigniorage of ~8% per commit crosses REFACTOR_BOUNDARY about every 30 commits
+        factor = factor * 108 // 100
+        coinage.set_factor(factor)
+        if step % 10 == 0:
+            mints += 1
+            for account, amount in deposits.items():
+                coinage.mint(account, amount)
+                stored[account] = rebase(apply_factor(stored.get(account, 0), coinage.factor()) + amount, coinage.factor())
+        # Each mint rounds the stored balance by up to one stored unit, worth factor / RAY wei
+        tolerance = mints * (coinage.factor() // RAY + 1)
+        for account in deposits:
+            assert abs(apply_factor(stored[account], coinage.factor()) - coinage.balance_of(account)) <= tolerance
+    assert coinage.refactor_count > 0
+
+
+def test_rebase_round_trip():
+    for factor in (RAY, RAY * 3 // 2, 9 * 10 ** 27 + 1, 7 * 10 ** 28):
+        for amount in (0, 1, 10 ** 18, 123456789 * 10 ** 27):
+            assert abs(apply_factor(rebase(amount, factor), factor) - amount) <= factor // RAY + 1
+
+
+def test_factor_index_keeps_uint256_factors(tmp_path):
+    index = FactorIndex(str(tmp_path / "factors.sqlite"))
+    factor = 2 ** 200 + 1
+    index.put_many({("0xcoinage", 100): factor, ("0xcoinage", 90): RAY})
+    index.put_coinages({"0xlayer2": "0xcoinage"})
+    assert index.get("0xcoinage", 100) == factor
+    assert index.get("0xcoinage", 90) == RAY
+    assert index.get("0xcoinage", 80) is None
+    assert index.blocks("0xcoinage") == {90, 100}
+    assert index.coinages() == {"0xlayer2": "0xcoinage"}
+    index.close()
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from common.ledger import StakeLedger
+
+
+def event(name, block, layer2, depositor, amount, log_index=0):
+    return {
+        "event": name,
+        "blockNumber": block,
+        "logIndex": log_index,
+        "args": {"layer2": layer2, "depositor": depositor, "amount": amount},
+    }
+
+
+def random_events(count, seed=1):
+    rng = random.Random(seed)
+    events = []
+    block = 1000
+    for i in range(count):
+        block += rng.choice([0, 1, 7, 40])
+        name = rng.choice(["Deposited", "Deposited", "WithdrawalRequested", "WithdrawalProcessed"])
+        events.append(event(name, block, rng.choice("AB"), rng.choice("xyz"), rng.randrange(1, 10 ** 30), i))
+    return events
+
+
+def expected_state(events, block_number):
+    """{(layer2, depositor): principal} summed straight from the events"""
+    state = {}
+    for e in events:
+        if e["blockNumber"] > block_number or e["event"] == "WithdrawalProcessed":
+            continue
+        key = (e["args"]["layer2"], e["args"]["depositor"])
+        sign = 1 if e["event"] == "Deposited" else -1
+        state[key] = state.get(key, 0) + sign * e["args"]["amount"]
+    return {key: amount for key, amount in state.items() if amount}
+
+
+def test_state_at_matches_replay_from_scratch_at_every_block():
+    events = random_events(300)
+    ledger = StakeLedger(checkpoint_every=100)
+    for e in events:
+        ledger.apply(e)
+    assert len(ledger.checkpoints) > 5
+
+    for block_number in range(events[0]["blockNumber"] - 1, events[-1]["blockNumber"] + 2):
+        expected = expected_state(events, block_number)
+        assert ledger.state_at(block_number) == expected
+        for (layer2, depositor) in ledger.accounts:
+            assert ledger.principal_at(layer2, depositor, block_number) == expected.get((layer2, depositor), 0)
+
+
+def test_checkpoints_never_split_a_block():
+    ledger = StakeLedger(checkpoint_every=10)
+    for i, block in enumerate([5, 20, 20, 20, 35]):
+        ledger.apply(event("Deposited", block, "A", "x", 1, i))
+    assert ledger.checkpoint_blocks == [5, 20]
+    assert ledger.state_at(20) == {("A", "x"): 4}
+    assert ledger.state_at(34) == {("A", "x"): 4}
+
+
+def test_stakers_at_sums_layer2s():
+    ledger = StakeLedger()
+    ledger.apply(event("Deposited", 1, "A", "x", 5))
+    ledger.apply(event("Deposited", 2, "B", "x", 7))
+    ledger.apply(event("WithdrawalRequested", 3, "A", "x", 5))
+    assert ledger.stakers_at(2) == {"x": 12}
+    assert ledger.stakers_at(3) == {"x": 7}
+    assert ledger.principal_at("A", "y", 3) == 0
+
+
+def test_events_out_of_order_are_rejected():
+    ledger = StakeLedger()
+    ledger.apply(event("Deposited", 10, "A", "x", 1))
+    with pytest.raises(ValueError):
+        ledger.apply(event("Deposited", 9, "A", "x", 1))
@@ -0,0 +1,102 @@
+import os
+import json
+import random
+
+import pytest
+from eth_abi import encode
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.datastructures import AttributeDict
+
+from conftest import ROOT
+from common.log_decoder import LogDecoder
+
+ABI_FILES = [
+    "get_all_transactions/DepositManager.json",
+    "get_all_stakers/SeigManager.json",
+    "get_all_stakers/StakeTONProxy.json",
+    "event_monitor_uniswap/NonfungiblePositionManager.json",
+]
+
+# Not in any of the ABIs: takes the eth_abi path for dynamic types
+DYNAMIC_EVENT = {
+    "anonymous": False,
+    "inputs": [
+        {"indexed": True, "name": "sender", "type": "address"},
+        {"indexed": False, "name": "memo", "type": "string"},
+        {"indexed": False, "name": "amounts", "type": "uint256[]"},
+        {"indexed": False, "name": "delta", "type": "int24"},
+    ],
+    "name": "Memo",
+    "type": "event",
+}
+
+
+def load_abi(path):
+    with open(os.path.join(ROOT, path), "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["abi"] if isinstance(data, dict) else data
+
+
+def random_value(rng, abi_type):
+    if abi_type == "address":
+        return Web3.to_checksum_address(f"0x{rng.getrandbits(160):040x}")
+    if abi_type == "bool":
+        return rng.random() < 0.5
+    if abi_type.startswith("uint") and not abi_type.endswith("[]"):
+        return rng.getrandbits(int(abi_type[4:] or 256))
+    if abi_type.startswith("int"):
+        bits = int(abi_type[3:] or 256)
+        return rng.getrandbits(bits) - 2 ** (bits - 1)
+    if abi_type.startswith("bytes"):
+        return rng.getrandbits(8 * int(abi_type[5:])).to_bytes(int(abi_type[5:]), "big")
+    if abi_type == "string":
+        return "staked " * rng.randrange(5)
+    if abi_type == "uint256[]":
+        return [rng.getrandbits(256) for _ in range(rng.randrange(4))]
+    raise ValueError(abi_type)
+
+
+def make_log(rng, event, number):
+    """A log of `event` with random arguments, shaped like the ones w3.eth.get_logs returns"""
+    inputs = event["inputs"]
+    indexed = [i for i in inputs if i.get("indexed")]
+    data = [i for i in inputs if not i.get("indexed")]
+    topics = [HexBytes(Web3.keccak(text=f"{event['name']}({','.join(i['type'] for i in inputs)})"))]
+    topics += [HexBytes(encode([i["type"]], [random_value(rng, i["type"])])) for i in indexed]
+    return AttributeDict({
+        "address": "0x56E465f654393fa48f007Ed7346105c7195CEe43",
+        "blockNumber": 18000000 + number,
+        "blockHash": HexBytes(rng.getrandbits(256).to_bytes(32, "big")),
+        "logIndex": number % 7,
+        "transactionIndex": number % 11,
+        "transactionHash": HexBytes(rng.getrandbits(256).to_bytes(32, "big")),
+        "topics": topics,
+        "data": HexBytes(encode([i["type"] for i in data], [random_value(rng, i["type"]) for i in data])),
+        "removed": False,
+    })
+
+
+@pytest.mark.parametrize("abi", [load_abi(path) for path in ABI_FILES] + [[DYNAMIC_EVENT]], ids=ABI_FILES + ["dynamic"])
+def test_decode_matches_process_log(abi):
+    rng = random.Random(1)
+    contract = Web3().eth.contract(abi=abi)
+    decoder = LogDecoder(abi)
+    for event in (entry for entry in abi if entry.get("type") == "event"):
+        for number in range(20):
+            log = make_log(rng, event, number)
+            expected = contract.events[event["name"]]().process_log(log)
+            actual = decoder.decode(log)
+            assert actual["event"] == expected["event"]
+            assert actual["args"] == dict(expected["args"])
+            for field in ("address", "blockNumber", "blockHash", "logIndex", "transactionIndex", "transactionHash"):
+                assert actual[field] == expected[field]
+
+
+def test_decode_skips_other_events():
+    abi = load_abi(ABI_FILES[0])
+    decoder = LogDecoder(abi, ["Deposited"])
+    withdrawal = next(entry for entry in abi if entry.get("name") == "WithdrawalRequested")
+    assert decoder.decode(make_log(random.Random(1), withdrawal, 0)) is None
+    assert decoder.decode({"topics": []}) is None
+    assert decoder.topics() == ["0x" + Web3.keccak(text="Deposited(address,address,uint256)").hex().removeprefix("0x")]
@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+
+import pytest
+
+from common.log_fetcher import RangePlanner, fetch_logs, fetch_range
+
+
+class FakeEth:
+    """eth_getLogs over one log per block, rejecting ranges wider than `limit` blocks"""
+
+    def __init__(self, limit, transient=0, broken=()):
+        self.limit = limit
+        self.transient = transient
+        self.broken = set(broken)
+        self.calls = []
+
+    def get_logs(self, params):
+        start, end = params["fromBlock"], params["toBlock"]
+        self.calls.append((start, end))
+        if self.transient:
+            self.transient -= 1
+            raise ValueError("429 Too Many Requests: rate limit")
+        if end - start + 1 > self.limit:
+            raise ValueError("query returned more than 10000 results")
+        if self.broken & set(range(start, end + 1)):
+            raise ValueError("execution reverted")
+        # Returned out of order; get_logs sorts them
+        return [{"blockNumber": n, "logIndex": 0} for n in range(end, start - 1, -1)]
+
+
+def blocks_of(chunks):
+    return [log["blockNumber"] for chunk in chunks for log in chunk.logs]
+
+
+def test_grow_doubles_quiet_ranges_up_to_max_span():
+    planner = RangePlanner(100, max_span=300, target_logs=10)
+    assert planner.grow(100, 4) == 200
+    assert planner.grow(200, 4) == 300
+    # Busy ranges keep the span
+    assert planner.grow(300, 5) == 300
+
+
+def test_shrink_halves_down_to_min_span():
+    planner = RangePlanner(100, min_span=30)
+    assert planner.shrink(100) == 50
+    assert planner.shrink(50) == 30
+    assert planner.splits == 2
+
+
+def test_fetch_range_bisects_ranges_the_provider_rejects():
+    w3 = SimpleNamespace(eth=FakeEth(limit=25))
+    # Every range is busy enough that the span is not grown back
+    planner = RangePlanner(100, target_logs=2)
+    chunks = list(fetch_range(w3, {}, 0, 199, planner))
+
+    assert blocks_of(chunks) == list(range(200))
+    assert all(chunk.end - chunk.start + 1 <= 25 for chunk in chunks)
+    assert [(c.start, c.end) for c in chunks] == sorted((c.start, c.end) for c in chunks)
+    assert planner.splits == 2  # 100 -> 50 -> 25
+    assert planner.missing == []
+
+
+def test_fetch_range_grows_after_quiet_ranges():
+    w3 = SimpleNamespace(eth=FakeEth(limit=1000))
+    planner = RangePlanner(10, max_span=40, target_logs=1000)
+    chunks = list(fetch_range(w3, {}, 0, 99, planner))
+
+    assert [(c.start, c.end) for c in chunks] == [(0, 9), (10, 29), (30, 69), (70, 99)]
+    assert blocks_of(chunks) == list(range(100))
+
+
+def test_unreadable_range_is_reported_missing():
+    w3 = SimpleNamespace(eth=FakeEth(limit=1000, broken={5}))
+    planner = RangePlanner(10, min_span=1)
+    chunks = list(fetch_range(w3, {}, 0, 19, planner))
+
+    failed = [chunk for chunk in chunks if chunk.logs is None]
+    assert [(c.start, c.end) for c in failed] == [(0, 9)]
+    assert planner.missing == [(0, 9, "execution reverted")]
+    assert blocks_of(c for c in chunks if c.logs is not None) == list(range(10, 20))
+
+
+def test_transient_errors_are_retried():
+    w3 = SimpleNamespace(eth=FakeEth(limit=1000, transient=2))
+    planner = RangePlanner(10, backoff=0)
+    assert [log["blockNumber"] for log in planner.get_logs(w3, {}, 0, 2)] == [0, 1, 2]
+    assert planner.retries == 2
+
+
+def test_retries_give_up_after_max_retries():
+    w3 = SimpleNamespace(eth=FakeEth(limit=1000, transient=10))
+    planner = RangePlanner(10, max_retries=2, backoff=0)
+    with pytest.raises(ValueError):
+        planner.get_logs(w3, {}, 0, 2)
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 4])
+def test_fetch_logs_yields_in_block_order(max_in_flight):
+    w3 = SimpleNamespace(eth=FakeEth(limit=30))
+    chunks = list(fetch_logs(w3, {}, 0, 499, 64, max_in_flight))
+    assert blocks_of(chunks) == list(range(500))
@@ -0,0 +1,116 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from common import slack_queue
+from common.slack_queue import RateLimited, SlackQueue
+
+
+class FakeSession:
+    """Answers posts from `statuses` (then 200, or 503 while `down`), rejecting any text containing "bad" with 400"""
+
+    def __init__(self, statuses=(), retry_after=None, down=False):
+        self.statuses = list(statuses)
+        self.down = down
+        self.retry_after = retry_after
+        self.texts = []
+
+    def post(self, url, json, timeout):
+        self.texts.append(json["text"])
+        if self.statuses:
+            status = self.statuses.pop(0)
+        else:
+            status = 503 if self.down else 400 if "bad" in json["text"] else 200
+        headers = {"Retry-After": self.retry_after} if self.retry_after is not None else {}
+
+        def raise_for_status():
+            if status >= 400:
+                raise RuntimeError(f"HTTP {status}")
+        return SimpleNamespace(status_code=status, headers=headers, text="invalid_payload", raise_for_status=raise_for_status)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Delays the worker asked for; it does not actually wait"""
+    delays = []
+    monkeypatch.setattr(slack_queue, "time", SimpleNamespace(sleep=delays.append, monotonic=time.monotonic))
+    return delays
+
+
+def spool(tmp_path, messages):
+    path = str(tmp_path / "slack_spool.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for message in messages:
+            f.write(json.dumps(message) + "\n")
+    return path
+
+
+@pytest.fixture
+def run(monkeypatch):
+    def run(path, session, drain=True, **kwargs):
+        """Deliver the spooled messages through `session` and stop the worker; drain=False stops it at once"""
+        monkeypatch.setattr(slack_queue.requests, "Session", lambda: session)
+        queue = SlackQueue("https://hooks.example/T0", path, **kwargs)
+        deadline = time.monotonic() + 5
+        while drain and len(queue) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        queue.close(timeout=5)
+        assert not queue.worker.is_alive()
+        return queue
+    return run
+
+
+def test_burst_goes_out_as_digests(tmp_path, sleeps, run):
+    messages = [f"event {i}" for i in range(slack_queue.MAX_DIGEST_MESSAGES + 5)]
+    session = FakeSession()
+    queue = run(spool(tmp_path, messages), session)
+    assert session.texts == ["\n".join(messages[:-5]), "\n".join(messages[-5:])]
+    assert queue.delivered == len(messages) and len(queue) == 0
+
+
+def test_digest_stays_under_the_size_limit(tmp_path, sleeps, run):
+    messages = ["x" * 1000 for _ in range(8)]
+    session = FakeSession()
+    run(spool(tmp_path, messages), session)
+    assert all(len(text) <= slack_queue.MAX_DIGEST_CHARS for text in session.texts)
+    assert "\n".join(session.texts).split("\n") == messages
+
+
+def test_rejected_digest_drops_only_the_bad_message(tmp_path, sleeps, run):
+    session = FakeSession()
+    queue = run(spool(tmp_path, ["a", "bad", "c", "d"]), session)
+    assert session.texts == ["a\nbad\nc\nd", "a", "bad", "c", "d"]
+    assert (queue.delivered, queue.dropped) == (3, 1)
+
+
+def test_rate_limit_waits_for_retry_after(tmp_path, sleeps, run):
+    session = FakeSession(statuses=[429], retry_after="7")
+    queue = run(spool(tmp_path, ["a"]), session)
+    assert session.texts == ["a", "a"]
+    assert 7.0 in sleeps
+    assert (queue.delivered, queue.failures) == (1, 1)
+
+
+def test_post_raises_rate_limited(sleeps):
+    queue = SlackQueue.__new__(SlackQueue)
+    queue.session = FakeSession(statuses=[429], retry_after="2.5")
+    queue.webhook_url, queue.timeout, queue.backoff = "https://hooks.example/T0", 10, 1.0
+    with pytest.raises(RateLimited) as e:
+        queue._post("a")
+    assert e.value.retry_after == 2.5
+
+
+def test_undelivered_messages_survive_a_restart(tmp_path, sleeps, run):
+    path = spool(tmp_path, ["a", "b"])
+    # Slack is down: close() gives up and leaves the messages in the spool
+    queue = run(path, FakeSession(down=True), drain=False)
+    assert queue.delivered == 0
+
+    session = FakeSession()
+    queue = run(path, session)
+    assert session.texts == ["a\nb"]
+    session = FakeSession()
+    run(path, session)
+    assert session.texts == []
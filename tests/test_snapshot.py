@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from conftest import add_script_dir
+
+add_script_dir("get_all_stakers")
+import snapshot
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "SNAPSHOT_CACHE_PATH", str(tmp_path / "snapshots"))
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    """Fake chain reads: stakeOf amounts in WTON wei and phase-1 vault balances in TON wei"""
+    reads = []
+    stakers = {"0xA": 10 ** 27 + 1, "0xB": 123456789012345678901234567890123}
+    phase1 = {"0xA": 3 * 10 ** 18 + 7, "0xC": 1}
+
+    def get_all_stakers(snapshot_block, w3, strict):
+        reads.append(("stakers", snapshot_block))
+        return sorted(stakers.items(), key=lambda x: -x[1]), None, None
+
+    def get_phase1_balances(block, w3):
+        reads.append(("phase1", block))
+        return dict(phase1)
+
+    monkeypatch.setattr(snapshot.get_all_stakers, "get_all_stakers", get_all_stakers)
+    monkeypatch.setattr(snapshot.get_phase1_stakers, "get_phase1_balances", get_phase1_balances)
+    return reads
+
+
+def test_sources_are_merged_as_exact_wton_integers(sources):
+    result = snapshot.take_snapshot(15000000)
+    assert result["sources"]["phase1"] == {"0xA": (3 * 10 ** 18 + 7) * 10 ** 9, "0xC": 10 ** 9}
+    assert result["total"] == {
+        "0xA": 10 ** 27 + 1 + (3 * 10 ** 18 + 7) * 10 ** 9,
+        "0xB": 123456789012345678901234567890123,
+        "0xC": 10 ** 9,
+    }
+    assert all(isinstance(amount, int) for amount in result["total"].values())
+
+
+def test_cached_snapshot_keeps_uint256_amounts(sources):
+    taken = snapshot.take_snapshot(15000000)
+    with open(snapshot.cache_path(15000000, snapshot.SOURCES), "r", encoding="utf-8") as f:
+        assert all(isinstance(amount, str) for amount in json.load(f)["total"].values())
+
+    cached = snapshot.take_snapshot(15000000)
+    assert cached == taken
+    assert sorted(sources) == [("phase1", 15000000), ("stakers", 15000000)]
+
+
+def test_cache_is_per_block_and_sources(sources):
+    snapshot.take_snapshot(15000000, ["stakers"])
+    snapshot.take_snapshot(15000001, ["stakers"])
+    snapshot.take_snapshot(15000000)
+    assert len(sources) == 4
+
+
+@pytest.mark.parametrize("amount, text", [
+    (0, "0.0000"),
+    (10 ** 27, "1.0000"),
+    (123456789 * 10 ** 23 - 1, "12345.6788"),
+    (2 ** 256 - 1, "115792089237316195423570985008687907853269984665640.5640"),
+])
+def test_format_wton_truncates_without_float(amount, text):
+    assert snapshot.format_wton(amount) == text